@@ -1,35 +1,47 @@
+import time
+
 from services.mongo import db
 
+# status -> (next status, guard on the application and documents to move on)
+ROUTES = {
+    "start": ("sales", lambda app_doc, docs: True),
+    "sales": ("verification", lambda app_doc, docs: app_doc.get("loan_amount") is not None),
+    "verification": ("underwriting", lambda app_doc, docs: docs.get("uploaded", False)),
+    "underwriting": ("sanction", lambda app_doc, docs: True),
+    "sanction": ("end", lambda app_doc, docs: True),
+}
+
 
 def route_next(session_id: str, message: str) -> str:
-    app_doc = db.applications.find_one({"sessionId": session_id}) or {}
+    # Only what the routes look at
+    app_doc = db.applications.find_one({"sessionId": session_id}, {"_id": 0, "status": 1, "loan_amount": 1}) or {}
     status = app_doc.get("status", "start")
-    docs = db.documents.find_one({"sessionId": session_id}) or {}
-    has_docs = docs.get("uploaded", False)
-    has_loan_data = app_doc.get("loan_amount") is not None
+    docs = db.documents.find_one({"sessionId": session_id}, {"_id": 0, "uploaded": 1}) or {}
+
+    if status not in ROUTES:
+        return "end"
+
+    target, guard = ROUTES[status]
+    if not guard(app_doc, docs):
+        return status
 
-    if status == "start":
-        db.applications.update_one(
+    if not app_doc:
+        # Brand new session: only the request whose upsert inserts the document starts it
+        existing = db.applications.find_one_and_update(
             {"sessionId": session_id},
-            {"$set": {"status": "sales"}},
+            {"$setOnInsert": {"status": target, "statusAt": time.time()}},
             upsert=True,
         )
-        return "sales"
-    elif status == "sales":
-        if has_loan_data:
-            db.applications.update_one({"sessionId": session_id}, {"$set": {"status": "verification"}})
-            return "verification"
-        return "sales"
-    elif status == "verification":
-        if has_docs:
-            db.applications.update_one({"sessionId": session_id}, {"$set": {"status": "underwriting"}})
-            return "underwriting"
-        return "verification"
-    elif status == "underwriting":
-        db.applications.update_one({"sessionId": session_id}, {"$set": {"status": "sanction"}})
-        return "sanction"
-    elif status == "sanction":
-        db.applications.update_one({"sessionId": session_id}, {"$set": {"status": "end"}})
-        return "end"
-    else:
-        return "end"
+        return target if existing is None else existing.get("status", target)
+
+    # One conditional update: only the request that still sees `status` moves it on
+    expected = [None, "start"] if status == "start" else [status]
+    moved = db.applications.find_one_and_update(
+        {"sessionId": session_id, "status": {"$in": expected}},
+        {"$set": {"status": target, "statusAt": time.time()}},
+    )
+    if moved is not None:
+        return target
+
+    # Lost the race: report wherever the winner left the session
+    return (db.applications.find_one({"sessionId": session_id}, {"_id": 0, "status": 1}) or {}).get("status", target)
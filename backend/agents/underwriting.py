@@ -1,22 +1,86 @@
-import joblib
 import os
-from services.mongo import db
+import numpy as np
 
-MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ml", "model.pkl")
+from services.model_registry import ModelRegistry
 
-try:
-    _model = joblib.load(MODEL_PATH)
-except Exception:
-    _model = None
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Versioned artifacts written by ml/train_model.py; MODEL_VERSION pins one,
+# otherwise the version named in MODEL_DIR/CURRENT is active and followed as it changes
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(BACKEND_DIR, "ml", "models"))
+MODEL_VERSION = os.getenv("MODEL_VERSION", "")
+# A version to shadow-score underwriting requests with ("latest": the newest published)
+MODEL_CANDIDATE = os.getenv("MODEL_CANDIDATE", "")
+# Seconds between checks for a new version; 0 loads once
+MODEL_POLL_S = float(os.getenv("MODEL_POLL_S", "10"))
+# Pickled sklearn forest, compiled on load; used when no artifact has been published
+MODEL_PATH = os.path.join(BACKEND_DIR, "ml", "model.pkl")
+
+
+def _load_pickle():
+    # joblib pulls in sklearn and scipy, which dominate the import time of the app;
+    # published artifacts are memory-mapped compiled forests and need neither
+    import joblib
+    from services.forest import CompiledForest
+
+    # Scoring goes through the compiled arrays; sklearn is only needed to build them
+    return CompiledForest(joblib.load(MODEL_PATH))
+
+
+# The model is loaded on first use (or ahead of it, by the app's warm-up thread)
+models = ModelRegistry(
+    MODEL_DIR,
+    fallback=_load_pickle,
+    pinned=MODEL_VERSION,
+    candidate=MODEL_CANDIDATE,
+    poll_s=MODEL_POLL_S,
+    shadow_workers=int(os.getenv("MODEL_SHADOW_WORKERS", "2")),
+)
+
+
+def compiled_forest():
+    """The active compiled model, loaded on first call; None if none is available."""
+    model = models.active()
+    return model.forest if model is not None else None
+
+
+def model_loaded() -> bool:
+    """Whether loading the model has been attempted in this process."""
+    return models.loaded()
+
+
+def model_info():
+    """Version and source of the active model; None until loaded or when it is missing."""
+    model = models.active() if models.loaded() else None
+    return model.info() if model is not None else None
+
+
+def score_approval(X, shadow=False):
+    """(approval probabilities, model version) for an (n, 3) array of [income, loan_amount, tenure] rows.
+
+    The whole array is scored in one pass by the active compiled forest. With
+    shadow=True the candidate model (if any) scores the same rows afterwards on a
+    background thread, for comparison. Returns (None, None) when no model is available.
+    """
+    proba, model = models.score(X, shadow=shadow)
+    return proba, (model.version if model is not None else None)
+
+
+def predict_approval_proba(X, shadow=False):
+    """Approval probability for an (n, 3) array of rows, or None when the model is not available."""
+    return score_approval(X, shadow=shadow)[0]
 
 
 def score_and_decide(session_id: str, inputs: dict):
+    # Imported here so batch scoring does not need a database connection
+    from services.mongo import db
+
     # inputs expected: income, loan_amount, tenure
     income = float(inputs.get("income", 0))
     loan_amount = float(inputs.get("loan_amount", 0))
     tenure = float(inputs.get("tenure", 12))
 
-    if _model is None:
+    prob, version = score_approval(np.array([[income, loan_amount, tenure]]), shadow=True)
+    if prob is None:
         # Fallback rule
         emi = loan_amount / max(tenure, 1)
         approved = emi < 0.4 * income
@@ -29,8 +93,7 @@ def score_and_decide(session_id: str, inputs: dict):
             "tenure": int(tenure),
         }
 
-    X = [[income, loan_amount, tenure]]
-    prob = float(_model.predict_proba(X)[0][1])
+    prob = float(prob[0])
     approved = prob >= 0.5
 
     decision = {
@@ -40,7 +103,42 @@ def score_and_decide(session_id: str, inputs: dict):
         "amount": loan_amount if approved else 0,
         "emi": round(loan_amount / max(tenure, 1), 2),
         "tenure": int(tenure),
+        "model_version": version,
     }
 
     db.decisions.update_one({"sessionId": session_id}, {"$set": decision}, upsert=True)
     return decision
+
+
+def score_and_decide_batch(rows: list):
+    # Same decision as score_and_decide for every row, scored in one vectorized pass.
+    # Nothing is persisted: batch rows are leads, not sessions.
+    income = np.array([float(r.get("income", 0)) for r in rows])
+    loan_amount = np.array([float(r.get("loan_amount", 0)) for r in rows])
+    tenure = np.array([float(r.get("tenure", 12)) for r in rows])
+    emi = loan_amount / np.maximum(tenure, 1)
+
+    prob, version = score_approval(np.column_stack([income, loan_amount, tenure]), shadow=True)
+    if prob is None:
+        approved = emi < 0.4 * income
+        confidence = np.full(len(rows), 0.5)
+        reason = "Fallback rule used"
+        model_fields = {}
+    else:
+        approved = prob >= 0.5
+        confidence = prob
+        reason = "Model-based underwriting"
+        model_fields = {"model_version": version}
+
+    return [
+        {
+            "approved": bool(approved[i]),
+            "confidence": float(confidence[i]),
+            "reason": reason,
+            "amount": float(loan_amount[i]) if approved[i] else 0,
+            "emi": round(float(emi[i]), 2),
+            "tenure": int(tenure[i]),
+            **model_fields,
+        }
+        for i in range(len(rows))
+    ]
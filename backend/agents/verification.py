@@ -2,7 +2,7 @@ from services.mongo import db
 
 
 def verify_kyc(session_id: str) -> str:
-    docs = db.documents.find_one({"sessionId": session_id}) or {}
+    docs = db.documents.find_one({"sessionId": session_id}, {"_id": 0, "uploaded": 1}) or {}
     if not docs.get("uploaded"):
         return ("Please upload the required documents: KYC Proof, Income Proof, and Bank Statements. "
                 "Once uploaded, I will verify them.")
@@ -2,43 +2,214 @@
 AI Loan Advisor - Multi-Agent Backend
 Master Agent orchestrates: Sales → Verification → Underwriting → Sanction
 """
+import atexit
+import functools
+import hmac
+import logging
 import os
+import re
 import sys
+import time
 import uuid
-import traceback
-from flask import Flask, request, jsonify, send_file
+import threading
+import contextvars
+from contextlib import contextmanager
+import numpy as np
+from flask import Flask, Request, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # Load environment
 load_dotenv()
 
+from agents.underwriting import compiled_forest, model_info, model_loaded, models, score_approval
+from services.workflow import Workflow
+from services.pdf_service import letter_cache, letter_template, render_sanction_letter
+from services.doc_store import DocumentStore, DocumentTooLarge
+from services.doc_inspect import DocumentInspector, document_kind
+from services.session_store import MAX_SESSIONS, SessionStore, apply_update, project
+from services.sqlite_store import SQLiteStore
+from services.mongo_setup import COLLECTIONS, LOG_COLLECTIONS, MongoConnector
+from services.metrics import InstrumentedDatabase, registry
+from services.credit_bureau import CreditScores, SimulatedBureau
+from services.journal import EventJournal, Write, apply_writes
+from services.decision_cache import DecisionCache, fingerprint
+from services.export import FORMATS as EXPORT_FORMATS, export_chunks, export_query, parse_time
+from services.offers import ANNUAL_RATE, MAX_TENURE, MIN_TENURE, offer_grid, offer_grid_json, repayment_schedules_json
+from services.tracing import Tracer, configure_logging, log_event, span
+
+# Log events go to stderr as JSON lines (LOG_LEVEL sets the level)
+configure_logging()
+
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-# ============ IN-MEMORY STORAGE (MongoDB fallback) ============
-class InMemoryDB:
-    def __init__(self):
-        self.applications = {}  # sessionId -> {status, loan_amount, tenure, income, ...}
-        self.documents = {}     # sessionId -> {uploaded: bool, filename: str}
-        self.decisions = {}     # sessionId -> {approved, confidence, reason, ...}
-        self.sanctions = {}     # sessionId -> {pdfId, ...}
+# ============ DOCUMENT STORE ============
+DOC_MAX_BYTES = int(float(os.getenv("DOC_MAX_MB", "10")) * 1024 * 1024)
+doc_store = DocumentStore(
+    os.getenv("DOC_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "documents")),
+    max_bytes=DOC_MAX_BYTES
+)
+
+class UploadRequest(Request):
+    """Streams files posted to /api/upload straight into the document store"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == "upload":
+            return doc_store.writer()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+# Uploads are inspected (type sniffing, PDF text, salary slip / KYC classification)
+# on a process pool; agents wait at most INSPECT_WAIT_S for a result still running
+doc_inspector = DocumentInspector(max_workers=int(os.getenv("INSPECT_WORKERS", "2")))
+atexit.register(doc_inspector.shutdown)
+INSPECT_WAIT_S = float(os.getenv("INSPECT_WAIT_S", "3"))
 
-db = InMemoryDB()
+app.request_class = UploadRequest
+# A body whose Content-Length is over the limit is refused before any of it is read;
+# the headroom is for the multipart framing and form fields around the file
+app.config["MAX_CONTENT_LENGTH"] = DOC_MAX_BYTES + 64 * 1024
 
-# Try MongoDB Atlas connection
+# ============ LOCAL STORAGE (MongoDB fallback) ============
+# sessionId -> applications {status, loan_amount, tenure, income, ...},
+# documents {uploaded, filename, digest, size, files, inspections},
+# decisions {approved, confidence, reason, ...}, sanctions {pdfId, issuedAt, decision}
+# "memory" is per process; "sqlite" is durable and shared by all workers on the box
+LOCAL_STORAGE = os.getenv("LOCAL_STORAGE", "memory")
+if LOCAL_STORAGE == "sqlite":
+    db = SQLiteStore(
+        os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sessions.db")),
+        COLLECTIONS,
+        logs=LOG_COLLECTIONS
+    )
+    journal_db = db
+else:
+    db = SessionStore(COLLECTIONS)
+    # Bounded like the session store; a larger JOURNAL_MAX_SESSIONS keeps the history
+    # (and the means to rebuild) of sessions the store has evicted
+    journal_db = SessionStore((), max_sessions=int(os.getenv("JOURNAL_MAX_SESSIONS", MAX_SESSIONS)), logs=LOG_COLLECTIONS)
+
+# MongoDB Atlas connects in the background, retrying with backoff; until it is up
+# reads are served from local storage and session writes get 503 (/api/ready
+# reports which), as nothing written locally would be seen once MongoDB is
 MONGO_URI = os.getenv("MONGO_URI", "")
-mongo_db = None
-if MONGO_URI:
+mongo = MongoConnector(MONGO_URI)
+
+@app.before_request
+def start_background():
+    """Fork the inspection workers, then start connecting to MongoDB.
+
+    Done by the entry point before it serves, and by a worker process before its
+    first request; a no-op once this process has both. Never at import: the
+    forked workers would outlive scripts that only import the app.
+    """
+    # The workers first, before the MongoDB, journal and warm-up threads exist
+    doc_inspector.start()
+    mongo.start()
+
+def writes_sessions(view):
+    """Answer 503 (retry shortly) while the configured MongoDB is still being connected"""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        if mongo.state == "connecting":
+            response = jsonify({"error": "Storage is not ready yet, please retry shortly", "mongo": mongo.status()})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        return view(*args, **kwargs)
+    return guarded
+
+# ============ METRICS (/api/metrics) AND TRACING ============
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Requests by route, method and status", ("route", "method", "status")
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "Requests being handled, by route", ("route",)
+)
+AGENT_SECONDS = registry.histogram(
+    "agent_duration_seconds", "Agent runs by workflow step (nested runs count in both)", ("agent", "step")
+)
+
+# Every request is traced: its span tree (agents, storage calls, PDF renders) is
+# logged with the "request" event. cProfile runs on a TRACE_PROFILE_SAMPLE fraction
+# of requests, and with TRACE_PROFILE_SLOW_MS on all of them to keep the slow ones;
+# profiles go to TRACE_PROFILE_DIR for pstats
+tracer = Tracer(
+    profile_sample=float(os.getenv("TRACE_PROFILE_SAMPLE", "0")),
+    profile_slow_ms=float(os.getenv("TRACE_PROFILE_SLOW_MS", "0")),
+    profile_dir=os.getenv("TRACE_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles")),
+    profile_keep=int(os.getenv("TRACE_PROFILE_KEEP", "200")),
+    spans_min_ms=float(os.getenv("TRACE_SPANS_MIN_MS", "0"))
+)
+# A caller's X-Request-ID is kept if it is safe to log and to put in a file name
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+@app.before_request
+def start_request():
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_id = request.headers.get("X-Request-ID", "")
+    if not REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    g.request_route = route
+    g.trace = tracer.start(request_id, route, method=request.method)
+    REQUESTS_IN_FLIGHT.inc(route=route)
+
+@app.after_request
+def record_response(response):
+    g.response_status = response.status_code
+    trace = g.get("trace")
+    if trace is not None:
+        response.headers["X-Request-ID"] = trace.request_id
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    # Runs even when the view raised, so the in-flight gauge never drifts
+    trace = g.pop("trace", None)
+    if trace is None:
+        return
+    route = g.pop("request_route")
+    status = g.pop("response_status", 500)
+    REQUESTS_IN_FLIGHT.dec(route=route)
+    duration_ms = tracer.finish(trace, status=status)
+    REQUEST_SECONDS.observe(duration_ms / 1000, route=route, method=request.method, status=status)
+
+@contextmanager
+def instrument_agent(step, agent):
+    start = time.perf_counter()
     try:
-        from pymongo import MongoClient
-        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        client.admin.command('ping')
-        mongo_db = client.ai_loan_advisor
-        print("✓ Connected to MongoDB Atlas")
-    except Exception as e:
-        print(f"⚠ MongoDB not available: {e}")
-        print("  Using in-memory storage instead")
+        with span(agent.__name__, step=step):
+            yield
+    finally:
+        AGENT_SECONDS.observe(time.perf_counter() - start, agent=agent.__name__, step=step)
+
+# ============ WARM-UP ============
+# The model (joblib, sklearn, scipy) and the letter template (ReportLab) load on
+# first use, keeping them out of import time. With WARMUP=background (the default)
+# they are loaded on a thread once the first response has gone out, so later
+# requests do not pay for them either; WARMUP=off leaves them to first use.
+WARMUP = os.getenv("WARMUP", "background")
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+def warm_up():
+    start = time.perf_counter()
+    compiled_forest()
+    letter_template()
+    log_event("warm_up_done", durationMs=round((time.perf_counter() - start) * 1000, 1))
+
+def start_warm_up():
+    global _warmup_pid
+    with _warmup_lock:
+        if _warmup_pid == os.getpid():
+            return
+        _warmup_pid = os.getpid()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.after_request
+def warm_up_after_first_response(response):
+    if WARMUP == "background" and _warmup_pid != os.getpid():
+        response.call_on_close(start_warm_up)
+    return response
 
 # ============ HELPER FUNCTIONS ============
 def strip_mongo_id(doc):
@@ -48,57 +219,416 @@ def strip_mongo_id(doc):
         del doc["_id"]
     return doc
 
+# Every storage call is timed per backend, collection and operation
+local_storage = InstrumentedDatabase(db, LOCAL_STORAGE)
+_mongo_storage = None
+
+def storage():
+    """The database in use: MongoDB, or the local session store"""
+    global _mongo_storage
+    database = mongo.database
+    if database is None:
+        return local_storage
+    if _mongo_storage is None or _mongo_storage.database is not database:
+        _mongo_storage = InstrumentedDatabase(database, "mongo")
+    return _mongo_storage
+
+def events_collection():
+    """Where the session journal's events are: MongoDB, or the local journal store"""
+    if mongo.database is None:
+        return journal_db.events
+    return storage().events
+
+def commit_writes(writes):
+    """Apply a journal batch; on SQLite its events go into the same transaction.
+
+    The local stores are written directly, as events_collection() is:
+    journal_commit_duration_seconds times the whole commit, where per-call
+    timing would cost more than the in-memory writes themselves.
+    """
+    if mongo.database is not None:
+        apply_writes(storage(), writes)
+    elif LOCAL_STORAGE == "sqlite":
+        db.apply_writes(writes, log="events")
+    else:
+        apply_writes(db, writes)
+
+def with_pending(docs, pending, projections):
+    """docs ({collection: document}) with every journal write in pending applied, in order.
+
+    pending is taken before the read, so all of it is applied: a write that
+    committed while storage was read may be missing from what was read. Its
+    $set is harmless to repeat; pushed values the document already holds are
+    not appended twice.
+    """
+    if not pending:
+        return docs
+    changed = set()
+    for write in pending:
+        if write.collection in docs:
+            doc = docs[write.collection]
+            if not doc:
+                doc = docs[write.collection] = {"sessionId": write.session_id}
+            update = write.update()
+            if "$push" in update:
+                update["$push"] = {
+                    key: {"$each": [v for v in values["$each"] if v not in (doc.get(key) or ())]}
+                    for key, values in update["$push"].items()
+                }
+            apply_update(doc, update)
+            changed.add(write.collection)
+    for name in changed:
+        docs[name] = project(docs[name], projections.get(name))
+    return docs
+
+def read_doc(collection, session_id, projection=None):
+    """Read one session's document (storage round trip), with this process's uncommitted writes to it"""
+    pending = session_journal.pending(session_id)
+    doc = strip_mongo_id(storage()[collection].find_one({"sessionId": session_id}, projection)) or {}
+    return with_pending({collection: doc}, pending, {collection: projection})[collection]
+
+def write_docs(session_id, changes, pushes=None, journal=True):
+    """$set fields on some of one session's documents ({collection: fields}), creating them if needed.
+
+    pushes ({collection: {field: [values]}}) are appended to array fields in the
+    same update. Through the journal, whose group commit writes them after the
+    response (async) or before it (sync); straight to storage with journal=False
+    or the journal off.
+    """
+    pushes = pushes or {}
+    writes = [
+        Write(session_id, c, changes.get(c, {}), event_type(c, changes.get(c, {})), push=pushes.get(c))
+        for c in [*changes, *(c for c in pushes if c not in changes)]
+    ]
+    if journal and session_journal.enabled:
+        session_journal.write(writes)
+        return
+    for write in writes:
+        storage()[write.collection].update_one({"sessionId": session_id}, write.update(), upsert=True)
+
+def write_doc(collection, session_id, data, push=None, journal=True):
+    """$set fields (and push, {field: [values]}) on one session's document, creating it if needed"""
+    write_docs(session_id, {collection: data}, {collection: push} if push else None, journal=journal)
+
+# ============ SESSION JOURNAL ============
+# The journal is the write path for session documents: every change is queued
+# with its event, and a group commit applies a batch of them (one transaction on
+# SQLite, one bulk write per collection on MongoDB) and appends their events, the
+# session's history and the source a session missing from storage is rebuilt
+# from. JOURNAL_DURABILITY "async" commits every JOURNAL_FLUSH_MS behind the
+# responses, "sync" makes each write wait for its commit (shared with concurrent
+# requests), "off" writes storage directly and keeps no journal. Status
+# compare-and-sets always wait: they commit with everything queued before them.
+# Only this process sees its uncommitted writes, so on storage other workers share
+# (SQLite, MongoDB) the default is "sync": a response is not sent before its
+# writes are readable by whichever worker gets the session's next request
+SHARED_STORAGE = LOCAL_STORAGE == "sqlite" or bool(MONGO_URI)
+session_journal = EventJournal(
+    commit_writes,
+    events_collection,
+    durability=os.getenv("JOURNAL_DURABILITY", "sync" if SHARED_STORAGE else "async"),
+    flush_interval_s=float(os.getenv("JOURNAL_FLUSH_MS", "100")) / 1000,
+    max_batch=int(os.getenv("JOURNAL_MAX_BATCH", "500")),
+    # Extracted document text can be recomputed and would dwarf everything else
+    exclude_fields=("inspectionText",)
+)
+atexit.register(session_journal.flush)
+
+def event_type(collection, fields):
+    """status, application, upload, inspection, decision or sanction"""
+    if collection == "applications":
+        return "status" if "status" in fields else "application"
+    if collection == "documents":
+        return "inspection" if any(key.startswith("inspections.") for key in fields) else "upload"
+    return collection.rstrip("s")
+
+def rebuild_session(session_id):
+    """Materialize a session that is missing from storage from its journal; {} if it has none"""
+    docs = session_journal.replay(session_id)
+    if "applications" not in docs:
+        # Nothing to rebuild: a session starts with its application
+        return {}
+    for collection, doc in docs.items():
+        fields = {k: v for k, v in doc.items() if k != "sessionId"}
+        write_doc(collection, session_id, fields, journal=False)
+    if docs:
+        log_event("session_rebuilt", sessionId=session_id, collections=sorted(docs))
+    return docs
+
+# ============ REQUEST SESSION (unit of work) ============
+class SessionContext:
+    """Unit of work for one session during one request.
+
+    The application, documents and decision are loaded once (a single aggregation
+    on MongoDB), reads are served from that snapshot, and set_* calls are staged as
+    pending $set changes that flush() hands to the journal together at the end.
+    """
+    # Fields no request step reads: extracted document text (kept for audits)
+    # and the decision snapshot that only letter rendering uses
+    PROJECTIONS = {
+        "documents": {"_id": 0, "inspectionText": 0},
+        "sanctions": {"_id": 0, "decision": 0}
+    }
+
+    def __init__(self, session_id, docs):
+        self.session_id = session_id
+        self.docs = docs
+        self.pending = {}
+
+    @classmethod
+    def load(cls, session_id):
+        with span("session.load"):
+            return cls._load(session_id)
+
+    @classmethod
+    def _load(cls, session_id):
+        docs = cls._read(session_id)
+        if not docs["applications"] and session_journal.enabled:
+            # Not in storage (evicted, or written elsewhere before a failover): rebuild
+            # it from the journal, if it has one
+            with span("session.rebuild"):
+                rebuilt = rebuild_session(session_id)
+            for name, doc in rebuilt.items():
+                docs[name] = project(doc, cls.PROJECTIONS.get(name))
+        return cls(session_id, docs)
+
+    @classmethod
+    def _read(cls, session_id):
+        pending = session_journal.pending(session_id)
+        if mongo.database is None:
+            docs = {
+                name: strip_mongo_id(storage()[name].find_one({"sessionId": session_id}, cls.PROJECTIONS.get(name))) or {}
+                for name in COLLECTIONS
+            }
+            return with_pending(docs, pending, cls.PROJECTIONS)
+
+        def match(name):
+            return [
+                {"$match": {"sessionId": session_id}},
+                {"$limit": 1},
+                {"$project": cls.PROJECTIONS.get(name, {"_id": 0})},
+                {"$set": {"_collection": name}}
+            ]
+
+        pipeline = match("applications")
+        for name in COLLECTIONS[1:]:
+            pipeline.append({"$unionWith": {"coll": name, "pipeline": match(name)}})
+
+        docs = {name: {} for name in COLLECTIONS}
+        for doc in storage().applications.aggregate(pipeline):
+            docs[doc.pop("_collection")] = doc
+        return with_pending(docs, pending, cls.PROJECTIONS)
+
+    def get(self, collection):
+        return dict(self.docs[collection])
+
+    def set(self, collection, data):
+        if not self.docs[collection]:
+            self.docs[collection] = {"sessionId": self.session_id}
+        self.docs[collection].update(data)
+        self.pending.setdefault(collection, {}).update(data)
+
+    def flush(self, exclude=()):
+        changes = {c: self.pending.pop(c) for c in list(self.pending) if c not in exclude}
+        if changes:
+            with span("session.flush"):
+                write_docs(self.session_id, changes)
+
+_current_session = contextvars.ContextVar("current_session", default=None)
+
+@contextmanager
+def session_context(session_id):
+    """Serve get_*/set_* for session_id from one snapshot; flush writes on success"""
+    context = SessionContext.load(session_id)
+    token = _current_session.set(context)
+    try:
+        yield context
+        context.flush()
+    finally:
+        _current_session.reset(token)
+
+def _active_context(session_id):
+    context = _current_session.get()
+    if context is not None and context.session_id == session_id:
+        return context
+    return None
+
+def get_session_doc(collection, session_id):
+    context = _active_context(session_id)
+    if context is not None:
+        return context.get(collection)
+    return read_doc(collection, session_id)
+
+def set_session_doc(collection, session_id, data):
+    context = _active_context(session_id)
+    if context is not None:
+        context.set(collection, data)
+    else:
+        write_doc(collection, session_id, data)
+
 def get_app(session_id):
-    if mongo_db is not None:
-        return strip_mongo_id(mongo_db.applications.find_one({"sessionId": session_id})) or {}
-    return db.applications.get(session_id, {})
+    return get_session_doc("applications", session_id)
 
 def set_app(session_id, data):
-    if mongo_db is not None:
-        mongo_db.applications.update_one(
-            {"sessionId": session_id},
-            {"$set": data},
-            upsert=True
-        )
-    else:
-        if session_id not in db.applications:
-            db.applications[session_id] = {"sessionId": session_id}
-        db.applications[session_id].update(data)
+    if "status" in data:
+        # Exports select sessions by when their status last changed: every status
+        # write outside the workflow (which stamps its own) comes through here
+        data = {"statusAt": time.time(), **data}
+    set_session_doc("applications", session_id, data)
 
 def get_docs(session_id):
-    if mongo_db is not None:
-        return strip_mongo_id(mongo_db.documents.find_one({"sessionId": session_id})) or {}
-    return db.documents.get(session_id, {})
+    return get_session_doc("documents", session_id)
 
 def set_docs(session_id, data):
-    if mongo_db is not None:
-        mongo_db.documents.update_one(
-            {"sessionId": session_id},
-            {"$set": data},
-            upsert=True
-        )
-    else:
-        if session_id not in db.documents:
-            db.documents[session_id] = {"sessionId": session_id}
-        db.documents[session_id].update(data)
+    set_session_doc("documents", session_id, data)
 
 def get_decision(session_id):
-    if mongo_db is not None:
-        return strip_mongo_id(mongo_db.decisions.find_one({"sessionId": session_id})) or {}
-    return db.decisions.get(session_id, {})
+    return get_session_doc("decisions", session_id)
 
 def set_decision(session_id, data):
-    if mongo_db is not None:
-        mongo_db.decisions.update_one(
-            {"sessionId": session_id},
-            {"$set": data},
-            upsert=True
-        )
+    set_session_doc("decisions", session_id, data)
+
+def set_sanction(session_id, data):
+    set_session_doc("sanctions", session_id, data)
+
+def find_sanction(pdf_id):
+    return strip_mongo_id(storage().sanctions.find_one(
+        {"pdfId": pdf_id},
+        {"_id": 0, "sessionId": 1, "pdfId": 1, "issuedAt": 1, "decision": 1}
+    )) or {}
+
+def record_inspection(session_id, digest, result):
+    """Write a finished inspection onto the session's documents record"""
+    # Runs on the inspector's callback thread, outside any request session. The
+    # text goes in its own field so request snapshots can project it away.
+    result = dict(result)
+    text = result.pop("text", "")
+    write_doc("documents", session_id, {
+        f"inspections.{digest}": result,
+        f"inspectionText.{digest}": text
+    })
+
+def inspect_upload(session_id, digest):
+    return doc_inspector.submit(
+        digest, doc_store.path(digest),
+        on_done=lambda digest, result: record_inspection(session_id, digest, result)
+    )
+
+def document_kinds(session_id, docs):
+    """Kinds of the session's uploads ("kyc", "salary_slip", "other") and whether any is still being inspected"""
+    inspections = docs.get("inspections", {})
+    kinds = set()
+    pending = False
+    for file in docs.get("files", []):
+        result = inspections.get(file["digest"]) or doc_inspector.cached(file["digest"])
+        if result is None:
+            # Inspected by another process, or lost with a restart: (re)submit and wait briefly
+            inspect_upload(session_id, file["digest"])
+            with span("inspection.wait", digest=file["digest"][:12]):
+                result = doc_inspector.wait(file["digest"], INSPECT_WAIT_S)
+        if result is None:
+            pending = True
+        else:
+            kinds.add(document_kind(result, file["filename"]))
+    return kinds, pending
+
+def inspection_pending_reply(step):
+    return {
+        "step": step,
+        "reply": "⏳ We're still checking your document. Please send a message again in a moment."
+    }
+
+# ============ WORKFLOW (status transitions) ============
+# status -> statuses it may move to
+TRANSITIONS = {
+    "start": {"verification"},
+    "sales": {"verification"},
+    "verification": {"underwriting"},
+    "underwriting": {"scoring"},
+    "scoring": {"sanction", "need_docs", "rejected"},
+    "need_docs": {"underwriting"},
+    "sanction": {"sanctioning"},
+    "sanctioning": {"completed"},
+    "completed": set(),
+    "rejected": set()
+}
+
+# status -> in-progress status held while its agent runs (one worker at a time)
+CLAIMS = {
+    "underwriting": "scoring",
+    "sanction": "sanctioning"
+}
+
+def compare_and_set_app(session_id, query, fields):
+    """Atomically $set fields on the application only while it matches query"""
+    context = _active_context(session_id)
+    if context is not None:
+        # Whatever the new status depends on (decision, documents) must land first;
+        # staged application fields ride along with the status update itself
+        context.flush(exclude=("applications",))
+        fields = {**context.pending.get("applications", {}), **fields}
+
+    if session_journal.enabled:
+        # Committed with the writes queued before it, and journaled only if it took effect
+        updated = session_journal.write(
+            [Write(session_id, "applications", fields, event_type("applications", fields), query=query)]
+        )[0]
     else:
-        db.decisions[session_id] = data
+        # Every backend applies the match and the $set as one atomic step
+        updated = storage().applications.find_one_and_update(
+            {"sessionId": session_id, **query},
+            {"$set": fields},
+            projection={"_id": 1}
+        ) is not None
+
+    if updated:
+        if context is not None:
+            context.pending.pop("applications", None)
+            context.docs["applications"].update(fields)
+    return updated
+
+workflow = Workflow(TRANSITIONS, CLAIMS, compare_and_set_app, instrument=instrument_agent)
+
+def advance_status(session_id, status, fields=None):
+    """Move the session from its current status to status; False if it lost a race"""
+    current = get_app(session_id).get("status", "start")
+    return workflow.advance(session_id, current, status, fields)
 
 # ============ AGENT FUNCTIONS ============
 
+# Largest number of rows accepted by /api/underwrite/batch in one request
+MAX_BATCH_ROWS = int(os.getenv("MAX_BATCH_ROWS", "10000"))
+
+# Credit scores come from the (simulated) bureau through a TTL cache that pulls each
+# applicant once, however many requests ask at the same time. /api/apply prefetches
+# the score, so the bureau's latency is usually spent before underwriting runs.
+credit_bureau = CreditScores(
+    SimulatedBureau(latency_ms=float(os.getenv("CREDIT_BUREAU_LATENCY_MS", "0"))),
+    ttl_s=float(os.getenv("CREDIT_SCORE_TTL_H", "24")) * 3600,
+    workers=int(os.getenv("CREDIT_BUREAU_WORKERS", "32")),
+    timeout_s=float(os.getenv("CREDIT_BUREAU_TIMEOUT_S", "10"))
+)
+
+def get_credit_score(session_id):
+    """The applicant's credit score (650-849), keyed by session"""
+    return credit_bureau.get(session_id)
+
+# Application fields underwriting reads
+UNDERWRITING_INPUTS = ("income", "loan_amount", "tenure")
+
+# A session waiting in need_docs gets the reply of the underwriting run that put it
+# there for as long as that run's inputs are unchanged; /api/apply and /api/upload
+# drop the entry when they change them
+decision_cache = DecisionCache(max_entries=int(os.getenv("DECISION_CACHE_SIZE", "10000")))
+
+def underwriting_fingerprint(session_id, app_data, docs):
+    """Digest of everything an underwriting decision depends on: loan inputs, credit score and uploads"""
+    return fingerprint(
+        [app_data.get(key) for key in UNDERWRITING_INPUTS],
+        get_credit_score(session_id),
+        sorted(file["digest"] for file in docs.get("files", []))
+    )
+
 def sales_agent(session_id, message):
     """Sales Agent: Collects loan amount, purpose, personal details"""
     app_data = get_app(session_id)
@@ -110,7 +640,7 @@ def sales_agent(session_id, message):
     
     if has_amount and has_income and has_tenure:
         # All data collected, move to verification
-        set_app(session_id, {"status": "verification"})
+        advance_status(session_id, "verification")
         return {
             "step": "verification",
             "reply": f"✓ Thank you! I have your details:\n• Loan Amount: ₹{app_data.get('loan_amount'):,}\n• Monthly Income: ₹{app_data.get('income'):,}\n• Tenure: {app_data.get('tenure')} months\n\nNow let's verify your identity. Please upload your KYC documents (Aadhaar/PAN) using the upload section."
@@ -125,18 +655,35 @@ def sales_agent(session_id, message):
         if not has_tenure:
             missing.append("preferred tenure")
         
+        reply = f"👋 Hello! I'm your AI Loan Advisor.\n\nTo process your loan application, please fill out the Loan Requirements form on the left with:\n• Loan Amount\n• Tenure (months)\n• Monthly Income\n• Other details\n\nThen click Submit."
+        try:
+            # Stored as the form sent it: a number, a numeric string, or anything else
+            income = int(float(app_data["income"])) if has_income else 0
+        except (TypeError, ValueError, OverflowError):
+            income = 0
+        if income > 0:
+            longest = offer_grid(income, ANNUAL_RATE)["offers"][-1]
+            reply += f"\n\n💡 With your income you can borrow up to ₹{longest['instant']['maxAmount']:,} over {longest['tenure']} months (EMI ₹{longest['instant']['emi']:,.0f})."
         return {
             "step": "sales",
-            "reply": f"👋 Hello! I'm your AI Loan Advisor.\n\nTo process your loan application, please fill out the Loan Requirements form on the left with:\n• Loan Amount\n• Tenure (months)\n• Monthly Income\n• Other details\n\nThen click Submit."
+            "reply": reply
         }
 
-def verification_agent(session_id):
+def verification_agent(session_id, message=""):
     """Verification Agent: Performs KYC checks via Dummy CRM"""
     docs = get_docs(session_id)
     
     if docs.get("uploaded"):
-        # Documents uploaded, perform "KYC check" (dummy)
-        set_app(session_id, {"status": "underwriting", "kyc_verified": True})
+        # KYC passes once an upload has been recognised as an identity document or payslip
+        kinds, pending = document_kinds(session_id, docs)
+        if not kinds & {"kyc", "salary_slip"}:
+            if pending:
+                return inspection_pending_reply("verification")
+            return {
+                "step": "verification",
+                "reply": "⚠ We couldn't recognise your upload as a KYC document. Please upload a clear copy of your Aadhaar or PAN card."
+            }
+        advance_status(session_id, "underwriting", {"kyc_verified": True})
         return {
             "step": "underwriting",
             "reply": f"✓ KYC Verification Complete!\n• Document: {docs.get('filename', 'Uploaded')}\n• Status: Verified ✓\n\nNow running credit assessment and ML prediction..."
@@ -147,7 +694,7 @@ def verification_agent(session_id):
             "reply": "📄 Please upload your KYC documents (Aadhaar, PAN, or Salary Slip) using the Document Upload section above.\n\nThis is required for identity verification."
         }
 
-def underwriting_agent(session_id):
+def underwriting_agent(session_id, message=""):
     """Underwriting Agent: Fetches credit score and runs ML prediction"""
     app_data = get_app(session_id)
     docs = get_docs(session_id)
@@ -161,8 +708,15 @@ def underwriting_agent(session_id):
     emi = loan_amount / max(tenure, 1)
     emi_to_income_ratio = emi / max(income, 1)
     
-    # Dummy credit score (random but deterministic per session)
-    credit_score = 650 + (hash(session_id) % 200)  # 650-850
+    credit_score = get_credit_score(session_id)
+    
+    # Recorded alongside the rule-based decision; the candidate model, if any,
+    # shadow-scores the same row in the background
+    model_proba, model_version = score_approval(np.array([[income, loan_amount, tenure]]), shadow=True)
+    model_fields = {
+        "model_probability": None if model_proba is None else round(float(model_proba[0]), 4),
+        "model_version": model_version
+    }
     
     # ML-style decision logic
     if emi_to_income_ratio < 0.3 and credit_score >= 700:
@@ -176,10 +730,11 @@ def underwriting_agent(session_id):
             "loan_amount": loan_amount,
             "emi": round(emi, 2),
             "tenure": int(tenure),
-            "reason": "Good credit score and healthy EMI-to-income ratio"
+            "reason": "Good credit score and healthy EMI-to-income ratio",
+            **model_fields
         }
         set_decision(session_id, decision)
-        set_app(session_id, {"status": "sanction"})
+        advance_status(session_id, "sanction")
         return {
             "step": "sanction",
             "reply": f"🎉 **Congratulations! Your loan is APPROVED!**\n\n📊 Assessment Results:\n• Credit Score: {credit_score}\n• EMI: ₹{emi:,.0f}/month\n• Confidence: {confidence*100:.0f}%\n\nGenerating your Sanction Letter..."
@@ -187,7 +742,8 @@ def underwriting_agent(session_id):
     
     elif emi_to_income_ratio < 0.5 and credit_score >= 600:
         # Need more docs (salary slip)
-        if docs.get("salary_slip_uploaded"):
+        kinds, pending = document_kinds(session_id, docs)
+        if "salary_slip" in kinds:
             # Re-evaluation after salary slip
             confidence = 0.75
             decision = {
@@ -198,20 +754,25 @@ def underwriting_agent(session_id):
                 "loan_amount": loan_amount,
                 "emi": round(emi, 2),
                 "tenure": int(tenure),
-                "reason": "Approved after salary verification"
+                "reason": "Approved after salary verification",
+                **model_fields
             }
             set_decision(session_id, decision)
-            set_app(session_id, {"status": "sanction"})
+            advance_status(session_id, "sanction")
             return {
                 "step": "sanction",
                 "reply": f"🎉 **Your loan is APPROVED after document verification!**\n\n📊 Assessment Results:\n• Credit Score: {credit_score}\n• EMI: ₹{emi:,.0f}/month\n\nGenerating your Sanction Letter..."
             }
         else:
-            set_app(session_id, {"status": "need_docs"})
-            return {
+            advance_status(session_id, "need_docs")
+            result = {
                 "step": "need_docs",
                 "reply": f"📋 **Additional Documents Required**\n\nYour application looks promising, but we need:\n• **Salary Slip** (last 3 months)\n\nPlease upload using the Document Upload section.\n\n📊 Current Assessment:\n• Credit Score: {credit_score}\n• EMI-to-Income: {emi_to_income_ratio*100:.0f}%"
             }
+            if not pending:
+                # Chats in need_docs get this reply until an input changes
+                decision_cache.put(session_id, underwriting_fingerprint(session_id, app_data, docs), result)
+            return result
     else:
         # Rejected
         decision = {
@@ -219,19 +780,98 @@ def underwriting_agent(session_id):
             "status": "rejected",
             "confidence": 0.85,
             "credit_score": credit_score,
-            "reason": f"EMI-to-income ratio too high ({emi_to_income_ratio*100:.0f}%) or credit score below threshold"
+            "reason": f"EMI-to-income ratio too high ({emi_to_income_ratio*100:.0f}%) or credit score below threshold",
+            **model_fields
         }
         set_decision(session_id, decision)
-        set_app(session_id, {"status": "rejected"})
+        advance_status(session_id, "rejected")
         return {
             "step": "rejected",
             "reply": f"❌ **Loan Application Declined**\n\n📊 Assessment Results:\n• Credit Score: {credit_score}\n• EMI-to-Income Ratio: {emi_to_income_ratio*100:.0f}%\n• Required: Below 50%\n\n**Reason:** {decision['reason']}\n\nYou may apply again after 6 months or with a co-applicant."
         }
 
-def sanction_agent(session_id):
-    """Sanction Agent: Generates the final sanction letter PDF"""
+def underwriting_batch(rows):
+    """Batch Underwriting: scores many applications in one vectorized pass
+
+    Uses the same EMI-to-income and credit score thresholds as underwriting_agent.
+    Each row needs income, loan_amount, tenure and either credit_score or sessionId;
+    salary_slip marks rows whose salary slip is already verified.
+    """
+    for i, row in enumerate(rows):
+        if row.get("credit_score") is None:
+            if not row.get("sessionId"):
+                raise ValueError(f"Row {i}: credit_score or sessionId is required")
+            # Start every pull before waiting on any, so they overlap
+            credit_bureau.prefetch(row["sessionId"])
+    credit_scores = [
+        int(row["credit_score"]) if row.get("credit_score") is not None else get_credit_score(row["sessionId"])
+        for row in rows
+    ]
+
+    income = np.array([float(row.get("income", 50000)) for row in rows])
+    loan_amount = np.array([float(row.get("loan_amount", 200000)) for row in rows])
+    tenure = np.array([float(row.get("tenure", 12)) for row in rows])
+    salary_slip = np.array([bool(row.get("salary_slip")) for row in rows], dtype=bool)
+    credit_score = np.array(credit_scores)
+
+    emi = loan_amount / np.maximum(tenure, 1)
+    emi_to_income_ratio = emi / np.maximum(income, 1)
+
+    approved = (emi_to_income_ratio < 0.3) & (credit_score >= 700)
+    borderline = ~approved & (emi_to_income_ratio < 0.5) & (credit_score >= 600)
+    approved_after_docs = borderline & salary_slip
+    need_docs = borderline & ~salary_slip
+
+    status = np.where(approved | approved_after_docs, "approved", np.where(need_docs, "need_docs", "rejected"))
+    confidence = np.select(
+        [approved, approved_after_docs, need_docs],
+        [np.minimum(0.95, 0.7 + (credit_score - 700) / 500), 0.75, np.nan],
+        default=0.85
+    )
+
+    # One predict_proba call per chunk instead of one per row
+    model_proba, model_version = score_approval(np.column_stack([income, loan_amount, tenure]), shadow=True)
+
+    results = []
+    for i in range(len(rows)):
+        results.append({
+            "index": i,
+            "sessionId": rows[i].get("sessionId"),
+            "status": str(status[i]),
+            "approved": bool(status[i] == "approved"),
+            "confidence": None if need_docs[i] else round(float(confidence[i]), 2),
+            "credit_score": int(credit_score[i]),
+            "emi": round(float(emi[i]), 2),
+            "emi_to_income": round(float(emi_to_income_ratio[i]), 4),
+            "model_probability": None if model_proba is None else round(float(model_proba[i]), 4),
+            "model_version": model_version
+        })
+    return results
+
+def sanction_letter(pdf_id):
+    """Path of the sanction letter, rendering it from its sanction record on a cache miss.
+
+    Returns None for an unknown pdf_id. Letters are not rendered when issued, and
+    one evicted from the cache is rebuilt here from the same record, issue date included.
+    """
+    try:
+        path = letter_cache.get(pdf_id)
+    except ValueError:
+        return None
+    if path is not None:
+        return path
+
+    record = find_sanction(pdf_id)
+    if not record:
+        return None
+    session_id = record["sessionId"]
+    # Sanctions issued before the decision was stored on the record fall back to decisions
+    decision = record.get("decision") or read_doc("decisions", session_id)
+    return render_sanction_letter(pdf_id, session_id, decision, record.get("issuedAt"))
+
+def sanction_agent(session_id, message=""):
+    """Sanction Agent: Queues the final sanction letter PDF"""
     decision = get_decision(session_id)
-    app_data = get_app(session_id)
     
     if not decision.get("approved"):
         return {
@@ -239,153 +879,130 @@ def sanction_agent(session_id):
             "reply": "No approved decision found."
         }
     
-    # Generate PDF
+    # Only the record is written here; the letter renders on its first download
     pdf_id = str(uuid.uuid4())
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    pdf_dir = os.path.join(base_dir, "ml")
-    os.makedirs(pdf_dir, exist_ok=True)
-    pdf_path = os.path.join(pdf_dir, f"{pdf_id}.pdf")
-    
-    try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.pdfgen import canvas as pdf_canvas
-        from reportlab.lib.units import inch
-        
-        c = pdf_canvas.Canvas(pdf_path, pagesize=A4)
-        width, height = A4
-        
-        # Header
-        c.setFont("Helvetica-Bold", 24)
-        c.drawCentredString(width/2, height - inch, "LOAN SANCTION LETTER")
-        
-        c.setFont("Helvetica", 12)
-        c.drawCentredString(width/2, height - 1.3*inch, "AI Loan Advisor")
-        
-        # Line
-        c.line(inch, height - 1.5*inch, width - inch, height - 1.5*inch)
-        
-        # Content
-        y = height - 2*inch
-        c.setFont("Helvetica", 11)
-        
-        lines = [
-            f"Date: {__import__('datetime').datetime.now().strftime('%B %d, %Y')}",
-            f"Application ID: {session_id}",
-            "",
-            "Dear Applicant,",
-            "",
-            "We are pleased to inform you that your loan application has been APPROVED.",
-            "",
-            "Loan Details:",
-            f"  • Sanctioned Amount: ₹{decision.get('loan_amount', 0):,.0f}",
-            f"  • Tenure: {decision.get('tenure', 12)} months",
-            f"  • Monthly EMI: ₹{decision.get('emi', 0):,.0f}",
-            f"  • Credit Score: {decision.get('credit_score', 'N/A')}",
-            "",
-            "Terms & Conditions:",
-            "  1. This sanction is valid for 30 days from the date of issue.",
-            "  2. Final disbursement subject to document verification.",
-            "  3. Interest rate as per prevailing market rates.",
-            "",
-            "Congratulations on your approval!",
-            "",
-            "Best regards,",
-            "AI Loan Advisor Team"
-        ]
-        
-        for line in lines:
-            c.drawString(inch, y, line)
-            y -= 18
-        
-        c.save()
-        print(f"✓ PDF generated: {pdf_path}")
-        
-    except Exception as e:
-        print(f"✗ PDF generation error: {e}")
-        traceback.print_exc()
-        return {
-            "step": "error",
-            "reply": f"Error generating PDF: {str(e)}"
-        }
-    
-    # Save sanction info
-    if mongo_db is not None:
-        mongo_db.sanctions.update_one(
-            {"sessionId": session_id},
-            {"$set": {"pdfId": pdf_id}},
-            upsert=True
-        )
-    else:
-        db.sanctions[session_id] = {"pdfId": pdf_id}
-    
-    set_app(session_id, {"status": "completed", "pdfId": pdf_id})
+    set_sanction(session_id, {"pdfId": pdf_id, "issuedAt": time.time(), "decision": decision})
+    advance_status(session_id, "completed", {"pdfId": pdf_id})
     
     return {
         "step": "completed",
-        "reply": f"📄 **Sanction Letter Generated!**\n\nYour loan of ₹{decision.get('loan_amount', 0):,.0f} has been approved.\n\n[Download Sanction Letter](/api/download/{pdf_id})\n\nThank you for choosing AI Loan Advisor!",
+        "reply": f"📄 **Sanction Letter Issued!**\n\nYour loan of ₹{decision.get('loan_amount', 0):,.0f} has been approved.\n\n[Download Sanction Letter](/api/download/{pdf_id})\n\nThank you for choosing AI Loan Advisor!",
         "pdfId": pdf_id,
         "decision": decision
     }
 
+def need_docs_agent(session_id, message=""):
+    """Waits for the salary slip, then hands back to underwriting
+
+    While the loan inputs, credit score and uploads are those the need_docs decision
+    was made on, the decision's reply is served from decision_cache without
+    touching storage; once any of them changes, underwriting runs again.
+    """
+    docs = get_docs(session_id)
+    cached = decision_cache.get(session_id, underwriting_fingerprint(session_id, get_app(session_id), docs))
+    if cached is not None:
+        return cached
+    kinds, pending = document_kinds(session_id, docs)
+    if pending and "salary_slip" not in kinds:
+        return inspection_pending_reply("need_docs")
+    advance_status(session_id, "underwriting")
+    return workflow.run(session_id, "underwriting", underwriting_agent, message) or busy_reply()
+
+def completed_agent(session_id, message=""):
+    pdf_id = get_app(session_id).get("pdfId")
+    return {
+        "step": "completed",
+        "reply": f"✅ Your application is complete!\n\n[Download Sanction Letter](/api/download/{pdf_id})" if pdf_id else "✅ Your application is complete!",
+        "pdfId": pdf_id
+    }
+
+def rejected_agent(session_id, message=""):
+    return {
+        "step": "rejected",
+        "reply": "❌ Your application was not approved. You may apply again after 6 months."
+    }
+
+def busy_reply():
+    """Reply for a duplicate request while another one runs the same step"""
+    return {
+        "step": "processing",
+        "reply": "⏳ Your application is being processed. Please check back in a moment."
+    }
+
+# status -> agent handling it
+WORKFLOW_AGENTS = {
+    "start": sales_agent,
+    "sales": sales_agent,
+    "verification": verification_agent,
+    "underwriting": underwriting_agent,
+    "need_docs": need_docs_agent,
+    "sanction": sanction_agent,
+    "completed": completed_agent,
+    "rejected": rejected_agent
+}
+
+# in-progress status -> the step that claimed it
+CLAIMED_STEPS = {claim: step for step, claim in CLAIMS.items()}
+
 def master_agent(session_id, message):
     """Master Agent: Orchestrates the entire workflow"""
-    app_data = get_app(session_id)
-    status = app_data.get("status", "start")
-    
-    print(f"[Master Agent] Session: {session_id}, Status: {status}, Message: {message[:50]}...")
-    
-    # Route to appropriate agent based on status
-    if status == "start" or status == "sales":
-        return sales_agent(session_id, message)
-    
-    elif status == "verification":
-        return verification_agent(session_id)
-    
-    elif status == "underwriting":
-        return underwriting_agent(session_id)
-    
-    elif status == "need_docs":
-        # Check if new docs uploaded
-        docs = get_docs(session_id)
-        if docs.get("salary_slip_uploaded"):
-            set_app(session_id, {"status": "underwriting"})
-            return underwriting_agent(session_id)
-        else:
-            return {
-                "step": "need_docs",
-                "reply": "📋 Please upload your Salary Slip to continue with the application.\n\nUse the Document Upload section above."
-            }
-    
-    elif status == "sanction":
-        return sanction_agent(session_id)
-    
-    elif status == "completed":
+    with span("master_agent"):
         app_data = get_app(session_id)
-        pdf_id = app_data.get("pdfId")
-        return {
-            "step": "completed",
-            "reply": f"✅ Your application is complete!\n\n[Download Sanction Letter](/api/download/{pdf_id})" if pdf_id else "✅ Your application is complete!",
-            "pdfId": pdf_id
-        }
-    
-    elif status == "rejected":
-        return {
-            "step": "rejected",
-            "reply": "❌ Your application was not approved. You may apply again after 6 months."
-        }
-    
-    else:
-        # Unknown status, restart
-        set_app(session_id, {"status": "sales"})
-        return sales_agent(session_id, message)
+        status = app_data.get("status", "start")
+        
+        log_event("master_agent", sessionId=session_id, status=status, message=message[:50])
+        
+        # A claimed step is normally busy elsewhere; retrying the claim takes it over
+        # only if the claim has expired (its worker died mid-step)
+        status = CLAIMED_STEPS.get(status, status)
+        agent = WORKFLOW_AGENTS.get(status)
+        
+        if agent is None:
+            # Unknown status, restart
+            workflow.reset(session_id, status, "sales")
+            agent, status = sales_agent, "sales"
+        
+        return workflow.run(session_id, status, agent, message) or busy_reply()
 
 # ============ API ENDPOINTS ============
 
 @app.route("/api/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "mongo": mongo_db is not None})
+    return jsonify({
+        "status": "ok",
+        "mongo": mongo.database is not None,
+        # Counters of the local store (memory or SQLite), when it is in use
+        "sessions": db.stats() if mongo.database is None else None,
+        "creditScores": credit_bureau.stats(),
+        "decisionCache": decision_cache.stats(),
+        "journal": session_journal.stats()
+    })
+
+@app.route("/api/ready", methods=["GET"])
+def ready():
+    """Readiness: 503 while the configured MongoDB is still being connected"""
+    ready = mongo.state != "connecting"
+    return jsonify({
+        "ready": ready,
+        "storage": "mongo" if mongo.database is not None else LOCAL_STORAGE,
+        "mongo": mongo.status(),
+        # None until the model has been loaded (by warm-up or the first score)
+        "model": (compiled_forest() is not None) if model_loaded() else None,
+        "modelVersion": (model_info() or {}).get("version")
+    }), 200 if ready else 503
+
+@app.route("/api/models", methods=["GET"])
+def model_status():
+    """Active and candidate model versions, shadow agreement and latency, and the last load error"""
+    return jsonify(models.status())
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text format: latency histograms per route, agent, datastore call and PDF render"""
+    return Response(registry.render(), content_type=registry.CONTENT_TYPE)
 
 @app.route("/api/apply", methods=["POST"])
+@writes_sessions
 def apply():
     """Save loan application data from form"""
     try:
@@ -401,22 +1018,30 @@ def apply():
             if data.get(key) is not None:
                 fields[key] = data[key]
         
-        # Set initial status if new application
-        app_data = get_app(session_id)
-        if not app_data.get("status"):
-            fields["status"] = "sales"
+        with session_context(session_id):
+            # Set initial status if new application
+            app_data = get_app(session_id)
+            if not app_data.get("status"):
+                fields["status"] = "sales"
+            
+            if any(app_data.get(key) != fields[key] for key in UNDERWRITING_INPUTS if key in fields):
+                decision_cache.invalidate(session_id)
+            set_app(session_id, fields)
+            saved = get_app(session_id)
         
-        set_app(session_id, fields)
+        if saved.get("income") is not None and saved.get("loan_amount") is not None:
+            # Underwriting will need the score: start the bureau pull now
+            credit_bureau.prefetch(session_id)
         
-        print(f"✓ Application saved: {session_id} -> {fields}")
+        log_event("application_saved", sessionId=session_id, fields=fields)
         return jsonify({"ok": True, "saved": fields})
     
     except Exception as e:
-        print(f"✗ Apply error: {e}")
-        traceback.print_exc()
+        log_event("apply_error", level=logging.ERROR, exc_info=True, error=str(e))
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/chat", methods=["POST"])
+@writes_sessions
 def chat():
     """Main chat endpoint - Master Agent handles all messages"""
     try:
@@ -427,28 +1052,34 @@ def chat():
         if not session_id:
             return jsonify({"error": "Missing sessionId"}), 400
         
-        # Initialize if new session
-        app_data = get_app(session_id)
-        if not app_data:
-            set_app(session_id, {"status": "start"})
-        
-        # Route through Master Agent
-        result = master_agent(session_id, message)
+        # One snapshot read and one flush per request
+        with session_context(session_id):
+            # Initialize if new session
+            app_data = get_app(session_id)
+            if not app_data:
+                set_app(session_id, {"status": "start"})
+            
+            # Route through Master Agent
+            result = master_agent(session_id, message)
         
-        print(f"✓ Chat response: {result.get('step')} -> {result.get('reply', '')[:50]}...")
+        log_event("chat_response", sessionId=session_id, step=result.get("step"), reply=result.get("reply", "")[:50])
         return jsonify(result)
     
     except Exception as e:
-        print(f"✗ Chat error: {e}")
-        traceback.print_exc()
+        log_event("chat_error", level=logging.ERROR, exc_info=True, error=str(e))
         return jsonify({"error": str(e), "reply": f"Error: {str(e)}"}), 500
 
 @app.route("/api/upload", methods=["POST"])
+@writes_sessions
 def upload():
     """Handle document upload"""
     try:
-        session_id = request.form.get("sessionId")
-        file = request.files.get("file")
+        try:
+            # Parsing the form is what streams the file into the document store
+            session_id = request.form.get("sessionId")
+            file = request.files.get("file")
+        except (RequestEntityTooLarge, DocumentTooLarge):
+            return jsonify({"error": f"File too large (max {DOC_MAX_BYTES // (1024 * 1024)} MB)"}), 413
         
         if not session_id:
             return jsonify({"error": "Missing sessionId"}), 400
@@ -457,58 +1088,135 @@ def upload():
             return jsonify({"error": "No file provided"}), 400
         
         filename = file.filename or "document"
+        stored = file.stream.commit()
         
-        # Check if it's a salary slip (by name heuristic)
-        is_salary_slip = "salary" in filename.lower() or "slip" in filename.lower() or "payslip" in filename.lower()
-        
-        # Save document info
-        doc_data = {
+        # Save document info; the content itself is in the store under its digest.
+        # The file is $pushed, so concurrent uploads to a session each add theirs
+        write_doc("documents", session_id, {
             "uploaded": True,
             "filename": filename,
-            "salary_slip_uploaded": is_salary_slip or get_docs(session_id).get("salary_slip_uploaded", False)
-        }
-        set_docs(session_id, doc_data)
-        
-        # Check current status and potentially advance
-        app_data = get_app(session_id)
-        status = app_data.get("status", "start")
+            "digest": stored["digest"],
+            "size": stored["size"]
+        }, push={"files": [{
+            "filename": filename,
+            "digest": stored["digest"],
+            "size": stored["size"],
+            "uploadedAt": time.time()
+        }]})
+        decision_cache.invalidate(session_id)
         
-        if status == "verification":
-            set_app(session_id, {"status": "underwriting"})
-        elif status == "need_docs" and is_salary_slip:
-            set_app(session_id, {"status": "underwriting"})
+        # Inspected off the request path; the verification and need_docs steps read the result
+        inspection = inspect_upload(session_id, stored["digest"])
+        result = inspection.result() if inspection.done() and inspection.exception() is None else None
         
-        print(f"✓ Document uploaded: {session_id} -> {filename}")
-        return jsonify({"ok": True, "filename": filename, "salary_slip": is_salary_slip})
+        log_event("document_uploaded", sessionId=session_id, filename=filename, size=stored["size"], digest=stored["digest"])
+        return jsonify({
+            "ok": True,
+            "filename": filename,
+            "digest": stored["digest"],
+            "size": stored["size"],
+            "inspection": "pending" if result is None else "done",
+            "salary_slip": result is not None and document_kind(result, filename) == "salary_slip"
+        })
     
     except Exception as e:
-        print(f"✗ Upload error: {e}")
-        traceback.print_exc()
+        log_event("upload_error", level=logging.ERROR, exc_info=True, error=str(e))
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/underwrite/batch", methods=["POST"])
+def underwrite_batch():
+    """Pre-screen many leads at once with the underwriting thresholds"""
+    try:
+        data = request.get_json() or {}
+        rows = data.get("rows")
+
+        if not rows or not isinstance(rows, list):
+            return jsonify({"error": "Missing rows"}), 400
+
+        if len(rows) > MAX_BATCH_ROWS:
+            return jsonify({"error": f"Too many rows (max {MAX_BATCH_ROWS})"}), 413
+
+        results = underwriting_batch(rows)
+        summary = {"approved": 0, "need_docs": 0, "rejected": 0}
+        for result in results:
+            summary[result["status"]] += 1
+
+        log_event("batch_underwriting", rows=len(results), summary=summary)
+        return jsonify({"ok": True, "count": len(results), "summary": summary, "results": results})
+
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    except Exception as e:
+        log_event("batch_underwriting_error", level=logging.ERROR, exc_info=True, error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+def offer_rate():
+    """Annual rate from the rate query parameter (ANNUAL_RATE if absent), rounded to keep cache keys few"""
+    rate = round(float(request.args.get("rate", ANNUAL_RATE)), 4)
+    if not 0 <= rate <= 1:
+        raise ValueError("rate must be between 0 and 1")
+    return rate
+
+@app.route("/api/offers", methods=["GET"])
+def offers():
+    """Eligibility grid for an income: the largest approvable amount and amortized EMI per tenure"""
+    try:
+        income = int(round(float(request.args["income"])))
+        step = int(request.args.get("step", 6))
+        if income <= 0:
+            raise ValueError("income must be positive")
+        if not 1 <= step <= MAX_TENURE - MIN_TENURE:
+            raise ValueError(f"step must be between 1 and {MAX_TENURE - MIN_TENURE}")
+        return Response(offer_grid_json(income, offer_rate(), step), content_type="application/json")
+
+    except KeyError:
+        return jsonify({"error": "Missing income"}), 400
+
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/schedule", methods=["GET"])
+def schedule():
+    """Month-by-month repayment schedules for an amount over one or more tenures (tenure=12,24,36)"""
+    try:
+        amount = int(round(float(request.args["amount"])))
+        tenures = tuple(sorted({int(t) for t in request.args["tenure"].split(",") if t.strip()}))
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        if not tenures or not all(MIN_TENURE <= t <= MAX_TENURE for t in tenures):
+            raise ValueError(f"tenure must be between {MIN_TENURE} and {MAX_TENURE} months")
+        return Response(repayment_schedules_json(amount, tenures, offer_rate()), content_type="application/json")
+
+    except KeyError as e:
+        return jsonify({"error": f"Missing {e.args[0]}"}), 400
+
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route("/api/download/<pdf_id>", methods=["GET"])
 def download(pdf_id):
     """Download generated PDF"""
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        pdf_path = os.path.join(base_dir, "ml", f"{pdf_id}.pdf")
+        pdf_path = sanction_letter(pdf_id)
         
-        if not os.path.exists(pdf_path):
+        if pdf_path is None:
             return jsonify({"error": "PDF not found"}), 404
         
         return send_file(pdf_path, as_attachment=True, download_name=f"sanction_letter_{pdf_id[:8]}.pdf")
     
     except Exception as e:
-        print(f"✗ Download error: {e}")
+        log_event("download_error", level=logging.ERROR, exc_info=True, pdfId=pdf_id, error=str(e))
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/status/<session_id>", methods=["GET"])
 def get_status(session_id):
     """Get current application status"""
     try:
-        app_data = get_app(session_id)
-        docs = get_docs(session_id)
-        decision = get_decision(session_id)
+        with session_context(session_id):
+            app_data = get_app(session_id)
+            docs = get_docs(session_id)
+            decision = get_decision(session_id)
         
         return jsonify({
             "application": app_data,
@@ -519,6 +1227,64 @@ def get_status(session_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/status/<session_id>/events", methods=["GET"])
+def get_events(session_id):
+    """The session's journal: every status change, decision, upload and sanction, oldest first"""
+    try:
+        events = [
+            {
+                "ts": e["ts"], "type": e["type"], "collection": e["collection"], "fields": dict(e["fields"]),
+                **({"push": dict(e["push"])} if "push" in e else {})
+            }
+            for e in session_journal.events(session_id)
+        ]
+        return jsonify({"sessionId": session_id, "durability": session_journal.durability, "events": events})
+
+    except Exception as e:
+        log_event("events_error", level=logging.ERROR, exc_info=True, error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+# ============ BULK EXPORT ============
+# Off unless EXPORT_TOKEN is set; callers send it as "Authorization: Bearer <token>"
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN", "")
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "1000"))
+
+@app.route("/api/export", methods=["GET"])
+def export():
+    """Every session matching the filters, joined across the collections, streamed as NDJSON or CSV"""
+    supplied = request.headers.get("Authorization", "").encode()
+    if not EXPORT_TOKEN or not hmac.compare_digest(supplied, f"Bearer {EXPORT_TOKEN}".encode()):
+        return jsonify({"error": "Export is disabled or the token is wrong"}), 403
+    try:
+        fmt = request.args.get("format", "ndjson")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+        statuses = [s for s in request.args.get("status", "").split(",") if s]
+        query = export_query(statuses, parse_time(request.args.get("since")), parse_time(request.args.get("until")))
+        batch_size = int(request.args.get("batch", EXPORT_BATCH))
+        if not 1 <= batch_size <= 10000:
+            raise ValueError("batch must be between 1 and 10000")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def stream():
+        start = time.perf_counter()
+        try:
+            yield from export_chunks(storage(), query, fmt, batch_size)
+        except Exception as e:
+            # Too late for an error status: end the response without its last chunk, so
+            # the client sees a broken transfer rather than a short export
+            log_event("export_error", level=logging.ERROR, exc_info=True, error=str(e))
+            raise
+        # Session counts are in export_sessions_total
+        log_event("export_finished", format=fmt, query=query, durationMs=round((time.perf_counter() - start) * 1000, 1))
+
+    return Response(
+        stream_with_context(stream()),
+        content_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=sessions.{fmt}"}
+    )
+
 # ============ ERROR HANDLERS ============
 
 @app.errorhandler(404)
@@ -535,8 +1301,9 @@ if __name__ == "__main__":
     print("\n" + "="*50)
     print("🚀 AI Loan Advisor Backend Starting...")
     print("="*50)
-    print(f"📦 MongoDB: {'Connected ✓' if mongo_db is not None else 'Using in-memory storage'}")
+    print(f"📦 MongoDB: {'Connecting in the background' if MONGO_URI else 'Not configured'}; using {LOCAL_STORAGE} storage until connected")
     print(f"🌐 Server: http://localhost:5000")
     print("="*50 + "\n")
     
+    start_background()
     app.run(host="0.0.0.0", port=5000, debug=False)
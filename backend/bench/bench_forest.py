@@ -0,0 +1,73 @@
+"""
+Benchmark: sklearn predict_proba vs the compiled forest evaluator.
+
+Usage (from backend/):
+    python bench/bench_forest.py [--rows 100000] [--single 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.underwriting import MODEL_PATH
+from services.forest import CompiledForest
+
+
+def synthetic_rows(n, seed=7):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.random(n) * 100000,               # income
+        rng.random(n) * 500000,               # loan amount
+        rng.integers(6, 67, n).astype(float)  # tenure
+    ])
+
+
+def per_call_us(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000, help="largest batch size")
+    parser.add_argument("--single", type=int, default=2000, help="single-row calls to time")
+    args = parser.parse_args()
+
+    model = joblib.load(MODEL_PATH)
+    start = time.perf_counter()
+    forest = CompiledForest(model)
+    print(f"Compiled {forest.n_trees} trees in {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"({'lookup grid' if forest.grid is not None else 'node walk'})")
+
+    X = synthetic_rows(args.rows)
+    exact = np.array_equal(model.predict_proba(X), forest.predict_proba(X))
+    print(f"Probabilities identical to predict_proba on {args.rows:,} rows: {exact}")
+
+    row = X[0].tolist()
+    sklearn_us = per_call_us(lambda: model.predict_proba([row]), max(args.single // 10, 10))
+    compiled_us = per_call_us(lambda: forest.predict_proba([row]), args.single)
+    print("\nSingle-row latency")
+    print(f"  sklearn predict_proba : {sklearn_us:10.1f} us")
+    print(f"  compiled forest       : {compiled_us:10.1f} us  ({sklearn_us / compiled_us:.0f}x)")
+
+    print("\nBatch throughput (rows/s)")
+    print(f"  {'rows':>8}  {'sklearn':>12}  {'compiled':>12}")
+    size = 100
+    while size <= args.rows:
+        batch = X[:size]
+        calls = max(1, 20000 // size)
+        sklearn_rate = size / (per_call_us(lambda: model.predict_proba(batch), calls) / 1e6)
+        compiled_rate = size / (per_call_us(lambda: forest.predict_proba(batch), calls) / 1e6)
+        print(f"  {size:>8,}  {sklearn_rate:>12,.0f}  {compiled_rate:>12,.0f}")
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
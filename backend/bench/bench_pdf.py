@@ -0,0 +1,72 @@
+"""
+Benchmark: sanction letters drawn with ReportLab vs stamped into the compiled template.
+
+Usage (from backend/):
+    python bench/bench_pdf.py [--letters 2000] [--processes N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import pdf_service
+from services.letter_cache import LetterCache
+
+
+def sample_letters(n):
+    return [
+        (f"bench-{i}", f"session-{i:06d}", {
+            "loan_amount": 100000 + 250 * i,
+            "tenure": 12 + i % 49,
+            "emi": 2500 + i,
+            "credit_score": 650 + i % 200
+        })
+        for i in range(n)
+    ]
+
+
+def drawn(pdf_id, session_id, decision):
+    # The renderer before templating: every letter drawn from scratch
+    data = pdf_service.draw_sanction_pdf(pdf_service.letter_fields(session_id, decision))
+    pdf_service.letter_cache.put(pdf_id, data)
+
+
+def letters_per_s(fn, letters):
+    start = time.perf_counter()
+    fn(letters)
+    return len(letters) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--letters", type=int, default=2000, help="letters per run")
+    parser.add_argument("--processes", type=int, default=None, help="bulk pool size (default: CPU count)")
+    args = parser.parse_args()
+
+    letters = sample_letters(args.letters)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Workers are forked, so they write to the same scratch cache
+        pdf_service.letter_cache = LetterCache(tmp)
+
+        start = time.perf_counter()
+        pdf_service.letter_template()
+        print(f"Compiled letter template in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        rates = [
+            ("drawn per letter (before)", letters_per_s(lambda ls: [drawn(*l) for l in ls], letters)),
+            ("template stamp", letters_per_s(lambda ls: [pdf_service.render_sanction_letter(*l) for l in ls], letters)),
+            (f"bulk, {args.processes or os.cpu_count()} processes", letters_per_s(
+                lambda ls: pdf_service.render_sanction_letters(ls, processes=args.processes), letters)),
+        ]
+
+    print(f"\nLetters/s over {args.letters:,} letters")
+    base = rates[0][1]
+    for name, rate in rates:
+        print(f"  {name:<28} {rate:>10,.0f}  ({rate / base:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
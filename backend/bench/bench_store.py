@@ -0,0 +1,97 @@
+"""
+Benchmark: the in-memory session store vs the SQLite (WAL) store.
+
+Usage (from backend/):
+    python bench/bench_store.py [--sessions 2000] [--threads 8] [--processes 4]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.session_store import SessionStore
+from services.sqlite_store import SQLiteStore
+
+COLLECTIONS = ("applications", "documents", "decisions", "sanctions")
+
+
+def request_mix(store, prefix, sessions):
+    """What one chat request does: read the session, update it, compare-and-set its status."""
+    for i in range(sessions):
+        sid = f"{prefix}-{i}"
+        store.applications.update_one({"sessionId": sid}, {"$set": {"status": "underwriting", "income": 50000}}, upsert=True)
+        store.documents.update_one({"sessionId": sid}, {"$set": {"uploaded": True}}, upsert=True)
+        for name in COLLECTIONS:
+            store[name].find_one({"sessionId": sid})
+        store.applications.find_one_and_update(
+            {"sessionId": sid, "status": "underwriting"},
+            {"$set": {"status": "scoring"}}
+        )
+    return sessions * 7
+
+
+def request_mix_rate(store, sessions):
+    start = time.perf_counter()
+    ops = request_mix(store, "single", sessions)
+    return ops / (time.perf_counter() - start)
+
+
+def threaded_ops_per_s(store, threads, sessions):
+    def worker(k):
+        request_mix(store, f"t{threads}-{k}", sessions)
+    pool = [threading.Thread(target=worker, args=(k,)) for k in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return threads * sessions * 7 / (time.perf_counter() - start)
+
+
+def _process_worker(path, k, sessions):
+    request_mix(SQLiteStore(path, COLLECTIONS), f"p{k}", sessions)
+
+
+def process_ops_per_s(path, processes, sessions):
+    ctx = multiprocessing.get_context("fork")
+    pool = [ctx.Process(target=_process_worker, args=(path, k, sessions)) for k in range(processes)]
+    start = time.perf_counter()
+    for p in pool:
+        p.start()
+    for p in pool:
+        p.join()
+    return processes * sessions * 7 / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=2000, help="sessions per thread or process")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.db")
+        backends = [
+            ("memory", SessionStore(COLLECTIONS, max_sessions=10 ** 7)),
+            ("sqlite", SQLiteStore(path, COLLECTIONS)),
+        ]
+
+        print(f"Store operations/s ({args.sessions:,} sessions per worker, 7 operations each)")
+        print(f"  {'backend':<8} {'1 thread':>12} {f'{args.threads} threads':>12} {f'{args.processes} processes':>14}")
+        for name, store in backends:
+            single = request_mix_rate(store, args.sessions)
+            threaded = threaded_ops_per_s(store, args.threads, args.sessions)
+            # Only SQLite is shared between processes; each process would have its own dicts
+            procs = process_ops_per_s(path, args.processes, args.sessions) if name == "sqlite" else None
+            procs_text = f"{procs:>14,.0f}" if procs is not None else f"{'n/a':>14}"
+            print(f"  {name:<8} {single:>12,.0f} {threaded:>12,.0f} {procs_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Import-time profile of the app: what a cold start spends before serving anything.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter and
+summarizes the report: total time, the slowest top-level imports (inclusive of
+everything they pull in), and whether modules that should load lazily did.
+
+Usage (from backend/):
+    python bench/importtime.py [--module app] [--top 15] [--budget-ms 800] [--json]
+
+Exits 1 when --budget-ms is exceeded or a lazy module was imported, so it can
+run in CI to catch a regression.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use (or by the warm-up thread), never while importing the app
+LAZY_MODULES = ("sklearn", "scipy", "joblib", "reportlab", "pymongo")
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def profile(module):
+    """[(self_us, cumulative_us, depth, name)] in report order for importing module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+        env={**os.environ, "MONGO_URI": "", "WARMUP": "off"}
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(self_us), int(cumulative_us), (len(indent) - 1) // 2, name))
+    return rows
+
+
+def summarize(rows, module, top):
+    total_us = next((cum for _, cum, depth, name in rows if depth == 0 and name == module), 0)
+    # Direct imports of the profiled module, slowest first; a dependency shared by
+    # several is charged to whichever imported it first
+    children = sorted((r for r in rows if r[2] == 1), key=lambda r: -r[1])
+    loaded = {name.split(".")[0] for _, _, _, name in rows}
+    return {
+        "module": module,
+        "totalMs": round(total_us / 1000, 1),
+        "modules": len(rows),
+        "slowest": [{"name": name, "ms": round(cum / 1000, 1)} for _, cum, _, name in children[:top]],
+        "eagerlyLoaded": sorted(m for m in LAZY_MODULES if m in loaded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=0, help="fail above this total (0: no budget)")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = summarize(profile(args.module), args.module, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"import {summary['module']}: {summary['totalMs']:.1f} ms, {summary['modules']} modules")
+        for entry in summary["slowest"]:
+            print(f"  {entry['ms']:8.1f} ms  {entry['name']}")
+        if summary["eagerlyLoaded"]:
+            print(f"Loaded at import but meant to be lazy: {', '.join(summary['eagerlyLoaded'])}")
+
+    over_budget = args.budget_ms and summary["totalMs"] > args.budget_ms
+    if over_budget:
+        print(f"Over budget: {summary['totalMs']:.1f} ms > {args.budget_ms:.1f} ms")
+    if over_budget or summary["eagerlyLoaded"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+Load test: virtual applicants walk the whole loan funnel against the app, in-process.
+
+Each applicant applies, chats to verification, uploads a KYC document, chats
+through underwriting and, when asked, uploads a salary slip and chats again,
+then downloads the sanction letter and reads its status. The applicant mix
+covers approval, the salary-slip path and rejection.
+
+Usage (from backend/):
+    python bench/loadgen.py [--applicants 500] [--concurrency 16] [--backend memory|sqlite|mongo]
+                            [--think-ms 0] [--mongo-uri mongodb://localhost:27017] [--out results.json]
+                            [--compare previous.json]
+
+Writes a JSON artifact (throughput, p50/p95/p99 latency per endpoint and per
+workflow step, error rates) to --out, by default bench/results/. --compare
+prints the change from an earlier artifact.
+
+The memory and sqlite backends need nothing running. The mongo backend points
+the app at a local mongod (mongomock cannot run the app's $unionWith snapshot read).
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services.credit_bureau import simulated_score
+
+# Chats sent at one step before the applicant gives up (inspection may still be running)
+MAX_POLLS = 20
+POLL_INTERVAL_S = 0.05
+
+# (profile, monthly income, share of applicants); loan is 300,000 over 24 months
+PROFILES = (
+    ("approved", 90000, 0.5),
+    ("salary_slip", 35000, 0.3),
+    ("rejected", 10000, 0.2),
+)
+
+
+def _pdf(text):
+    """A minimal one-page PDF whose content stream shows text."""
+    content = b"BT /F1 12 Tf 72 720 Td (" + text.encode("latin-1") + b") Tj ET"
+    return (
+        b"%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+        b"2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n"
+        b"3 0 obj << /Type /Page /Parent 2 0 R /Contents 4 0 R >> endobj\n"
+        b"4 0 obj << /Length " + str(len(content)).encode() + b" >> stream\n" + content +
+        b"\nendstream endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n"
+    )
+
+
+def kyc_document(n):
+    return _pdf(f"Government of India Aadhaar No. 1234 5678 {n:04d} Date of Birth 01/01/1990")
+
+
+def salary_slip(n):
+    return _pdf(f"Salary slip Employee {n} Gross salary 40000 Deductions 5000 Net pay 35000")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest rank
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+class Recorder:
+    """Latencies and errors per key ("POST /api/chat", "step:underwriting", ...)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.outcomes = defaultdict(int)
+
+    def record(self, keys, seconds, ok):
+        with self._lock:
+            for key in keys:
+                self.latencies[key].append(seconds)
+                if not ok:
+                    self.errors[key] += 1
+
+    def outcome(self, profile, result):
+        with self._lock:
+            self.outcomes[f"{profile}:{result}"] += 1
+
+    def summary(self, wall_s):
+        out = {}
+        for key in sorted(self.latencies):
+            values = sorted(self.latencies[key])
+            out[key] = {
+                "count": len(values),
+                "errors": self.errors[key],
+                "errorRate": round(self.errors[key] / len(values), 4),
+                "throughputPerS": round(len(values) / wall_s, 1),
+                "p50Ms": round(percentile(values, 50) * 1000, 3),
+                "p95Ms": round(percentile(values, 95) * 1000, 3),
+                "p99Ms": round(percentile(values, 99) * 1000, 3),
+                "maxMs": round(values[-1] * 1000, 3),
+            }
+        return out
+
+
+class Applicant:
+    """One virtual applicant with its own test client."""
+
+    def __init__(self, app_module, recorder, n, profile, income, think_s=0.0):
+        self.app = app_module
+        self.think_s = think_s
+        self.client = app_module.app.test_client()
+        self.recorder = recorder
+        self.n = n
+        self.profile = profile
+        self.income = income
+        self.session_id = self._session_id()
+        self.step = "sales"
+
+    def _session_id(self):
+        # The simulated bureau derives the score from the session id: pick one that fits
+        for attempt in range(1000):
+            session_id = f"load-{self.n}-{attempt}"
+            if simulated_score(session_id) >= 700:
+                return session_id
+        return f"load-{self.n}"
+
+    def call(self, method, path, endpoint, **kwargs):
+        if self.think_s:
+            # Time a person spends reading the reply or picking a file
+            time.sleep(self.think_s)
+        keys = [f"{method} {endpoint}"]
+        if endpoint == "/api/chat":
+            keys.append(f"step:{self.step}")
+        start = time.perf_counter()
+        try:
+            response = self.client.open(path, method=method, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.recorder.record(keys, time.perf_counter() - start, ok)
+        return response if ok else None
+
+    def chat(self):
+        response = self.call("POST", "/api/chat", "/api/chat", json={"sessionId": self.session_id, "message": "continue"})
+        data = response.get_json() if response is not None else {}
+        previous, self.step = self.step, data.get("step", self.step)
+        return data, previous
+
+    def chat_until(self, done_steps):
+        """Chat until the funnel reaches one of done_steps; the last reply, or None on giving up."""
+        for _ in range(MAX_POLLS):
+            data, previous = self.chat()
+            if self.step in done_steps:
+                return data
+            if self.step == previous:
+                # Waiting on something (document inspection); a real user would pause too
+                time.sleep(POLL_INTERVAL_S)
+        return None
+
+    def upload(self, filename, content):
+        return self.call("POST", "/api/upload", "/api/upload", data={
+            "sessionId": self.session_id,
+            "file": (io.BytesIO(content), filename),
+        }, content_type="multipart/form-data")
+
+    def run(self):
+        sid = self.session_id
+        if self.call("POST", "/api/apply", "/api/apply", json={
+            "sessionId": sid, "loan_amount": 300000, "tenure": 24, "income": self.income
+        }) is None:
+            return "apply_failed"
+
+        if self.chat_until({"verification"}) is None:
+            return "stuck_sales"
+        self.upload(f"aadhaar-{self.n}.pdf", kyc_document(self.n))
+
+        reply = self.chat_until({"need_docs", "completed", "rejected"})
+        if reply is not None and self.step == "need_docs":
+            self.upload(f"salary_slip-{self.n}.pdf", salary_slip(self.n))
+            reply = self.chat_until({"completed", "rejected"})
+        if reply is None:
+            return f"stuck_{self.step}"
+
+        if self.step == "completed" and reply.get("pdfId"):
+            self.call("GET", f"/api/download/{reply['pdfId']}", "/api/download/<pdf_id>")
+        self.call("GET", f"/api/status/{sid}", "/api/status/<session_id>")
+        return self.step
+
+
+def configure_backend(args, tmp):
+    """Environment for the app, set before it is imported."""
+    os.environ["DOC_STORE_DIR"] = os.path.join(tmp, "documents")
+    os.environ["LETTER_CACHE_DIR"] = os.path.join(tmp, "letters")
+    os.environ["TRACE_PROFILE_DIR"] = os.path.join(tmp, "profiles")
+    os.environ["LOG_LEVEL"] = "WARNING"
+    os.environ["SESSION_STORE_MAX"] = str(max(10000, args.applicants * 2))
+    os.environ["MONGO_URI"] = args.mongo_uri if args.backend == "mongo" else ""
+    if args.backend == "sqlite":
+        os.environ["LOCAL_STORAGE"] = "sqlite"
+        os.environ["SQLITE_PATH"] = os.path.join(tmp, "sessions.db")
+    else:
+        os.environ["LOCAL_STORAGE"] = "memory"
+
+
+def wait_until_ready(app_module, timeout_s):
+    client = app_module.app.test_client()
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        if client.get("/api/ready").status_code == 200:
+            return
+        time.sleep(0.2)
+    sys.exit(f"App not ready after {timeout_s}s: {client.get('/api/ready').get_json()}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_load(app_module, args):
+    recorder = Recorder()
+    plan = []
+    for n in range(args.applicants):
+        # Deterministic interleaving of the profiles in their proportions
+        position = (n * 0.618034) % 1.0
+        total = 0.0
+        for name, income, share in PROFILES:
+            total += share
+            if position < total:
+                break
+        plan.append((n, name, income))
+
+    lock = threading.Lock()
+    queue = iter(plan)
+
+    def worker():
+        while True:
+            with lock:
+                item = next(queue, None)
+            if item is None:
+                return
+            n, profile, income = item
+            applicant = Applicant(app_module, recorder, n, profile, income, args.think_ms / 1000)
+            try:
+                result = applicant.run()
+            except Exception as e:
+                result = f"exception_{type(e).__name__}"
+            recorder.outcome(profile, result)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - start
+
+    summary = recorder.summary(wall_s)
+    requests = sum(s["count"] for k, s in summary.items() if not k.startswith("step:"))
+    errors = sum(s["errors"] for k, s in summary.items() if not k.startswith("step:"))
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "applicants": args.applicants,
+            "concurrency": args.concurrency,
+            "thinkMs": args.think_ms,
+            "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "wallS": round(wall_s, 3),
+        "requests": requests,
+        "requestsPerS": round(requests / wall_s, 1),
+        "applicantsPerS": round(args.applicants / wall_s, 2),
+        "errorRate": round(errors / requests, 4) if requests else 0,
+        "outcomes": dict(sorted(recorder.outcomes.items())),
+        "endpoints": {k: v for k, v in summary.items() if not k.startswith("step:")},
+        "steps": {k[len("step:"):]: v for k, v in summary.items() if k.startswith("step:")},
+    }
+
+
+def print_report(result):
+    print(f"{result['meta']['applicants']} applicants, concurrency {result['meta']['concurrency']}, "
+          f"{result['meta']['backend']} backend: {result['requests']} requests in {result['wallS']:.2f}s "
+          f"({result['requestsPerS']:,.0f} req/s, {result['applicantsPerS']:,.1f} applicants/s, "
+          f"error rate {result['errorRate']:.2%})")
+    for title, rows in (("endpoint", result["endpoints"]), ("chat at step", result["steps"])):
+        print(f"  {title:<28} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for key, s in rows.items():
+            print(f"  {key:<28} {s['count']:>7} {s['p50Ms']:>9.2f} {s['p95Ms']:>9.2f} {s['p99Ms']:>9.2f} {s['errors']:>7}")
+    print(f"  outcomes: {result['outcomes']}")
+
+
+def print_comparison(result, previous):
+    def change(new, old):
+        return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+    print(f"Compared with {previous['meta'].get('commit')} ({previous['meta'].get('startedAt')}):")
+    print(f"  requests/s {previous['requestsPerS']:,.0f} -> {result['requestsPerS']:,.0f} "
+          f"({change(result['requestsPerS'], previous['requestsPerS'])})")
+    for section in ("endpoints", "steps"):
+        for key, s in result[section].items():
+            old = previous.get(section, {}).get(key)
+            if old:
+                print(f"  {key:<28} p95 {old['p95Ms']:>8.2f} -> {s['p95Ms']:>8.2f} ms ({change(s['p95Ms'], old['p95Ms'])})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--applicants", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--think-ms", type=float, default=0, help="pause before each request, as a person would")
+    parser.add_argument("--backend", choices=("memory", "sqlite", "mongo"), default="memory")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--out", help="JSON artifact path (default bench/results/loadgen-<backend>-<time>.json)")
+    parser.add_argument("--compare", help="earlier artifact to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_backend(args, tmp)
+        import app as app_module
+
+        if args.backend == "mongo":
+            wait_until_ready(app_module, 30)
+        result = run_load(app_module, args)
+
+    out = args.out or os.path.join(
+        BACKEND_DIR, "bench", "results", f"loadgen-{args.backend}-{time.strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print_report(result)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(result, json.load(f))
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
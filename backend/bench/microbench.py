@@ -0,0 +1,277 @@
+"""
+Microbenchmarks for the hot paths, with stored baselines as a regression gate.
+
+Times each benchmark over several rounds and measures its memory with
+tracemalloc: the peak a single call reaches and what it leaves allocated. The
+results are compared with bench/baselines/microbench.json; the run fails when a
+benchmark is slower than its baseline by more than --tolerance, or allocates
+more than --alloc-tolerance over it.
+
+The gate uses the fastest round, which other load on the machine can only slow
+down, and a benchmark past its baseline is measured again (--rechecks times)
+before it counts as a regression: a busy moment fails no run on its own.
+
+Usage (from backend/):
+    python bench/microbench.py [-k pdf [-k sqlite]] [--tolerance 0.25] [--alloc-tolerance 0.10]
+    python bench/microbench.py --save-baseline      # after an intended change
+
+Baselines are machine-specific: record them on the machine that runs the gate.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+BASELINE_PATH = os.path.join(BACKEND_DIR, "bench", "baselines", "microbench.json")
+
+# Each round runs the benchmark for about this long; the fastest round is gated on
+ROUND_S = 0.1
+ROUNDS = 7
+# Further measurements of a benchmark past its baseline before it is reported
+RECHECKS = 2
+# Calls measured under tracemalloc
+ALLOC_CALLS = 50
+# Differences below these are noise, whatever the relative change
+MIN_TIME_DELTA_US = 2.0
+MIN_ALLOC_DELTA_B = 512
+
+COLLECTIONS = ("applications", "documents", "decisions", "sanctions")
+
+
+def configure(tmp):
+    """Environment for the app, set before it is imported: local storage, no Mongo, quiet logs."""
+    os.environ.update({
+        "MONGO_URI": "",
+        "LOCAL_STORAGE": "memory",
+        "WARMUP": "off",
+        "LOG_LEVEL": "WARNING",
+        "DOC_STORE_DIR": os.path.join(tmp, "documents"),
+        "LETTER_CACHE_DIR": os.path.join(tmp, "letters"),
+        "TRACE_PROFILE_DIR": os.path.join(tmp, "profiles"),
+    })
+
+
+def approved_session(prefix):
+    """A session id whose (simulated) credit score passes underwriting."""
+    from services.credit_bureau import simulated_score
+
+    for i in range(1000):
+        session_id = f"{prefix}-{i}"
+        if simulated_score(session_id) >= 700:
+            return session_id
+    raise RuntimeError("No session id with a high enough credit score")
+
+
+def benchmarks(tmp):
+    """(name -> zero-argument callable, reset run between rounds); setup happens here, outside the timings."""
+    import app
+    from agents import underwriting
+    from services import pdf_service
+    from services.session_store import SessionStore
+    from services.sqlite_store import SQLiteStore
+
+    underwriting.compiled_forest()
+    pdf_service.letter_template()
+    decision = {"approved": True, "loan_amount": 300000, "tenure": 24, "emi": 12500, "credit_score": 760}
+
+    sid = approved_session("underwriting")
+    app.write_doc("applications", sid, {"income": 90000, "loan_amount": 300000, "tenure": 24})
+
+    def underwriting_agent():
+        # The agent runs under the step's claim and moves the status on, so every
+        # call starts from the claimed status again
+        app.write_doc("applications", sid, {"status": "scoring"})
+        app.underwriting_agent(sid)
+
+    sanction_sid = approved_session("sanction")
+    app.write_doc("decisions", sanction_sid, decision)
+
+    def sanction_agent():
+        app.write_doc("applications", sanction_sid, {"status": "sanctioning"})
+        app.sanction_agent(sanction_sid)
+
+    def session_round_trip():
+        with app.session_context(sid):
+            app.get_app(sid)
+            app.set_app(sid, {"lastSeen": time.time()})
+
+    def reset_journal():
+        # The agents write the same sessions over and over: commit what they queued
+        # and empty the journal's log, so neither grows from one round to the next
+        app.session_journal.flush()
+        app.journal_db.clear()
+
+    inputs = {"income": 90000, "loan_amount": 300000, "tenure": 24}
+    fields = pdf_service.letter_fields("bench-session", decision, 1700000000)
+
+    suite = {
+        "underwriting_agent": underwriting_agent,
+        "score_and_decide": lambda: underwriting.score_and_decide("bench-score", inputs),
+        "sanction_agent": sanction_agent,
+        "generate_sanction_letter": lambda: pdf_service.generate_sanction_letter("bench-letter", decision),
+        "pdf_stamp": lambda: pdf_service.sanction_letter_pdf("bench-session", decision, 1700000000),
+        "pdf_draw": lambda: pdf_service.draw_sanction_pdf(fields),
+        "app_session_round_trip": session_round_trip,
+    }
+
+    stores = {
+        "memory": SessionStore(COLLECTIONS, max_sessions=10 ** 6),
+        "sqlite": SQLiteStore(os.path.join(tmp, "bench.db"), COLLECTIONS),
+    }
+    for name, store in stores.items():
+        store.applications.update_one({"sessionId": "bench"}, {"$set": {"status": "sales", "income": 90000}}, upsert=True)
+        suite[f"{name}_find_one"] = lambda store=store: store.applications.find_one({"sessionId": "bench"})
+        suite[f"{name}_update_one"] = lambda store=store: store.applications.update_one(
+            {"sessionId": "bench"}, {"$set": {"income": 90000}}, upsert=True)
+        suite[f"{name}_compare_and_set"] = lambda store=store: store.applications.find_one_and_update(
+            {"sessionId": "bench", "status": "sales"}, {"$set": {"status": "sales"}})
+    return suite, reset_journal
+
+
+def time_per_call(fn, reset):
+    """(fastest, median) seconds per call over ROUNDS rounds of about ROUND_S each, and calls per round."""
+    fn()
+    # Calls per round, from how many fit in a fifth of one
+    start = time.perf_counter()
+    calls = 0
+    while time.perf_counter() - start < ROUND_S / 5:
+        fn()
+        calls += 1
+    number = max(1, int(calls * ROUND_S / (time.perf_counter() - start)))
+
+    rounds = []
+    for _ in range(ROUNDS):
+        reset()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return min(rounds), statistics.median(rounds), number
+
+
+def allocations(fn, reset):
+    """(median peak bytes of one call, bytes left allocated per call) under tracemalloc."""
+    fn()
+    reset()
+    tracemalloc.start()
+    try:
+        peaks = []
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(ALLOC_CALLS):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, call_peak = tracemalloc.get_traced_memory()
+            peaks.append(call_peak - current)
+        reset()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks), max(0, after - before) / ALLOC_CALLS
+
+
+def measure(fn, reset):
+    fastest, median, number = time_per_call(fn, reset)
+    peak, retained = allocations(fn, reset)
+    return {
+        "us": round(fastest * 1e6, 2),
+        "medianUs": round(median * 1e6, 2),
+        "callsPerRound": number,
+        "peakBytes": peak,
+        "retainedBytesPerCall": round(retained, 1),
+    }
+
+
+def run(suite, reset, patterns):
+    """Results of the benchmarks whose name contains any of patterns (all of them if none)."""
+    return {
+        name: measure(fn, reset)
+        for name, fn in suite.items()
+        if not patterns or any(pattern in name for pattern in patterns)
+    }
+
+
+def recheck(suite, reset, results, baseline, tolerance, alloc_tolerance, rechecks=RECHECKS):
+    """Measure the benchmarks past their baseline again, up to rechecks times, keeping the best of each figure."""
+    for _ in range(rechecks):
+        suspects = [name for name in results if regressions({name: results[name]}, baseline, tolerance, alloc_tolerance)]
+        for name in suspects:
+            again = measure(suite[name], reset)
+            best = {key: min(results[name][key], again[key]) for key in ("us", "peakBytes", "retainedBytesPerCall")}
+            results[name].update(best)
+
+
+def regressions(results, baseline, tolerance, alloc_tolerance):
+    """Human-readable lines for every benchmark past its baseline's tolerance."""
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["us"] - base["us"] > max(MIN_TIME_DELTA_US, base["us"] * tolerance):
+            found.append(f"{name}: {base['us']:.1f} -> {result['us']:.1f} us")
+        for key in ("peakBytes", "retainedBytesPerCall"):
+            if result[key] - base[key] > max(MIN_ALLOC_DELTA_B, base[key] * alloc_tolerance):
+                found.append(f"{name}: {key} {base[key]:,.0f} -> {result[key]:,.0f}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="patterns", action="append",
+                        help="only benchmarks whose name contains this (repeat for several)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--alloc-tolerance", type=float, default=0.10, help="allowed growth in allocations")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--rechecks", type=int, default=RECHECKS,
+                        help="times a benchmark past its baseline is measured again before it is reported")
+    parser.add_argument("--save-baseline", action="store_true", help="record these results as the baseline")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(tmp)
+        suite, reset = benchmarks(tmp)
+        results = run(suite, reset, args.patterns)
+        if not args.save_baseline:
+            recheck(suite, reset, results, baseline, args.tolerance, args.alloc_tolerance, args.rechecks)
+
+    print(f"  {'benchmark':<28} {'us/call':>10} {'median':>10} {'baseline':>10} {'peak KiB':>9} {'kept B/call':>12}")
+    for name, r in results.items():
+        base = baseline.get(name, {}).get("us")
+        base_text = f"{base:>10.1f}" if base is not None else f"{'-':>10}"
+        print(f"  {name:<28} {r['us']:>10.1f} {r['medianUs']:>10.1f} {base_text} "
+              f"{r['peakBytes'] / 1024:>9.1f} {r['retainedBytesPerCall']:>12.0f}")
+
+    if args.save_baseline:
+        # Keep the baselines of benchmarks that were filtered out of this run
+        merged = {**baseline, **results}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"python": sys.version.split()[0], "benchmarks": merged}, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    found = regressions(results, baseline, args.tolerance, args.alloc_tolerance)
+    if found:
+        print("Regressions:")
+        for line in found:
+            print(f"  {line}")
+        sys.exit(1)
+    if baseline:
+        print(f"No regressions (time tolerance {args.tolerance:.0%}, allocation tolerance {args.alloc_tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
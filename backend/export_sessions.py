@@ -0,0 +1,166 @@
+"""
+Export sessions (application, documents, decision and sanction, joined by
+sessionId) to NDJSON or CSV part files, for analytics.
+
+Reads MongoDB (MONGO_URI) or else the SQLite store (SQLITE_PATH) directly, not
+through the server; in-memory storage lives inside the server process, so use
+GET /api/export for it. The applications are read through one batched cursor
+and joined a batch at a time, so memory stays bounded by --batch whatever the
+size of the dataset. Filters select sessions by status and by when their status
+last changed (statusAt); statusAt is indexed, so a nightly export reads only the
+day's sessions. Parts are written under a temporary name and renamed when complete;
+manifest.json lists them with the filters and counts.
+
+Usage (from backend/):
+    python export_sessions.py --out exports/2025-01-01 --since 2025-01-01 --until 2025-01-02
+    python export_sessions.py --out exports/funnel --format csv --status completed,rejected --gzip
+    python export_sessions.py --out - --status need_docs     # NDJSON on stdout
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from services.export import FORMATS, export_query, joined_batches, parse_time, render
+from services.mongo_setup import COLLECTIONS, LOG_COLLECTIONS, client_options
+from services.sqlite_store import SQLiteStore
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def open_database(args):
+    """(database, description) for the configured storage."""
+    if args.mongo_uri:
+        from pymongo import MongoClient
+
+        client = MongoClient(args.mongo_uri, **client_options())
+        return client[args.mongo_db], f"MongoDB {args.mongo_db}"
+    if not os.path.exists(args.sqlite_path):
+        raise SystemExit(f"No SQLite store at {args.sqlite_path} (set MONGO_URI or SQLITE_PATH)")
+    return SQLiteStore(args.sqlite_path, COLLECTIONS, logs=LOG_COLLECTIONS), f"SQLite {args.sqlite_path}"
+
+
+class PartWriter:
+    """Writes rows to numbered part files of at most rows_per_file rows each."""
+
+    def __init__(self, out_dir, fmt, rows_per_file, compress):
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.rows_per_file = rows_per_file
+        self.compress = compress
+        self.parts = []
+        self._file = None
+        self._path = None
+        self._rows = 0
+
+    def _open(self):
+        name = f"part-{len(self.parts):05d}.{self.fmt}" + (".gz" if self.compress else "")
+        self._path = os.path.join(self.out_dir, name)
+        tmp = self._path + ".tmp"
+        self._file = gzip.open(tmp, "wt", encoding="utf-8", newline="") if self.compress \
+            else open(tmp, "w", encoding="utf-8", newline="")
+        self._file.write(render([], self.fmt, header=True))
+        self._rows = 0
+
+    def _close(self):
+        self._file.close()
+        os.replace(self._path + ".tmp", self._path)
+        self.parts.append({"file": os.path.basename(self._path), "sessions": self._rows})
+        self._file = None
+
+    def write(self, rows):
+        while rows:
+            if self._file is None:
+                self._open()
+            take = rows[:self.rows_per_file - self._rows]
+            self._file.write(render(take, self.fmt))
+            self._rows += len(take)
+            rows = rows[len(take):]
+            if self._rows >= self.rows_per_file:
+                self._close()
+
+    def close(self):
+        if self._file is not None:
+            self._close()
+
+    def abort(self):
+        """Stop without publishing the part in progress; its .tmp file is left behind."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="directory for the part files, or - for stdout")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="ndjson")
+    parser.add_argument("--status", default="", help="comma-separated statuses to export (default: all)")
+    parser.add_argument("--since", help="status changed at or after: ISO date/datetime (UTC) or epoch seconds")
+    parser.add_argument("--until", help="status changed before: ISO date/datetime (UTC) or epoch seconds")
+    parser.add_argument("--batch", type=int, default=1000, help="sessions read and joined at a time")
+    parser.add_argument("--rows-per-file", type=int, default=100_000)
+    parser.add_argument("--gzip", action="store_true", help="gzip the part files")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", ""))
+    parser.add_argument("--mongo-db", default="ai_loan_advisor")
+    parser.add_argument("--sqlite-path", default=os.getenv("SQLITE_PATH", os.path.join(BACKEND_DIR, "data", "sessions.db")))
+    args = parser.parse_args()
+    if args.batch < 1 or args.rows_per_file < 1:
+        parser.error("--batch and --rows-per-file must be positive")
+
+    try:
+        statuses = [s for s in args.status.split(",") if s]
+        query = export_query(statuses, parse_time(args.since), parse_time(args.until))
+    except ValueError as e:
+        parser.error(str(e))
+    database, source = open_database(args)
+    start = time.perf_counter()
+    sessions = 0
+
+    if args.out == "-":
+        sys.stdout.write(render([], args.format, header=True))
+        for rows in joined_batches(database, query, args.batch):
+            sys.stdout.write(render(rows, args.format))
+            sessions += len(rows)
+        print(f"Exported {sessions:,} sessions from {source} in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+        return
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, "manifest.json")
+    if os.path.exists(manifest_path):
+        # A previous export's parts are about to be overwritten
+        os.remove(manifest_path)
+    writer = PartWriter(args.out, args.format, args.rows_per_file, args.gzip)
+    try:
+        for rows in joined_batches(database, query, args.batch):
+            writer.write(rows)
+            sessions += len(rows)
+            print(f"  {sessions:,} sessions", file=sys.stderr, end="\r", flush=True)
+    except BaseException:
+        # No manifest: an incomplete export is never mistaken for a finished one
+        writer.abort()
+        raise
+    writer.close()
+
+    manifest = {
+        "source": source,
+        "query": query,
+        "format": args.format,
+        "gzip": args.gzip,
+        "sessions": sessions,
+        "parts": writer.parts,
+        "exportedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "durationS": round(time.perf_counter() - start, 3),
+    }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Exported {sessions:,} sessions from {source} to {len(writer.parts)} file(s) in {args.out} "
+          f"in {manifest['durationS']:.1f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
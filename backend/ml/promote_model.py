@@ -0,0 +1,49 @@
+"""
+List published model versions, or make one current.
+
+Running workers follow MODEL_DIR/CURRENT and swap to the new version within
+MODEL_POLL_S, without a restart. Check the candidate's shadow agreement and
+latency at /api/models before promoting it.
+
+Usage (from backend/):
+    python ml/promote_model.py               # list versions, the current one marked
+    python ml/promote_model.py 20250101T000000
+"""
+import argparse
+import json
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services import model_store  # noqa: E402
+
+MODELS_DIR = os.path.join(BACKEND_DIR, "ml", "models")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("version", nargs="?", help="version to make current")
+    parser.add_argument("--models-dir", default=os.getenv("MODEL_DIR", MODELS_DIR))
+    args = parser.parse_args()
+
+    if args.version:
+        model_store.promote(args.models_dir, args.version)
+        print(f"{args.version} is now the current model in {args.models_dir}")
+        return
+
+    current = model_store.current_version(args.models_dir)
+    for version in model_store.versions(args.models_dir):
+        try:
+            with open(os.path.join(args.models_dir, version, model_store.META_FILE)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {}
+        marker = "*" if version == current else " "
+        rows = f"{meta['rows']:,} rows" if "rows" in meta else ""
+        print(f"{marker} {version:<20} {rows:>16}  accuracy {meta.get('accuracy', '-')}  trained {meta.get('trainedAt', '-')}")
+
+
+if __name__ == "__main__":
+    main()
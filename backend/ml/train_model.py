@@ -1,26 +1,216 @@
-import joblib
+"""
+Train the underwriting model and publish it as a versioned, memory-mappable artifact.
+
+Rows are generated (synthetic, the same distribution as before) or read from a
+CSV of historical decisions in chunks of --chunk-rows, so memory stays bounded by
+one chunk however many rows there are. The random forest is grown chunk by
+chunk with warm_start: each chunk adds its share of the --trees trees, built on
+all cores (--jobs). A slice of every chunk (--holdout) is kept back to evaluate
+the finished forest.
+
+The forest is compiled (services/forest.py) and written to
+<models-dir>/<version>/forest.joblib with a meta.json holding the training
+time, peak memory and holdout accuracy, then made the current version that
+agents/underwriting.py loads (memory-mapped, so the app's worker processes share
+one copy of the model).
+
+Usage (from backend/):
+    python ml/train_model.py --rows 5000000 [--chunk-rows 1000000] [--trees 100] [--jobs -1]
+    python ml/train_model.py --csv decisions.csv     # columns: income,loan_amount,tenure,approved
+    python ml/train_model.py --rows 1000 --no-promote  # publish without making it current
+"""
+import argparse
+import csv
+import itertools
+import math
+import os
+import platform
+import resource
+import sys
+import time
+
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
 
-np.random.seed(42)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services import model_store  # noqa: E402
+from services.forest import CompiledForest  # noqa: E402
+
+MODELS_DIR = os.path.join(BACKEND_DIR, "ml", "models")
+FEATURES = ("income", "loan_amount", "tenure")
+LABEL = "approved"
+# Holdout rows kept across all chunks for evaluation
+MAX_EVAL_ROWS = 200_000
+# Holdout rows on which the compiled forest is checked against sklearn
+PARITY_ROWS = 10_000
+
+
+def synthetic_chunks(rows, chunk_rows, seed):
+    """(X, y) chunks of synthetic applications; chunk i is the same whatever the chunk count."""
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        n = min(chunk_rows, rows - start)
+        rng = np.random.default_rng([seed, i])
+        X = rng.random((n, 3))
+        X[:, 0] *= 100000  # income
+        X[:, 1] *= 500000  # loan amount
+        X[:, 2] = (X[:, 2] * 60 + 6).astype(int)  # tenure 6-66 months
+
+        # Rule of thumb: approve if EMI < 40% of income
+        # EMI approximation: loan_amount / tenure
+        emi = X[:, 1] / X[:, 2]
+        y = (emi < 0.4 * X[:, 0]).astype(np.int8)
+        yield X, y
+
+
+def count_csv_rows(path):
+    with open(path, "rb") as f:
+        return max(0, sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1)
+
+
+def csv_chunks(path, chunk_rows):
+    """(X, y) chunks from a CSV with a header row naming FEATURES and LABEL."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        missing = [c for c in (*FEATURES, LABEL) if c not in header]
+        if missing:
+            raise ValueError(f"{path} has no column(s): {', '.join(missing)}")
+        columns = [header.index(c) for c in (*FEATURES, LABEL)]
+        while True:
+            block = [[row[c] for c in columns] for row in itertools.islice(reader, chunk_rows)]
+            if not block:
+                return
+            data = np.array(block, dtype=np.float64)
+            yield data[:, :3], data[:, 3].astype(np.int8)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (Linux reports KiB, macOS bytes)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def train(chunks, n_chunks, trees, jobs, holdout, seed, min_samples_leaf, max_depth):
+    """Grow the forest chunk by chunk; returns (model, X_eval, y_eval, timings).
+
+    Raises ValueError, before fitting it, on a chunk whose training rows lack one of the labels.
+    """
+    if trees < n_chunks:
+        raise ValueError(f"--trees ({trees}) must be at least the number of chunks ({n_chunks})")
+    # Trees per chunk, spread as evenly as possible
+    shares = [len(part) for part in np.array_split(np.arange(trees), n_chunks)]
+    eval_per_chunk = MAX_EVAL_ROWS // n_chunks
+
+    model = RandomForestClassifier(
+        n_estimators=0, warm_start=True, n_jobs=jobs, random_state=seed,
+        min_samples_leaf=min_samples_leaf, max_depth=max_depth,
+    )
+    X_eval, y_eval = [], []
+    read_s = fit_s = 0.0
+    rows = 0
+    chunks = iter(chunks)
+    for i in itertools.count():
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        read_s += time.perf_counter() - start
+        if chunk is None:
+            break
+        if i >= n_chunks:
+            raise ValueError("More chunks than counted; did the input change while training?")
+        X, y = chunk
+        split = len(X) - min(eval_per_chunk, int(len(X) * holdout))
+        # Each warm_start fit takes its classes from its own chunk: trees grown on a
+        # chunk with one class predict a single column the others don't line up with
+        labels = np.unique(y[:split])
+        if not np.array_equal(labels, [0, 1]):
+            raise ValueError(
+                f"Chunk {i + 1}/{n_chunks} has {LABEL}={labels.tolist()} only in its training rows; "
+                f"every chunk needs both approved and rejected rows (shuffle the input, e.g. one "
+                f"sorted by {LABEL}, or raise --chunk-rows)"
+            )
+        X_eval.append(X[split:])
+        y_eval.append(y[split:])
+        rows += split
+
+        start = time.perf_counter()
+        model.n_estimators += shares[i]
+        model.fit(X[:split], y[:split])
+        fit_s += time.perf_counter() - start
+        print(f"  chunk {i + 1}/{n_chunks}: {split:,} rows, {model.n_estimators} trees, "
+              f"peak RSS {peak_rss_mb():,.0f} MB", flush=True)
+
+    timings = {"readS": round(read_s, 3), "fitS": round(fit_s, 3), "trainRows": rows}
+    return model, np.concatenate(X_eval), np.concatenate(y_eval), timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--rows", type=int, default=1000, help="synthetic rows to train on")
+    source.add_argument("--csv", help="CSV of historical decisions instead of synthetic rows")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--jobs", type=int, default=-1, help="cores to build trees on (-1 = all)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="share of each chunk kept for evaluation")
+    parser.add_argument("--min-samples-leaf", type=int, default=1)
+    parser.add_argument("--max-depth", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--models-dir", default=os.getenv("MODEL_DIR", MODELS_DIR))
+    parser.add_argument("--version", help="version name (default: the training timestamp)")
+    parser.add_argument("--no-promote", action="store_true", help="publish without making it the current version")
+    args = parser.parse_args()
 
-# Generate synthetic dataset for underwriting
-# Features: [income, loan_amount, tenure]
-X = np.random.rand(1000, 3)
-X[:, 0] *= 100000  # income
-X[:, 1] *= 500000  # loan amount
-X[:, 2] = (X[:, 2] * 60 + 6).astype(int)  # tenure 6-66 months
+    if args.csv:
+        total = count_csv_rows(args.csv)
+        chunks = csv_chunks(args.csv, args.chunk_rows)
+    else:
+        total = args.rows
+        chunks = synthetic_chunks(args.rows, args.chunk_rows, args.seed)
+    if total <= 0:
+        parser.error("no rows to train on")
+    n_chunks = math.ceil(total / args.chunk_rows)
+    print(f"Training on {total:,} rows in {n_chunks} chunk(s), {args.trees} trees, jobs={args.jobs}")
 
-# Rule of thumb: approve if EMI < 40% of income
-# EMI approximation: loan_amount / tenure
-emi = X[:, 1] / X[:, 2]
-y = (emi < 0.4 * X[:, 0]).astype(int)
+    start = time.perf_counter()
+    try:
+        model, X_eval, y_eval, timings = train(
+            chunks, n_chunks, args.trees, args.jobs, args.holdout, args.seed, args.min_samples_leaf, args.max_depth
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    compile_start = time.perf_counter()
+    forest = CompiledForest(model)
+    timings["compileS"] = round(time.perf_counter() - compile_start, 3)
+    timings["totalS"] = round(time.perf_counter() - start, 3)
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    proba = forest.predict_proba(X_eval)[:, 1]
+    sample = X_eval[:PARITY_ROWS]
+    meta = {
+        "source": os.path.abspath(args.csv) if args.csv else f"synthetic(seed={args.seed})",
+        "rows": total,
+        "evalRows": len(X_eval),
+        "accuracy": round(float(np.mean((proba >= 0.5) == y_eval)), 5) if len(X_eval) else None,
+        "compiledMatchesSklearn": bool(np.array_equal(forest.predict_proba(sample), model.predict_proba(sample))),
+        "trees": forest.n_trees,
+        "nodes": int(len(forest.feature)),
+        "grid": forest.grid is not None,
+        "params": {k: v for k, v in model.get_params().items() if k in ("min_samples_leaf", "max_depth", "random_state")},
+        "chunkRows": args.chunk_rows,
+        "jobs": args.jobs,
+        "cpus": os.cpu_count(),
+        "timings": timings,
+        "peakRssMb": peak_rss_mb(),
+        "trainedAt": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+    }
+    version = model_store.save(args.models_dir, forest, meta, version=args.version, make_current=not args.no_promote)
+    print(f"Accuracy {meta['accuracy']} on {meta['evalRows']:,} holdout rows; "
+          f"trained in {timings['totalS']:.1f} s, peak RSS {meta['peakRssMb']:,.0f} MB")
+    print(f"Saved model {version} to {os.path.join(args.models_dir, version)}"
+          + ("" if args.no_promote else " (current)"))
 
-clf = RandomForestClassifier(n_estimators=100, random_state=42)
-clf.fit(X_train, y_train)
 
-joblib.dump(clf, "backend/ml/model.pkl")
-print("Model saved to backend/ml/model.pkl")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import abc
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from services.metrics import registry
+from services.tracing import span
+
+CREDIT_SCORE_LOOKUPS = registry.counter(
+    "credit_score_lookups_total",
+    "Credit score lookups by result: hit (cached), joined (pull already running) or pulled",
+    ("result",)
+)
+BUREAU_PULL_SECONDS = registry.histogram(
+    "credit_bureau_pull_duration_seconds", "Credit bureau pulls by outcome", ("outcome",)
+)
+
+
+class CreditScoreProvider(abc.ABC):
+    """Source of credit scores. pull(applicant_id) returns an int score or raises."""
+
+    @abc.abstractmethod
+    def pull(self, applicant_id: str) -> int:
+        """The applicant's score; called on CreditScores' pool threads."""
+
+
+def simulated_score(applicant_id: str) -> int:
+    """Score in 650-849 derived from the applicant id; the same in every process and run."""
+    digest = hashlib.sha256(applicant_id.encode("utf-8")).digest()
+    return 650 + int.from_bytes(digest[:8], "big") % 200
+
+
+class SimulatedBureau(CreditScoreProvider):
+    """Stand-in for the bureau API: simulated_score after latency_ms (+/- jitter) of waiting."""
+
+    def __init__(self, latency_ms=0.0, jitter=0.2):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+
+    def pull(self, applicant_id: str) -> int:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000 * random.uniform(1 - self.jitter, 1 + self.jitter))
+        return simulated_score(applicant_id)
+
+
+class CreditScores:
+    """TTL cache with single-flight pulls in front of a CreditScoreProvider.
+
+    A cached score is served for ttl_s (up to max_entries applicants, least
+    recently used first out). On a miss exactly one pull per applicant runs, on
+    a small thread pool; concurrent lookups for the same applicant wait on it.
+    prefetch() starts that pull without waiting, so a score requested early
+    (when the application is saved) is ready by underwriting. Failed pulls are
+    not cached: every waiter gets the error and the next lookup tries again.
+    """
+
+    def __init__(self, provider, ttl_s=86400.0, max_entries=100000, workers=32, timeout_s=10.0):
+        self.provider = provider
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.timeout_s = timeout_s
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="credit-bureau")
+        self._cache = OrderedDict()  # applicant_id -> (score, pulled at)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, applicant_id):
+        """(score or None, future or None, started); caller holds the lock."""
+        entry = self._cache.get(applicant_id)
+        if entry is not None:
+            if time.time() - entry[1] < self.ttl_s:
+                self._cache.move_to_end(applicant_id)
+                return entry[0], None, False
+            del self._cache[applicant_id]
+        future = self._inflight.get(applicant_id)
+        if future is not None:
+            return None, future, False
+        future = self._inflight[applicant_id] = Future()
+        return None, future, True
+
+    def _start(self, applicant_id, future):
+        try:
+            self._pool.submit(self._pull, applicant_id, future)
+        except RuntimeError as e:
+            # Pool shut down (interpreter exit): fail the waiters instead of hanging them
+            self._finish(applicant_id, future, error=e)
+
+    def _pull(self, applicant_id, future):
+        start = time.perf_counter()
+        try:
+            score = int(self.provider.pull(applicant_id))
+        except Exception as e:
+            BUREAU_PULL_SECONDS.observe(time.perf_counter() - start, outcome="error")
+            self._finish(applicant_id, future, error=e)
+            return
+        BUREAU_PULL_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+        self._finish(applicant_id, future, score=score)
+
+    def _finish(self, applicant_id, future, score=None, error=None):
+        with self._lock:
+            self._inflight.pop(applicant_id, None)
+            if error is None:
+                self._cache[applicant_id] = (score, time.time())
+                self._cache.move_to_end(applicant_id)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        if error is None:
+            future.set_result(score)
+        else:
+            future.set_exception(error)
+
+    def get(self, applicant_id: str) -> int:
+        """The applicant's score, pulling it (once, however many callers) on a miss."""
+        with self._lock:
+            score, future, started = self._lookup(applicant_id)
+        if score is not None:
+            CREDIT_SCORE_LOOKUPS.inc(result="hit")
+            return score
+        CREDIT_SCORE_LOOKUPS.inc(result="pulled" if started else "joined")
+        if started:
+            self._start(applicant_id, future)
+        with span("credit_bureau.wait", started=started):
+            return future.result(timeout=self.timeout_s)
+
+    def prefetch(self, applicant_id: str):
+        """Start pulling the applicant's score unless it is cached or already being pulled."""
+        with self._lock:
+            _, future, started = self._lookup(applicant_id)
+        if started:
+            self._start(applicant_id, future)
+
+    def stats(self):
+        with self._lock:
+            return {"cached": len(self._cache), "inflight": len(self._inflight), "ttlS": self.ttl_s}
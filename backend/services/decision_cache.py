@@ -0,0 +1,77 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from services.metrics import registry
+
+DECISION_CACHE_LOOKUPS = registry.counter(
+    "decision_cache_lookups_total", "Underwriting decision cache lookups by result (hit or miss)", ("result",)
+)
+DECISION_CACHE_INVALIDATIONS = registry.counter(
+    "decision_cache_invalidations_total", "Cached underwriting decisions dropped because their inputs changed"
+)
+
+
+def fingerprint(*inputs):
+    """Short stable digest of JSON-serializable inputs."""
+    encoded = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class DecisionCache:
+    """Per-session memo of an underwriting result, valid while its input fingerprint holds.
+
+    get() returns the cached result only when the fingerprint matches the one it
+    was stored under, so a result is never served for inputs it was not computed
+    from, even if an invalidate() was missed (another process took the write).
+    invalidate() drops a session's entry as soon as its inputs are known to have
+    changed. At most max_entries sessions are kept, least recently used first out.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # session_id -> (fingerprint, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, session_id, key):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            hit = entry is not None and entry[0] == key
+            if hit:
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+        DECISION_CACHE_LOOKUPS.inc(result="hit" if hit else "miss")
+        # A copy, so the caller may add to the reply without touching the cache
+        return dict(entry[1]) if hit else None
+
+    def put(self, session_id, key, result):
+        with self._lock:
+            self._entries[session_id] = (key, dict(result))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            dropped = self._entries.pop(session_id, None) is not None
+            if dropped:
+                self.invalidations += 1
+        if dropped:
+            DECISION_CACHE_INVALIDATIONS.inc()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else None,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,318 @@
+import base64
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Characters of extracted text kept on the inspection result
+TEXT_KEEP = 2000
+
+_MAGIC = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/msword"),
+    (b"PK\x03\x04", "application/zip"),
+]
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Words that mark a document as one kind or the other; the kind with more hits wins
+KIND_PATTERNS = {
+    "salary_slip": re.compile(
+        r"\b(salary|pay\s?slip|pay\s?stub|net\s+pay|gross\s+(pay|salary|earnings)|basic\s+pay|"
+        r"earnings|deductions|provident\s+fund|take\s+home)\b", re.I),
+    "kyc": re.compile(
+        r"\b(aadhaar|aadhar|uidai|permanent\s+account\s+number|income\s+tax\s+department|"
+        r"government\s+of\s+india|passport|voter|date\s+of\s+birth|dob)\b", re.I),
+}
+FILENAME_PATTERNS = {
+    "salary_slip": re.compile(r"salary|slip|payslip", re.I),
+    "kyc": re.compile(r"aadhaa?r|(?<![a-z])pan(?![a-z])|passport|kyc|voter", re.I),
+}
+
+_PDF_STREAM = re.compile(rb"<<(.*?)>>\s*stream\r?\n(.*?)\r?\n?endstream", re.S)
+_PDF_FILTER = re.compile(rb"/Filter\s*(\[[^\]]*\]|/\w+)")
+_PDF_PAGE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+_PDF_TEXT_BLOCK = re.compile(rb"BT(.*?)ET", re.S)
+_PDF_STRING = re.compile(rb"\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>(?=\s*(?:Tj|TJ|'|\"|\]|[\s<(-]))", re.S)
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+def sniff_mime(head: bytes) -> str:
+    """MIME type from the file's leading bytes, ignoring its name and declared type."""
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            if mime == "application/zip" and b"word/" in head:
+                return DOCX_MIME
+            return mime
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError:
+        # A multi-byte character cut off at the end of head is still text
+        try:
+            head[:-3].decode("utf-8")
+        except UnicodeDecodeError:
+            return "application/octet-stream"
+    return "text/plain"
+
+
+def _unescape_pdf_string(raw: bytes) -> str:
+    if raw.startswith(b"<"):
+        digits = re.sub(rb"\s", b"", raw[1:-1])
+        if len(digits) % 2:
+            digits += b"0"
+        return bytes.fromhex(digits.decode("ascii")).decode("latin-1")
+
+    out = bytearray()
+    body = raw[1:-1]
+    i = 0
+    while i < len(body):
+        ch = body[i:i + 1]
+        if ch != b"\\":
+            out += ch
+            i += 1
+            continue
+        nxt = body[i + 1:i + 2]
+        octal = re.match(rb"[0-7]{1,3}", body[i + 1:i + 4])
+        if octal:
+            out.append(int(octal.group(), 8) & 0xFF)
+            i += 1 + len(octal.group())
+        elif nxt in (b"\n", b"\r"):
+            i += 2
+        else:
+            out += _PDF_ESCAPES.get(nxt, nxt)
+            i += 2
+    return out.decode("latin-1")
+
+
+def _decode_stream(info: bytes, data: bytes):
+    """Undo the ASCII85/Flate filters ReportLab and most producers use; None if unsupported."""
+    declared = _PDF_FILTER.search(info)
+    for name in re.findall(rb"/(\w+)", declared.group(1)) if declared else []:
+        if name in (b"ASCII85Decode", b"A85"):
+            data = data.strip()
+            if data.startswith(b"<~"):
+                data = data[2:]
+            if data.endswith(b"~>"):
+                data = data[:-2]
+            data = base64.a85decode(data)
+        elif name in (b"FlateDecode", b"Fl"):
+            data = zlib.decompress(data)
+        else:
+            return None
+    return data
+
+
+def pdf_text(data: bytes):
+    """(page count, text) from a PDF's own bytes.
+
+    A deliberately small extractor: it reads the text-showing operators of every
+    content stream it can decode, which covers generated statements and payslips.
+    Scanned PDFs have no text and yield an empty string.
+    """
+    pages = len(_PDF_PAGE.findall(data))
+    chunks = []
+    for info, stream in _PDF_STREAM.findall(data):
+        try:
+            content = _decode_stream(info, stream)
+        except Exception:
+            continue
+        if not content or b"BT" not in content:
+            continue
+        for block in _PDF_TEXT_BLOCK.findall(content):
+            line = "".join(_unescape_pdf_string(s) for s in _PDF_STRING.findall(block))
+            if line.strip():
+                chunks.append(line)
+    return pages, "\n".join(chunks)
+
+
+def docx_text(path: str) -> str:
+    with zipfile.ZipFile(path) as z:
+        xml = z.read("word/document.xml").decode("utf-8", "replace")
+    xml = re.sub(r"</w:p>", "\n", xml)
+    return re.sub(r"<[^>]+>", "", xml)
+
+
+def classify_text(text: str):
+    """(kind, hits) for the kind whose keywords occur most in text, or (None, 0)."""
+    best, best_hits = None, 0
+    for kind, pattern in KIND_PATTERNS.items():
+        hits = len(pattern.findall(text))
+        if hits > best_hits:
+            best, best_hits = kind, hits
+    return best, best_hits
+
+
+def inspect_document(path: str) -> dict:
+    """Inspect one stored document. Runs in a worker process.
+
+    Looks only at the content, never the file name, so the result can be cached
+    by content hash and shared by every upload of the same bytes.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    mime = sniff_mime(data[:4096])
+    pages = None
+    text = ""
+    error = None
+    try:
+        if mime == "application/pdf":
+            pages, text = pdf_text(data)
+        elif mime == DOCX_MIME:
+            text = docx_text(path)
+        elif mime == "text/plain":
+            text = data.decode("utf-8", "replace")
+    except Exception as e:
+        error = str(e)
+
+    kind, hits = classify_text(text)
+    return {
+        "mime": mime,
+        "size": len(data),
+        "pages": pages,
+        "textChars": len(text),
+        "text": text[:TEXT_KEEP],
+        "kind": kind,
+        "keywordHits": hits,
+        "error": error
+    }
+
+
+def document_kind(inspection: dict, filename: str = ""):
+    """What a file is, from its inspection; the file name is used only as a last resort.
+
+    Content keywords decide whenever the document has readable text. Files with
+    none (photos, scans) fall back to the name the applicant gave them.
+    """
+    if inspection.get("kind"):
+        return inspection["kind"]
+    if inspection.get("textChars"):
+        return "other"
+    for kind, pattern in FILENAME_PATTERNS.items():
+        if pattern.search(filename or ""):
+            return kind
+    return "other"
+
+
+class DocumentInspector:
+    """Runs inspect_document on a process pool, off the request path.
+
+    Results are cached by content digest (LRU, up to keep entries), and a digest
+    already being inspected is not submitted twice: the caller gets the same future.
+
+    The workers are forked: call start() while the process has no other threads,
+    as a fork copies any lock another thread holds into a child that can never
+    release it. spawn and forkserver workers would re-import the server's
+    __main__ instead, starting its storage and MongoDB connection in every one.
+    Without start() the first submit forks them. shutdown() stops them.
+    """
+
+    def __init__(self, max_workers=2, keep=10000):
+        self.max_workers = max_workers
+        self.keep = keep
+        self._pool = None
+        self._pid = None
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Fork the pool's workers now, unless this process already has them."""
+        with self._lock:
+            self._executor()
+
+    def shutdown(self):
+        """Stop this process's workers, waiting for inspections already running; registered with atexit."""
+        with self._lock:
+            pool = self._pool if self._pid == os.getpid() else None
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _executor(self):
+        """The pool, created (and its workers forked) if this process has none; caller holds _lock."""
+        if self._pool is None or self._pid != os.getpid():
+            # A pool inherited through a fork has no manager thread and belongs to the parent
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("fork")
+            )
+            self._pid = os.getpid()
+            # Fork-context pools launch every worker on their first submit
+            self._pool.submit(sniff_mime, b"")
+        return self._pool
+
+    def cached(self, digest):
+        with self._lock:
+            result = self._cache.get(digest)
+            if result is not None:
+                self._cache.move_to_end(digest)
+            return result
+
+    def submit(self, digest, path, on_done=None):
+        """Inspect the document at path (stored under digest); returns a Future.
+
+        on_done(digest, result) is called once the result is known, including
+        straight away on a cache hit; it runs on a pool callback thread.
+        """
+        started = False
+        with self._lock:
+            result = self._cache.get(digest)
+            future = self._inflight.get(digest)
+            if result is None and future is None:
+                try:
+                    future = self._executor().submit(inspect_document, path)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM on a hostile file); start a fresh pool. This
+                    # fork does happen with threads running, but the workers only unpickle
+                    # and run inspect_document, taking no lock the server's threads use
+                    self._pool = None
+                    future = self._executor().submit(inspect_document, path)
+                self._inflight[digest] = future
+                started = True
+        if started:
+            # Outside the lock: a future that is already done runs this immediately
+            future.add_done_callback(lambda f: self._finish(digest, f))
+
+        if result is not None:
+            future = Future()
+            future.set_result(result)
+        if on_done is not None:
+            def done(f):
+                if f.exception() is None:
+                    on_done(digest, f.result())
+            future.add_done_callback(done)
+        return future
+
+    def _finish(self, digest, future):
+        with self._lock:
+            self._inflight.pop(digest, None)
+            if future.exception() is not None:
+                return
+            self._cache[digest] = future.result()
+            while len(self._cache) > self.keep:
+                self._cache.popitem(last=False)
+
+    def wait(self, digest, timeout):
+        """The result for digest, waiting up to timeout seconds; None if not ready."""
+        result = self.cached(digest)
+        if result is not None:
+            return result
+        with self._lock:
+            future = self._inflight.get(digest)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None
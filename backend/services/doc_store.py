@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DocumentTooLarge(Exception):
+    """Raised while writing a document once it passes the store's max_bytes."""
+
+
+class DocumentWriter:
+    """Writable, readable temp file that hashes and counts what is written to it.
+
+    Handed to the multipart parser as the file's container, so the upload goes
+    to disk chunk by chunk as it is parsed and is never held in memory. commit()
+    moves it into the store under its SHA-256; a writer closed without commit
+    (rejected or failed request) leaves nothing behind.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=store.tmp_dir, suffix=".part", delete=False)
+        self._committed = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.store.max_bytes and self.size > self.store.max_bytes:
+            # The parser drops its reference on error, so clean up here
+            self.close()
+            raise DocumentTooLarge(f"Document exceeds {self.store.max_bytes} bytes")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def commit(self):
+        """Store the content; returns {digest, size, deduplicated}. Safe to call twice."""
+        if self._committed is not None:
+            return self._committed
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        digest = self.digest
+        path = self.store.path(digest)
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            # Same bytes already stored; the digest is the identity
+            os.remove(self._file.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._file.name, path)
+        self._committed = {"digest": digest, "size": self.size, "deduplicated": deduplicated}
+        return self._committed
+
+    def close(self):
+        if self._committed is not None:
+            return
+        self._file.close()
+        try:
+            os.remove(self._file.name)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DocumentStore:
+    """Content-addressed document store: each file is kept once, under its SHA-256.
+
+    Documents live at root/<digest[:2]>/<digest[2:4]>/<digest>. Identical
+    uploads share one file, and a stored document is never modified.
+    """
+
+    def __init__(self, root, max_bytes=0, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, digest):
+        if not _DIGEST_RE.match(digest):
+            raise ValueError(f"Invalid document digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def open(self, digest):
+        return open(self.path(digest), "rb")
+
+    def writer(self):
+        return DocumentWriter(self)
+
+    def save_stream(self, stream):
+        """Copy a readable stream into the store chunk by chunk; returns commit()'s result."""
+        with self.writer() as writer:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            return writer.commit()
@@ -0,0 +1,130 @@
+import csv
+import io
+import itertools
+import json
+from datetime import datetime, timezone
+
+from services.metrics import registry
+from services.tracing import span
+
+# format -> content type
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# collection -> (key in an exported row, projection); applications drive the join
+JOINED = {
+    "applications": ("application", {"_id": 0}),
+    # Extracted document text is recomputable and would dwarf the rest; the
+    # sanction's decision snapshot repeats the decision
+    "documents": ("documents", {"_id": 0, "inspectionText": 0}),
+    "decisions": ("decision", {"_id": 0}),
+    "sanctions": ("sanction", {"_id": 0, "decision": 0}),
+}
+
+# CSV columns: <row key>.<field>; lists and dicts are written as JSON
+CSV_COLUMNS = (
+    "sessionId",
+    "application.status", "application.statusAt", "application.loan_amount", "application.tenure",
+    "application.income", "application.purpose", "application.employment", "application.age",
+    "documents.uploaded", "documents.filename", "documents.files",
+    "decision.approved", "decision.status", "decision.confidence", "decision.credit_score",
+    "decision.emi", "decision.reason", "decision.model_probability", "decision.model_version",
+    "sanction.pdfId", "sanction.issuedAt",
+)
+
+EXPORT_SESSIONS = registry.counter("export_sessions_total", "Sessions written by exports, by format", ("format",))
+
+
+def parse_time(value):
+    """Epoch seconds from epoch seconds or an ISO 8601 date/datetime (UTC unless it has an offset); None for ""."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # fromisoformat only takes a "Z" suffix from Python 3.11
+    moment = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def export_query(statuses=None, since=None, until=None):
+    """Applications query for sessions in statuses whose status last changed in [since, until)."""
+    query = {}
+    if statuses:
+        query["status"] = {"$in": list(statuses)}
+    if since is not None or until is not None:
+        query["statusAt"] = {}
+        if since is not None:
+            query["statusAt"]["$gte"] = since
+        if until is not None:
+            query["statusAt"]["$lt"] = until
+        if since is not None and until is not None and since >= until:
+            raise ValueError("since must be before until")
+    return query
+
+
+def joined_batches(database, query, batch_size=1000):
+    """Lists of up to batch_size exported rows, one session each, for applications matching query.
+
+    The applications are read through one cursor (a server-side cursor on
+    MongoDB, getMore'd batch_size documents at a time); each batch is joined
+    with one sessionId $in query per other collection. Only one batch is held
+    at a time, whatever the number of sessions. Rows are
+    {"sessionId", "application", "documents", "decision", "sanction"}, with
+    {} for a collection the session has no document in.
+    """
+    applications = iter(database["applications"].find(query, JOINED["applications"][1], batch_size=batch_size))
+    while True:
+        batch = list(itertools.islice(applications, batch_size))
+        if not batch:
+            return
+        with span("export.batch", sessions=len(batch)):
+            ids = [doc["sessionId"] for doc in batch]
+            related = {}
+            for name, (key, projection) in JOINED.items():
+                if name != "applications":
+                    found = database[name].find({"sessionId": {"$in": ids}}, projection, batch_size=batch_size)
+                    related[key] = {doc["sessionId"]: doc for doc in found}
+        yield [
+            {
+                "sessionId": doc["sessionId"],
+                "application": doc,
+                **{key: docs.get(doc["sessionId"], {}) for key, docs in related.items()},
+            }
+            for doc in batch
+        ]
+
+
+def _csv_value(row, column):
+    if column == "sessionId":
+        return row["sessionId"]
+    key, field = column.split(".", 1)
+    value = row[key].get(field)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, separators=(",", ":"), default=str)
+    return "" if value is None else value
+
+
+def render(rows, fmt, header=False):
+    """rows as text in fmt ("ndjson" or "csv"); header adds the CSV header line."""
+    if fmt == "ndjson":
+        return "".join(json.dumps(row, separators=(",", ":"), default=str) + "\n" for row in rows)
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    writer.writerows([_csv_value(row, column) for column in CSV_COLUMNS] for row in rows)
+    return out.getvalue()
+
+
+def export_chunks(database, query, fmt, batch_size=1000):
+    """The export as text chunks, one per batch, ready to stream."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r} (one of {', '.join(FORMATS)})")
+    if fmt == "csv":
+        yield render([], fmt, header=True)
+    for rows in joined_batches(database, query, batch_size):
+        yield render(rows, fmt)
+        EXPORT_SESSIONS.inc(len(rows), format=fmt)
@@ -0,0 +1,186 @@
+import numpy as np
+
+# Rows evaluated per block; keeps the (trees x rows) working set in cache
+BLOCK_ROWS = 256
+
+# Lookup grids larger than this (total cells across all trees) are not built
+MAX_GRID_CELLS = 4_000_000
+
+
+def _floor_float32(values):
+    """Largest float32 <= each float64 value.
+
+    sklearn casts features to float32 and compares them with float64 thresholds;
+    for a float32 x, x <= t holds exactly when x <= _floor_float32(t).
+    """
+    rounded = values.astype(np.float32)
+    over = rounded.astype(np.float64) > values
+    rounded[over] = np.nextafter(rounded[over], np.float32(-np.inf))
+    return rounded
+
+
+def _plain_arrays(value):
+    """value with every np.memmap in it (also inside dicts and lists) as a plain ndarray view."""
+    if isinstance(value, np.memmap):
+        return value.view(np.ndarray)
+    if isinstance(value, dict):
+        return {k: _plain_arrays(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain_arrays(v) for v in value]
+    return value
+
+
+class CompiledForest:
+    """Array-backed evaluator for a fitted sklearn RandomForestClassifier.
+
+    The trees are flattened into contiguous node arrays (feature, threshold,
+    children, leaf probabilities) with leaves pointing at themselves. Because the
+    forest splits on a handful of features, each tree is additionally compiled into
+    a lookup grid: every combination of threshold bins maps straight to a leaf, so a
+    row is scored with one searchsorted per feature and a few gathers instead of a
+    depth-long walk. Forests whose grids would exceed MAX_GRID_CELLS fall back to
+    walking the node arrays.
+
+    predict_proba matches the forest's own predict_proba bit for bit.
+    """
+
+    def __init__(self, model, max_grid_cells=MAX_GRID_CELLS):
+        self.n_features = int(model.n_features_in_)
+        self.classes = np.asarray(model.classes_)
+        self._flatten(model.estimators_)
+        self.grid = self._compile_grid(max_grid_cells)
+
+    def __setstate__(self, state):
+        # Loaded with joblib mmap_mode, the arrays arrive as np.memmap; views of the
+        # same pages as plain ndarrays skip the subclass's overhead on every operation
+        self.__dict__.update(_plain_arrays(state))
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _flatten(self, estimators):
+        features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            node_ids = np.arange(offset, offset + tree.node_count)
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :]
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            probas.append(value / normalizer)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        self.feature = np.concatenate(features).astype(np.int64)
+        self.threshold = _floor_float32(np.concatenate(thresholds).astype(np.float64))
+        self.children = np.ascontiguousarray(np.stack([np.concatenate(lefts), np.concatenate(rights)]), dtype=np.int64)
+        self.is_leaf = self.children[0] == np.arange(offset)
+        self.leaf_proba = np.ascontiguousarray(np.concatenate(probas), dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.ends = np.append(self.roots[1:], offset)
+
+    def _tree_thresholds(self, t, k):
+        nodes = slice(self.roots[t], self.ends[t])
+        split = ~self.is_leaf[nodes] & (self.feature[nodes] == k)
+        return np.unique(self.threshold[nodes][split])
+
+    def _compile_grid(self, max_grid_cells):
+        per_tree = [[self._tree_thresholds(t, k) for k in range(self.n_features)] for t in range(self.n_trees)]
+        sizes = [int(np.prod([len(th) + 1 for th in tree_th])) for tree_th in per_tree]
+        if sum(sizes) > max_grid_cells:
+            return None
+
+        # Global bins per feature, and for every tree the local bin of each global bin
+        edges = [np.unique(self.threshold[~self.is_leaf & (self.feature == k)]) for k in range(self.n_features)]
+        bin_maps = [np.zeros((self.n_trees, len(edges[k]) + 1), dtype=np.int64) for k in range(self.n_features)]
+        strides = np.zeros((self.n_features, self.n_trees), dtype=np.int64)
+        offsets = np.zeros(self.n_trees, dtype=np.int64)
+        cell_leaves = []
+
+        offset = 0
+        for t, tree_th in enumerate(per_tree):
+            stride = 1
+            for k in reversed(range(self.n_features)):
+                bin_maps[k][t, 1:] = np.searchsorted(tree_th[k], edges[k], side="right")
+                strides[k, t] = stride
+                stride *= len(tree_th[k]) + 1
+
+            # One representative point per cell: bin b is (th[b-1], th[b]], the last bin is open
+            axes = [np.append(th, np.float32(np.inf)) for th in tree_th]
+            points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, self.n_features)
+            roots = np.full(len(points), self.roots[t])
+            cell_leaves.append(self._walk(points, roots, np.arange(len(points)))[0])
+
+            offsets[t] = offset
+            offset += sizes[t]
+
+        leaves = np.concatenate(cell_leaves)
+        return {
+            "edges": edges,
+            "bin_maps": bin_maps,
+            "strides": strides,
+            "offsets": offsets,
+            # (n_classes, n_cells) so each class gathers from a contiguous row
+            "cell_proba": np.ascontiguousarray(self.leaf_proba[leaves].T),
+        }
+
+    def _walk(self, X, nodes, rows):
+        """Follow (row, node) pairs down to their leaves through the node arrays."""
+        flat_X = X.ravel()
+        pos = rows * self.n_features
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            go_right = ~(flat_X[pos[active] + self.feature[current]] <= self.threshold[current])
+            following = self.children[go_right.view(np.int8), current]
+            nodes[active] = following
+            active = active[~self.is_leaf[following]]
+        return nodes.reshape(-1, len(X))
+
+    def _block_proba(self, X):
+        if self.grid is not None:
+            cells = self.grid["offsets"][:, np.newaxis]
+            for k in range(self.n_features):
+                global_bin = np.searchsorted(self.grid["edges"][k], X[:, k], side="left")
+                cells = cells + self.grid["bin_maps"][k][:, global_bin] * self.grid["strides"][k][:, np.newaxis]
+            per_tree = self.grid["cell_proba"][:, cells]
+        else:
+            leaves = self.apply(X)
+            per_tree = np.ascontiguousarray(self.leaf_proba[leaves].transpose(2, 0, 1))
+
+        # Sum tree by tree in estimator order, as sklearn does, so results match
+        # bit for bit; add.accumulate is strictly sequential, unlike add.reduce
+        return np.add.accumulate(per_tree, axis=1)[:, -1].T
+
+    def apply(self, X):
+        """Leaf node index reached by every row in every tree, shape (n_trees, n_rows)."""
+        X = self._features(X)
+        n_rows = len(X)
+        return self._walk(X, np.repeat(self.roots, n_rows), np.tile(np.arange(n_rows), self.n_trees))
+
+    def _features(self, X):
+        # sklearn compares float32 features against the (floored) thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32).reshape(-1, self.n_features)
+        # NaN fails every <= and would walk right to an arbitrary leaf; sklearn
+        # rejects NaN, infinity and values too large for float32 the same way
+        if not np.isfinite(X).all():
+            raise ValueError("Input contains NaN, infinity or a value too large for float32")
+        return X
+
+    def predict_proba(self, X):
+        X = self._features(X)
+        proba = np.empty((len(X), len(self.classes)))
+        for start in range(0, len(X), BLOCK_ROWS):
+            proba[start:start + BLOCK_ROWS] = self._block_proba(X[start:start + BLOCK_ROWS])
+        proba /= self.n_trees
+        return proba
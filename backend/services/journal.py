@@ -0,0 +1,415 @@
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+
+from services.metrics import registry
+from services.session_store import apply_update
+from services.tracing import log_event, span
+
+DURABILITY_MODES = ("async", "sync", "off")
+
+JOURNAL_EVENTS = registry.counter("journal_events_total", "Session writes queued in the journal", ("type",))
+JOURNAL_BATCH_EVENTS = registry.histogram(
+    "journal_batch_events", "Writes per group commit", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+)
+JOURNAL_COMMIT_SECONDS = registry.histogram(
+    "journal_commit_duration_seconds", "Group commits of the journal by outcome", ("outcome",)
+)
+
+
+class JournalError(Exception):
+    """A write that was not committed: its group commit failed or timed out, or the buffer stayed full."""
+
+
+class Write:
+    """One update of one of a session's documents, as the journal commits it.
+
+    fields are $set; push ({field: [values]}) appends to array fields in the
+    same update, so concurrent writers of a list each add to it instead of
+    replacing it. Without a query the document is upserted; with one the write
+    takes effect only if the document exists and matches it (a compare-and-set).
+    applied is None until the write is committed, then whether it took effect;
+    its event is stored in the log once it has.
+    """
+
+    __slots__ = ("session_id", "collection", "fields", "push", "type", "query", "event", "waiting", "applied",
+                 "event_stored")
+
+    def __init__(self, session_id, collection, fields, type, query=None, push=None):
+        self.session_id = session_id
+        self.collection = collection
+        self.fields = fields
+        self.push = push
+        self.type = type
+        self.query = query
+        self.event = None
+        self.waiting = False
+        self.applied = None
+        self.event_stored = False
+
+    def update(self):
+        """The write as a MongoDB update document"""
+        # An empty $set only when there is nothing else: MongoDB rejects an empty update
+        update = {"$set": self.fields} if self.fields or not self.push else {}
+        if self.push:
+            update["$push"] = {key: {"$each": values} for key, values in self.push.items()}
+        return update
+
+
+def apply_writes(database, writes):
+    """Apply writes to database's collections in order, setting each one's applied.
+
+    Runs of unconditional writes go to each collection as one ordered bulk_write
+    where it has one (MongoDB), else as one update_one each; conditional writes
+    are find_one_and_update calls between the runs. Writes already applied are
+    skipped. On an error, writes not known to have taken effect keep applied None.
+    """
+    run = []
+    for write in writes:
+        if write.applied is not None:
+            continue
+        if write.query is None:
+            run.append(write)
+            continue
+        _apply_run(database, run)
+        run = []
+        write.applied = database[write.collection].find_one_and_update(
+            {"sessionId": write.session_id, **write.query},
+            write.update(),
+            projection={"_id": 1}
+        ) is not None
+    _apply_run(database, run)
+
+
+def _apply_run(database, writes):
+    by_collection = {}
+    for write in writes:
+        by_collection.setdefault(write.collection, []).append(write)
+    for name, group in by_collection.items():
+        collection = database[name]
+        if not hasattr(collection, "bulk_write"):
+            for write in group:
+                collection.update_one({"sessionId": write.session_id}, write.update(), upsert=True)
+                write.applied = True
+            continue
+
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+
+        try:
+            collection.bulk_write(
+                [UpdateOne({"sessionId": w.session_id}, w.update(), upsert=True) for w in group],
+                ordered=True
+            )
+        except BulkWriteError as e:
+            # Ordered: every write before the first failed one took effect
+            for write in group[:e.details["writeErrors"][0]["index"]]:
+                write.applied = True
+            raise
+        for write in group:
+            write.applied = True
+
+
+class _Batch:
+    """Writes committed together, and the outcome their waiting callers read."""
+
+    __slots__ = ("writes", "done", "error")
+
+    def __init__(self):
+        self.writes = []
+        self.done = False
+        self.error = None
+
+
+class EventJournal:
+    """Write-behind journal of session changes, and the write path to the session documents.
+
+    write() queues Writes in an in-memory batch. A group commit applies the
+    batch's writes in order with apply(writes), then stores the events of those
+    that took effect with one insert_many on log(); apply may store them itself,
+    in the same transaction, marking them event_stored. A write takes effect
+    before its event is stored, never after: an event that fails to store is
+    retried with the next batch, so the journal neither misses a change nor
+    records one that did not happen. durability sets when write() returns:
+
+    - "async": at once. A flusher thread commits every flush_interval_s, or as
+      soon as max_batch writes are waiting; a crash loses at most that window,
+      and other processes see the writes once they are committed. Writes of a
+      failed commit are retried ahead of newer ones.
+    - "sync": once committed. The caller runs the commit itself unless one is
+      running; writes queued meanwhile share the next, so concurrent requests
+      pay for one commit between them.
+    - "off": nothing goes through the journal; callers write storage directly.
+
+    A conditional write is always waited for, and committed with everything
+    queued before it: its outcome decides what the caller does next. A waiting
+    caller whose write did not take effect gets JournalError.
+
+    pending() lists this process's uncommitted writes to a session, for reads
+    to apply over storage; a session with session_backlog of them is committed
+    by the read instead. events() and replay() read the committed log plus
+    those, so a session can be rebuilt from the journal at any time. Field
+    names whose first part is in exclude_fields are left out of events.
+    """
+
+    def __init__(self, apply, log, durability="async", flush_interval_s=0.1, max_batch=500,
+                 max_buffer=50000, session_backlog=8, wait_timeout_s=10.0, exclude_fields=()):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown journal durability {durability!r} (one of {', '.join(DURABILITY_MODES)})")
+        self.apply = apply
+        self.log = log
+        self.durability = durability
+        self.flush_interval_s = flush_interval_s
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+        self.session_backlog = session_backlog
+        self.wait_timeout_s = wait_timeout_s
+        self.exclude_fields = frozenset(exclude_fields)
+        # One lock: _cond is notified when a commit finishes, _wake when the flusher should not wait
+        self._cond = threading.Condition()
+        self._wake = threading.Condition(self._cond)
+        self._batch = _Batch()
+        self._committing = None
+        self._by_session = {}  # sessionId -> its queued and committing writes, in order
+        self._seq = itertools.count()
+        # Event ids are <process token>-<seq>; the flusher thread is per process
+        self._pid = None
+        self._token = None
+        self.appended = 0
+        self.committed = 0
+        self.batches = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.durability != "off"
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._cond:
+            if self._pid == pid:
+                return
+            # Writes queued before a fork are the parent's to commit
+            self._batch = _Batch()
+            self._committing = None
+            self._by_session = {}
+            self._pid = pid
+            self._token = uuid.uuid4().hex[:12]
+            threading.Thread(target=self._run, name="journal-flusher", daemon=True).start()
+
+    def _journaled(self, fields):
+        # Pairs rather than a document: field names may be dotted paths
+        return [[k, v] for k, v in fields.items() if k.split(".", 1)[0] not in self.exclude_fields]
+
+    def _event(self, write):
+        event = {
+            "sessionId": write.session_id,
+            "eventId": f"{self._token}-{next(self._seq)}",
+            "ts": time.time(),
+            "type": write.type,
+            "collection": write.collection,
+            "fields": self._journaled(write.fields),
+        }
+        if write.push:
+            event["push"] = self._journaled(write.push)
+        return event
+
+    def write(self, writes):
+        """Queue writes, in order; returns whether each took effect (True at once for async unconditional ones)."""
+        self._ensure_flusher()
+        wait = self.durability == "sync" or any(w.query is not None for w in writes)
+        for write in writes:
+            write.event = self._event(write)
+            write.waiting = wait
+        with self._cond:
+            if len(self._batch.writes) >= self.max_buffer and not self._cond.wait_for(
+                    lambda: len(self._batch.writes) < self.max_buffer, self.wait_timeout_s):
+                # Commits are failing or falling behind: push back rather than grow without bound
+                raise JournalError(f"Journal buffer still full after {self.wait_timeout_s}s")
+            batch = self._batch
+            batch.writes.extend(writes)
+            for write in writes:
+                self._by_session.setdefault(write.session_id, []).append(write)
+            self.appended += len(writes)
+            if len(batch.writes) >= self.max_batch:
+                self._wake.notify()
+            # With no commit running, a waiting caller commits the batch right away
+            lead = self._take() if wait and self._committing is None else None
+        for write in writes:
+            JOURNAL_EVENTS.inc(type=write.type)
+        if not wait:
+            return [True] * len(writes)
+
+        with span("journal.wait"):
+            if lead is not None:
+                self._commit(lead)
+            else:
+                self._await(batch)
+        if any(w.applied is None for w in writes):
+            raise JournalError(f"Journal commit failed: {batch.error}")
+        return [w.applied for w in writes]
+
+    def _await(self, batch):
+        """Wait until batch is committed, running the commit on this thread when no other is."""
+        deadline = time.monotonic() + self.wait_timeout_s
+        while True:
+            with self._cond:
+                while not batch.done and self._committing is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise JournalError(f"Journal commit did not finish within {self.wait_timeout_s}s")
+                    self._cond.wait(remaining)
+                if batch.done:
+                    return
+                # Not done and nothing committing: batch is the open one
+                lead = self._take()
+            self._commit(lead)
+
+    def _take(self):
+        """Start committing the open batch; caller holds the lock."""
+        batch, self._batch = self._batch, _Batch()
+        self._committing = batch
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Group commit window: the batch fills up for one interval. Appends do
+                # not wake the flusher otherwise, which keeps it off the request path.
+                self._wake.wait_for(lambda: len(self._batch.writes) >= self.max_batch, self.flush_interval_s)
+                if not self._batch.writes or self._committing is not None:
+                    # Nothing queued, or a waiting caller is committing it
+                    continue
+                batch = self._take()
+            if not self._commit(batch):
+                # Do not spin on a datastore that is down
+                time.sleep(min(1.0, max(self.flush_interval_s, 0.05)))
+
+    def _commit(self, batch):
+        """Apply batch's writes and store their events; False if that failed."""
+        start = time.perf_counter()
+        error = None
+        try:
+            if batch.writes:
+                self.apply(batch.writes)
+            unstored = [w for w in batch.writes if w.applied and not w.event_stored]
+            if unstored:
+                # One round trip; the log may change (local -> MongoDB) between batches
+                self.log().insert_many([dict(w.event) for w in unstored], ordered=False)
+                for write in unstored:
+                    write.event_stored = True
+        except Exception as e:
+            error = e
+            JOURNAL_COMMIT_SECONDS.observe(time.perf_counter() - start, outcome="error")
+            log_event("journal_commit_error", level=logging.WARNING, writes=len(batch.writes), error=str(e))
+        else:
+            JOURNAL_COMMIT_SECONDS.observe(time.perf_counter() - start, outcome="ok")
+            JOURNAL_BATCH_EVENTS.observe(len(batch.writes))
+
+        with self._cond:
+            retry = []
+            for write in batch.writes:
+                # Retried: events of writes that took effect, and async writes that did not get to
+                if write.applied and not write.event_stored or write.applied is None and not write.waiting:
+                    retry.append(write)
+                else:
+                    self._forget(write)
+            self._batch.writes[:0] = retry
+            if error is None:
+                self.committed += len(batch.writes)
+                self.batches += 1
+            else:
+                self.errors += 1
+            self._committing = None
+            batch.error = error
+            batch.done = True
+            self._cond.notify_all()
+        return error is None
+
+    def _forget(self, write):
+        writes = self._by_session.get(write.session_id)
+        if writes is not None:
+            writes.remove(write)
+            if not writes:
+                del self._by_session[write.session_id]
+
+    def flush(self):
+        """Commit everything queued so far, on this thread; False if that failed."""
+        if not self.enabled or self._pid != os.getpid():
+            return True
+        with self._cond:
+            # The open batch, or else the one being committed
+            batch = self._batch if self._batch.writes else self._committing
+        if batch is None:
+            return True
+        try:
+            self._await(batch)
+        except JournalError:
+            return False
+        return batch.error is None
+
+    def pending(self, session_id):
+        """This process's uncommitted unconditional writes to the session, oldest first.
+
+        A read takes this list before reading storage and applies all of it over
+        what it read, committed meanwhile or not: a write that commits during
+        the read may or may not be in the result, and $set fields applied again
+        in the same order land where storage has them.
+        """
+        if self._pid != os.getpid():
+            return []
+        with self._cond:
+            writes = [w for w in self._by_session.get(session_id, ()) if w.query is None and w.applied is None]
+        if len(writes) >= self.session_backlog and self.flush():
+            # A busy session: one commit, rather than every read applying the same writes
+            with self._cond:
+                writes = [w for w in self._by_session.get(session_id, ()) if w.query is None and w.applied is None]
+        return writes
+
+    def events(self, session_id):
+        """The session's events, oldest first: committed ones and this process's pending ones."""
+        if not self.enabled:
+            return []
+        events = {}
+        # Pending first: an in-flight batch that commits meanwhile is then read twice, not missed
+        pending = []
+        if self._pid == os.getpid():
+            with self._cond:
+                pending = [
+                    w.event for w in self._by_session.get(session_id, ())
+                    if not w.event_stored and (w.query is None or w.applied)
+                ]
+        for event in self.log().find({"sessionId": session_id}, {"_id": 0}):
+            events[event["eventId"]] = event
+        for event in pending:
+            events.setdefault(event["eventId"], event)
+        return sorted(events.values(), key=lambda e: (e["ts"], e["eventId"]))
+
+    def replay(self, session_id):
+        """{collection: document} rebuilt by applying the session's events in order; {} without any."""
+        docs = {}
+        for event in self.events(session_id):
+            doc = docs.setdefault(event["collection"], {"sessionId": session_id})
+            apply_update(doc, {
+                "$set": dict(event["fields"]),
+                "$push": {key: {"$each": values} for key, values in event.get("push", ())}
+            })
+        return docs
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._batch.writes) + (len(self._committing.writes) if self._committing else 0)
+            return {
+                "durability": self.durability,
+                "appended": self.appended,
+                "committed": self.committed,
+                "pending": pending,
+                "batches": self.batches,
+                "writesPerBatch": round(self.committed / self.batches, 2) if self.batches else None,
+                "errors": self.errors,
+            }
@@ -0,0 +1,132 @@
+import os
+import re
+import threading
+import time
+import uuid
+
+# Keys become file names, so only plain ids (uuid-style) are accepted
+_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+class LetterCache:
+    """Bounded on-disk cache of rendered files, sharded by key prefix and evicted LRU.
+
+    Files live at root/<first shard_chars of key>/<key><suffix> so no directory
+    grows without bound. A file's mtime is its last use: get() touches it, and
+    sweep() deletes files older than max_age_s and then the least recently used
+    until the cache is back under low_water * max_bytes. Either limit may be 0 to
+    disable it.
+
+    Several processes may share root. Each keeps a running estimate of the total
+    size from its own writes and sweeps when the estimate crosses max_bytes or
+    sweep_interval_s has passed; the sweep re-reads the directory, so the
+    estimate never drifts far. Writes go to a temp file renamed into place, so a
+    reader never sees a partial file and concurrent fills of one key are harmless.
+    """
+
+    def __init__(self, root, max_bytes=0, max_age_s=0, suffix=".pdf", shard_chars=2,
+                 low_water=0.9, sweep_interval_s=300):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.suffix = suffix
+        self.shard_chars = shard_chars
+        self.low_water = low_water
+        self.sweep_interval_s = sweep_interval_s
+        self._lock = threading.Lock()
+        self._bytes = None
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key):
+        if not _KEY_RE.match(key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return os.path.join(self.root, key[:self.shard_chars], f"{key}{self.suffix}")
+
+    def get(self, key):
+        """Path of the cached file for key (marking it used), or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key, data):
+        """Store data under key atomically and return its path."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += len(data)
+            due = (self._bytes is None
+                   or (self.max_bytes and self._bytes > self.max_bytes)
+                   or time.time() - self._last_sweep > self.sweep_interval_s)
+        if due:
+            self.sweep()
+        return path
+
+    def _entries(self):
+        try:
+            shards = os.scandir(self.root)
+        except FileNotFoundError:
+            return
+        with shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        try:
+                            st = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        yield st.st_mtime, st.st_size, entry.path
+
+    def sweep(self):
+        """Apply the age and size limits now; returns the number of files removed."""
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.low_water
+        removed = 0
+        for mtime, size, path in entries:
+            expired = self.max_age_s and now - mtime > self.max_age_s
+            over = self.max_bytes and total > target
+            # Abandoned temp files from a crashed writer age out like anything else
+            if not expired and not over:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._bytes = total
+            self._last_sweep = now
+            self.evictions += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,270 @@
+import bisect
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from services.tracing import span
+
+# Seconds; covers a cached read (sub-millisecond) up to a slow agent step
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Each thread updates one shard, picked round-robin the first time it records
+# anything, so concurrent requests rarely touch the same lock
+SHARDS = 16
+
+_thread = threading.local()
+_next_shard = itertools.count()
+
+
+def _shard_index():
+    index = getattr(_thread, "shard", None)
+    if index is None:
+        # next() on itertools.count is atomic under the GIL
+        index = _thread.shard = next(_next_shard) % SHARDS
+    return index
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value (a number, or histogram state)
+
+
+class _Metric:
+    """A named metric whose values are split over SHARDS locks, one per group of threads.
+
+    Updates lock only the calling thread's shard; a scrape locks each shard in
+    turn and adds them up.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labels)
+        self._shards = [_Shard() for _ in range(SHARDS)]
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _shard(self):
+        return self._shards[_shard_index()]
+
+    def _merged(self):
+        """label values -> value summed over the shards."""
+        merged = {}
+        for shard in self._shards:
+            with shard.lock:
+                items = [(key, self._copy(value)) for key, value in shard.values.items()]
+            for key, value in items:
+                merged[key] = self._add(merged[key], value) if key in merged else value
+        return merged
+
+    def _copy(self, value):
+        return value
+
+    def _add(self, a, b):
+        return a + b
+
+    def samples(self):
+        """(suffix, label text, value) lines for the exposition format."""
+        for key, value in sorted(self._merged().items()):
+            yield "", _format_labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        shard = self._shard()
+        with shard.lock:
+            shard.values[key] = shard.values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """A value that goes up and down; shards hold deltas, so inc and dec may run on different threads."""
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Per-bucket (not cumulative) counts, then +Inf, then the sum
+        index = bisect.bisect_left(self.buckets, value)
+        shard = self._shard()
+        with shard.lock:
+            state = shard.values.get(key)
+            if state is None:
+                state = shard.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value):
+        return list(value)
+
+    def _add(self, a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self):
+        bounds = self.buckets + (float("inf"),)
+        for key, state in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield "_bucket", _format_labels(self.labelnames, key, le), cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield "_sum", labels, state[-1]
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text format.
+
+    Each worker process has its own registry; scrape every worker (or run one
+    per container) to see all traffic.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-importing a module (tests, reloads) gets the metric it made before
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+DATASTORE_SECONDS = registry.histogram(
+    "datastore_operation_duration_seconds",
+    "Datastore calls by backend, collection and operation",
+    ("backend", "collection", "operation")
+)
+DATASTORE_ERRORS = registry.counter(
+    "datastore_operation_errors_total",
+    "Datastore calls that raised",
+    ("backend", "collection", "operation")
+)
+
+
+class InstrumentedCollection:
+    """Wraps a collection so every method call is timed into DATASTORE_SECONDS and traced."""
+
+    def __init__(self, collection, name, backend):
+        self._collection = collection
+        self._name = name
+        self._backend = backend
+
+    def __getattr__(self, operation):
+        method = getattr(self._collection, operation)
+        if not callable(method):
+            return method
+        labels = {"backend": self._backend, "collection": self._name, "operation": operation}
+        span_name = f"{self._name}.{operation}"
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with span(span_name, backend=self._backend):
+                    return method(*args, **kwargs)
+            except Exception:
+                DATASTORE_ERRORS.inc(**labels)
+                raise
+            finally:
+                DATASTORE_SECONDS.observe(time.perf_counter() - start, **labels)
+
+        # Cached on the instance, so __getattr__ runs once per operation
+        setattr(self, operation, timed)
+        return timed
+
+
+class InstrumentedDatabase:
+    """A pymongo database (or a local store standing in for one) with timed collections."""
+
+    def __init__(self, database, backend):
+        self.database = database
+        self.backend = backend
+        self._collections = {}
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = InstrumentedCollection(self.database[name], name, self.backend)
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
@@ -0,0 +1,324 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from services import model_store
+from services.metrics import registry
+from services.tracing import log_event
+
+# Seconds; one compiled-forest score takes tens of microseconds
+SCORE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+MODEL_LOADS = registry.counter(
+    "model_loads_total", "Model loads by role (active or candidate) and outcome", ("role", "outcome")
+)
+MODEL_SCORE_SECONDS = registry.histogram(
+    "model_score_duration_seconds", "Scoring time by role: active (in the request) or candidate (shadow)",
+    ("role",), buckets=SCORE_BUCKETS
+)
+SHADOW_ROWS = registry.counter(
+    "model_shadow_rows_total",
+    "Rows shadow-scored by the candidate, by outcome: agree or disagree (on approval), dropped (pool busy) or error",
+    ("outcome",)
+)
+
+
+class LoadedModel:
+    """A loaded forest with where it came from; replaced whole, never changed in place."""
+
+    __slots__ = ("forest", "version", "source", "meta", "loaded_at")
+
+    def __init__(self, forest, version, source, meta):
+        self.forest = forest
+        self.version = version
+        self.source = source
+        self.meta = meta
+        self.loaded_at = time.time()
+
+    def info(self):
+        return {
+            "version": self.version,
+            "source": self.source,
+            "trainedAt": self.meta.get("trainedAt"),
+            "accuracy": self.meta.get("accuracy"),
+            "loadedAt": round(self.loaded_at, 3),
+        }
+
+
+class ShadowStats:
+    """Agreement and latency of one candidate against one active version."""
+
+    def __init__(self, active_version, candidate_version, window):
+        self.active_version = active_version
+        self.candidate_version = candidate_version
+        self.rows = 0
+        self.agreed = 0
+        self.abs_diff = 0.0
+        self.dropped = 0
+        self.errors = 0
+        # Per-call latencies (seconds) of the most recent calls
+        self.latency = {"active": deque(maxlen=window), "candidate": deque(maxlen=window)}
+
+    def snapshot(self):
+        latency = {}
+        for role, samples in self.latency.items():
+            ms = np.asarray(samples) * 1000
+            latency[role] = {
+                "calls": len(ms),
+                "p50Ms": round(float(np.percentile(ms, 50)), 4) if len(ms) else None,
+                "p95Ms": round(float(np.percentile(ms, 95)), 4) if len(ms) else None,
+            }
+        return {
+            "activeVersion": self.active_version,
+            "candidateVersion": self.candidate_version,
+            "rows": self.rows,
+            "agreement": round(self.agreed / self.rows, 5) if self.rows else None,
+            "meanAbsDiff": round(self.abs_diff / self.rows, 6) if self.rows else None,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "latency": latency,
+        }
+
+
+class ModelRegistry:
+    """The active model (and an optional shadow candidate), reloaded as new versions are published.
+
+    Versions are the artifacts model_store publishes under root. The active one is
+    root/CURRENT unless pinned; without any published version fallback() supplies
+    the model. A watcher thread re-reads CURRENT every poll_s and loads a changed
+    version off the request path, checks that it scores, and swaps it in with a
+    single reference assignment: a request scores with whichever model it picked
+    up first, so a swap never fails or drops one. A version that fails to load is
+    logged and skipped (the previous model stays active) until CURRENT changes.
+
+    candidate names a version (or "latest", the newest published one) to
+    shadow-score: score(shadow=True) hands the rows to a small thread pool that
+    scores them with the candidate after the response's own score, and records
+    approval agreement, mean probability difference and latency of both. At most
+    shadow_queue batches wait; beyond that shadow work is dropped, never queued
+    behind the request.
+    """
+
+    def __init__(self, root, fallback=None, pinned=None, candidate=None, poll_s=10.0,
+                 shadow_workers=2, shadow_queue=1000, latency_window=2000):
+        self.root = root
+        self.fallback = fallback
+        self.pinned = pinned or None
+        self.candidate_spec = candidate or None
+        self.poll_s = poll_s
+        self.shadow_workers = shadow_workers
+        self.shadow_queue = shadow_queue
+        self.latency_window = latency_window
+        self._active = None
+        self._candidate = None
+        self._loaded = False
+        self._last_error = None
+        self._failed = {}  # role -> version (None: the fallback) that failed to load, skipped until it changes
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = None
+        # Threads do not survive a fork, so the watcher and the shadow pool are per process
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._shadow_slots = None
+
+    # ---- loading ----
+
+    def _load_version(self, version):
+        forest, meta = model_store.load(self.root, version, mmap_mode="r")
+        return LoadedModel(forest, version, "artifact", meta)
+
+    def _check(self, model):
+        """Score one row so a broken artifact fails here instead of in a request."""
+        proba = model.forest.predict_proba(np.zeros((1, model.forest.n_features)))
+        if proba.shape != (1, len(model.forest.classes)) or not np.all(np.isfinite(proba)):
+            raise ValueError(f"Model {model.version} returned {proba!r} for a probe row")
+        return model
+
+    def _wanted(self, role):
+        """The version that should be loaded for role, or None."""
+        if role == "active":
+            return self.pinned or model_store.current_version(self.root)
+        if self.candidate_spec == "latest":
+            published = model_store.versions(self.root)
+            active = self._active.version if self._active is not None else None
+            newest = published[-1] if published else None
+            return newest if newest != active else None
+        return self.candidate_spec
+
+    def _refresh(self, role):
+        current = self._active if role == "active" else self._candidate
+        try:
+            version = self._wanted(role)
+        except (OSError, ValueError) as e:
+            self._record_error(role, None, e)
+            return
+        if (current is not None and current.version == version) or (role in self._failed and self._failed[role] == version):
+            return
+        if version is None:
+            if role == "candidate":
+                self._candidate = None
+            elif current is None and self.fallback is not None:
+                try:
+                    self._active = self._check(LoadedModel(self.fallback(), None, "fallback", {}))
+                except Exception as e:
+                    self._failed[role] = None
+                    self._record_error(role, None, e)
+                    return
+                MODEL_LOADS.inc(role=role, outcome="ok")
+                log_event("model_loaded", role=role, version=None, source="fallback")
+            return
+
+        try:
+            model = self._check(self._load_version(version))
+        except Exception as e:
+            self._failed[role] = version
+            self._record_error(role, version, e)
+            return
+        self._failed.pop(role, None)
+        if role == "active":
+            self._active = model
+        else:
+            self._candidate = model
+        MODEL_LOADS.inc(role=role, outcome="ok")
+        log_event("model_loaded", role=role, version=version,
+                  previous=current.version if current is not None else None)
+
+    def _record_error(self, role, version, error):
+        self._last_error = {"role": role, "version": version, "error": str(error), "at": round(time.time(), 3)}
+        MODEL_LOADS.inc(role=role, outcome="error")
+        log_event("model_load_error", level=logging.WARNING, role=role, version=version, error=str(error))
+
+    def refresh(self):
+        """Load whatever changed in root since the last call; safe to call from any thread."""
+        with self._load_lock:
+            self._refresh("active")
+            if self.candidate_spec:
+                self._refresh("candidate")
+            self._loaded = True
+
+    # ---- per-process threads ----
+
+    def _ensure_threads(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._thread_lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._pool = None
+            self._shadow_slots = threading.BoundedSemaphore(self.shadow_queue)
+            if self.poll_s > 0:
+                threading.Thread(target=self._watch, name="model-watcher", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_s)
+            try:
+                self.refresh()
+            except Exception as e:
+                log_event("model_watch_error", level=logging.WARNING, error=str(e))
+
+    def _shadow_pool(self):
+        if self._pool is None:
+            with self._thread_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.shadow_workers, thread_name_prefix="model-shadow")
+        return self._pool
+
+    # ---- scoring ----
+
+    def active(self):
+        """The active LoadedModel (loaded on first call), or None when there is none."""
+        if not self._loaded:
+            self.refresh()
+        self._ensure_threads()
+        return self._active
+
+    def loaded(self):
+        return self._loaded
+
+    def score(self, X, shadow=False):
+        """(class-1 probabilities, LoadedModel) for the rows of X, or (None, None) without a model."""
+        model = self.active()
+        if model is None:
+            return None, None
+        start = time.perf_counter()
+        proba = model.forest.predict_proba(X)[:, 1]
+        elapsed = time.perf_counter() - start
+        MODEL_SCORE_SECONDS.observe(elapsed, role="active")
+
+        candidate = self._candidate
+        if shadow and candidate is not None and candidate.version != model.version:
+            if self._shadow_slots.acquire(blocking=False):
+                try:
+                    self._shadow_pool().submit(self._shadow, np.array(X, dtype=np.float64), proba, elapsed, model, candidate)
+                except RuntimeError:
+                    # Pool shut down (interpreter exit)
+                    self._shadow_slots.release()
+            else:
+                SHADOW_ROWS.inc(len(proba), outcome="dropped")
+                with self._stats_lock:
+                    self._shadow_stats(model, candidate).dropped += len(proba)
+        return proba, model
+
+    def _shadow_stats(self, model, candidate):
+        """Stats for this pair, started afresh when either side changed; caller holds _stats_lock."""
+        stats = self._stats
+        if stats is None or (stats.active_version, stats.candidate_version) != (model.version, candidate.version):
+            stats = self._stats = ShadowStats(model.version, candidate.version, self.latency_window)
+        return stats
+
+    def _shadow(self, X, active_proba, active_s, model, candidate):
+        try:
+            start = time.perf_counter()
+            try:
+                proba = candidate.forest.predict_proba(X)[:, 1]
+            except Exception as e:
+                SHADOW_ROWS.inc(len(X), outcome="error")
+                with self._stats_lock:
+                    self._shadow_stats(model, candidate).errors += len(X)
+                log_event("model_shadow_error", level=logging.WARNING, candidate=candidate.version, error=str(e))
+                return
+            elapsed = time.perf_counter() - start
+            MODEL_SCORE_SECONDS.observe(elapsed, role="candidate")
+
+            agreed = int(np.count_nonzero((proba >= 0.5) == (active_proba >= 0.5)))
+            SHADOW_ROWS.inc(agreed, outcome="agree")
+            SHADOW_ROWS.inc(len(proba) - agreed, outcome="disagree")
+            with self._stats_lock:
+                stats = self._shadow_stats(model, candidate)
+                stats.rows += len(proba)
+                stats.agreed += agreed
+                stats.abs_diff += float(np.abs(proba - active_proba).sum())
+                stats.latency["active"].append(active_s)
+                stats.latency["candidate"].append(elapsed)
+        finally:
+            self._shadow_slots.release()
+
+    def status(self):
+        with self._stats_lock:
+            shadow = self._stats.snapshot() if self._stats is not None else None
+        active, candidate = self._active, self._candidate
+        try:
+            current = model_store.current_version(self.root)
+        except (OSError, ValueError):
+            current = None
+        return {
+            "active": active.info() if active is not None else None,
+            "candidate": candidate.info() if candidate is not None else None,
+            "pinned": self.pinned,
+            "candidateSpec": self.candidate_spec,
+            "published": model_store.versions(self.root),
+            "current": current,
+            "pollS": self.poll_s,
+            "shadow": shadow,
+            "lastError": self._last_error,
+        }
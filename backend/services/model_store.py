@@ -0,0 +1,103 @@
+import json
+import os
+import re
+import shutil
+import time
+
+# Artifact files inside a version directory
+FOREST_FILE = "forest.joblib"
+META_FILE = "meta.json"
+# Names the version the app loads by default
+CURRENT_FILE = "CURRENT"
+
+# Versions become directory names
+_VERSION_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def _check_version(version):
+    if not _VERSION_RE.match(version) or version.startswith("."):
+        raise ValueError(f"Invalid model version: {version!r}")
+    return version
+
+
+def new_version():
+    """A version name that sorts by training time."""
+    return time.strftime("%Y%m%dT%H%M%S")
+
+
+def versions(root):
+    """Published versions under root, oldest first."""
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if _VERSION_RE.match(n) and not n.startswith(".")
+                  and os.path.exists(os.path.join(root, n, FOREST_FILE)))
+
+
+def current_version(root):
+    """The version named by root/CURRENT, or None when nothing has been promoted."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return _check_version(version) if version else None
+
+
+def promote(root, version):
+    """Point root/CURRENT at version (atomically, so readers see the old or the new one)."""
+    if version not in versions(root):
+        raise FileNotFoundError(f"No model version {version!r} in {root}")
+    tmp = os.path.join(root, f".{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def save(root, forest, meta, version=None, make_current=True):
+    """Publish a compiled forest and its metadata as a new version; returns the version.
+
+    The forest is written uncompressed so load() can memory-map its arrays. The
+    version directory is filled under a temporary name and renamed into place,
+    so a half-written version is never visible.
+    """
+    import joblib
+
+    version = _check_version(version or new_version())
+    final = os.path.join(root, version)
+    if os.path.exists(final):
+        raise FileExistsError(f"Model version {version!r} already exists in {root}")
+    tmp = os.path.join(root, f".{version}.{os.getpid()}.tmp")
+    os.makedirs(tmp)
+    try:
+        joblib.dump(forest, os.path.join(tmp, FOREST_FILE))
+        with open(os.path.join(tmp, META_FILE), "w") as f:
+            json.dump({"version": version, **meta}, f, indent=2, sort_keys=True)
+        os.rename(tmp, final)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if make_current:
+        promote(root, version)
+    return version
+
+
+def load(root, version, mmap_mode="r"):
+    """(forest, meta) of a version.
+
+    With mmap_mode="r" the forest's arrays are read-only maps of the artifact
+    file: every process that loads the same version shares one copy of those
+    pages through the OS page cache, and loading costs no more than the pickled
+    object skeleton.
+    """
+    import joblib
+
+    path = os.path.join(root, _check_version(version))
+    forest = joblib.load(os.path.join(path, FOREST_FILE), mmap_mode=mmap_mode)
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        meta = {"version": version}
+    return forest, meta
@@ -1,44 +1,44 @@
 import os
 from dotenv import load_dotenv
 
+from services.mongo_setup import COLLECTIONS, MongoConnector
+from services.session_store import SessionStore
+
 load_dotenv()
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-
-# In-memory fallback when MongoDB is not available
-class InMemoryCollection:
-    def __init__(self):
-        self._data = {}
-
-    def find_one(self, query):
-        key = query.get("sessionId")
-        return self._data.get(key)
-
-    def update_one(self, query, update, upsert=False):
-        key = query.get("sessionId")
-        doc = self._data.get(key, {})
-        if "$set" in update:
-            doc.update(update["$set"])
-        if "$setOnInsert" in update and key not in self._data:
-            doc.update(update["$setOnInsert"])
-        if upsert or key in self._data:
-            doc["sessionId"] = key
-            self._data[key] = doc
-
-class InMemoryDB:
-    def __init__(self):
-        self.applications = InMemoryCollection()
-        self.documents = InMemoryCollection()
-        self.decisions = InMemoryCollection()
-        self.sanctions = InMemoryCollection()
-
-# Try MongoDB, fall back to in-memory
-try:
-    from pymongo import MongoClient
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
-    client.admin.command('ping')
-    db = client.ai_loan_advisor
-    print("Connected to MongoDB")
-except Exception as e:
-    print(f"MongoDB not available ({e}), using in-memory storage")
-    db = InMemoryDB()
+MONGO_URI = os.getenv("MONGO_URI", "")
+
+# Connects in the background on first use, and only when MONGO_URI is set; without
+# it the bounded, thread-safe in-memory store is the database
+connector = MongoConnector(MONGO_URI)
+_local = SessionStore(COLLECTIONS)
+
+
+class MongoNotReady(Exception):
+    """MONGO_URI is set but MongoDB is not connected yet; retry shortly."""
+
+
+class _Database:
+    """MongoDB when MONGO_URI is set, the in-memory store when it is not.
+
+    A configured MongoDB that has not connected yet raises MongoNotReady rather
+    than serving from memory: writes made there would never reach MongoDB.
+    """
+
+    def _current(self):
+        if connector.state == "disabled":
+            return _local
+        connector.start()
+        database = connector.database
+        if database is None:
+            raise MongoNotReady(f"MongoDB is not connected yet ({connector.last_error or 'connecting'})")
+        return database
+
+    def __getattr__(self, name):
+        return getattr(self._current(), name)
+
+    def __getitem__(self, name):
+        return self._current()[name]
+
+
+db = _Database()
@@ -0,0 +1,150 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from services.tracing import log_event
+
+COLLECTIONS = ("applications", "documents", "decisions", "sanctions")
+# Append-only: any number of documents per session
+LOG_COLLECTIONS = ("events",)
+
+# collection -> [(keys, options)]; every collection is looked up by sessionId
+INDEXES = {
+    "applications": [
+        ([("sessionId", 1)], {"unique": True, "name": "sessionId_unique"}),
+        # Funnel queries (sessions per status) and stale-claim lookups (status + age)
+        ([("status", 1), ("statusAt", 1)], {"name": "status_statusAt"}),
+        # Exports of a date range across every status
+        ([("statusAt", 1)], {"name": "statusAt"}),
+    ],
+    "documents": [
+        ([("sessionId", 1)], {"unique": True, "name": "sessionId_unique"}),
+    ],
+    "decisions": [
+        ([("sessionId", 1)], {"unique": True, "name": "sessionId_unique"}),
+    ],
+    "sanctions": [
+        ([("sessionId", 1)], {"unique": True, "name": "sessionId_unique"}),
+        # Downloads find the sanction by letter id
+        ([("pdfId", 1)], {"name": "pdfId"}),
+    ],
+    "events": [
+        # A session's journal, in order
+        ([("sessionId", 1), ("ts", 1)], {"name": "sessionId_ts"}),
+    ],
+}
+
+
+def client_options() -> dict:
+    """MongoClient keyword arguments from the environment.
+
+    MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE  connections per process (default 50 / 0)
+    MONGO_MAX_IDLE_MS                           close pooled connections idle this long
+    MONGO_SERVER_SELECTION_TIMEOUT_MS           how long to wait for a usable server
+    MONGO_CONNECT_TIMEOUT_MS / MONGO_SOCKET_TIMEOUT_MS
+    MONGO_WRITE_CONCERN                         w: a number or "majority" (default 1)
+    MONGO_JOURNAL                               "1" to wait for the journal on writes
+    """
+    w = os.getenv("MONGO_WRITE_CONCERN", "1")
+    options = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000")),
+        "w": int(w) if w.isdigit() else w,
+        "journal": os.getenv("MONGO_JOURNAL", "0") == "1",
+    }
+    if os.getenv("MONGO_MAX_IDLE_MS"):
+        options["maxIdleTimeMS"] = int(os.getenv("MONGO_MAX_IDLE_MS"))
+    return options
+
+
+def ensure_indexes(database) -> list:
+    """Create the indexes in INDEXES if they are missing; returns the names ensured.
+
+    create_index is a no-op for an index that already exists, so this is safe on
+    every startup. A unique index that cannot be built (duplicate sessionIds left
+    over from before it existed) is reported and skipped rather than stopping the
+    server.
+    """
+    ensured = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                ensured.append(f"{collection}.{database[collection].create_index(keys, **options)}")
+            except Exception as e:
+                log_event("mongo_index_failed", level=logging.WARNING, index=f"{collection}.{options['name']}", error=str(e))
+    return ensured
+
+
+class MongoConnector:
+    """Connects to MongoDB on a background thread, retrying with backoff until it works.
+
+    Nothing waits on the connection: callers use `database` (None until the first
+    successful ping) and fall back to local storage meanwhile. Once connected the
+    indexes are ensured and on_connect(database) is called; from then on pymongo
+    reconnects by itself, so a later outage surfaces as errors rather than a
+    silent switch to another backend.
+    """
+
+    def __init__(self, uri, db_name="ai_loan_advisor", on_connect=None, options=None,
+                 initial_delay_s=0.5, max_delay_s=30.0):
+        self.uri = uri
+        self.db_name = db_name
+        self.on_connect = on_connect
+        self.options = options
+        self.initial_delay_s = initial_delay_s
+        self.max_delay_s = max_delay_s
+        self.database = None
+        self.attempts = 0
+        self.last_error = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if not self.uri:
+            return "disabled"
+        return "connected" if self.database is not None else "connecting"
+
+    def start(self):
+        """Start connecting unless this process already has (cheap; safe to call per request)."""
+        if not self.uri or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Neither the thread nor a pymongo client survives a fork: a forked worker connects anew
+            self._pid = os.getpid()
+            self.database = None
+            self.attempts = 0
+        threading.Thread(target=self._run, name="mongo-connect", daemon=True).start()
+
+    def _run(self):
+        from pymongo import MongoClient
+
+        delay = self.initial_delay_s
+        client = MongoClient(self.uri, **(self.options or client_options()))
+        while True:
+            self.attempts += 1
+            try:
+                client.admin.command("ping")
+                database = client[self.db_name]
+                ensured = ensure_indexes(database)
+                self.database = database
+                self.last_error = None
+                log_event("mongo_connected", attempts=self.attempts, indexes=ensured)
+                if self.on_connect is not None:
+                    self.on_connect(database)
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                log_event("mongo_unavailable", level=logging.WARNING, attempt=self.attempts, retryInS=round(delay, 1), error=str(e))
+                time.sleep(delay * random.uniform(0.8, 1.2))
+                delay = min(delay * 2, self.max_delay_s)
+
+    def status(self):
+        return {"state": self.state, "attempts": self.attempts, "lastError": self.last_error}
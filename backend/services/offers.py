@@ -0,0 +1,137 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+# Annual interest rate offered when the caller does not give one
+ANNUAL_RATE = float(os.getenv("OFFER_ANNUAL_RATE", "0.12"))
+# Tenures on the offer grid, in months
+MIN_TENURE = 6
+MAX_TENURE = 84
+# Largest EMI as a share of monthly income, per approval route (the underwriting
+# thresholds): approved outright, or after a verified salary slip
+EMI_RATIOS = {"instant": 0.3, "with_salary_slip": 0.5}
+# Offered amounts are rounded down to this
+AMOUNT_STEP = 1000
+CACHE_SIZE = int(os.getenv("OFFER_CACHE_SIZE", "4096"))
+
+
+def amortized_emi(principal, months, annual_rate):
+    """Monthly instalment repaying principal over months at annual_rate; broadcasts over arrays."""
+    principal = np.asarray(principal, dtype=np.float64)
+    months = np.asarray(months, dtype=np.float64)
+    r = annual_rate / 12
+    if r == 0:
+        return principal / months
+    growth = (1 + r) ** months
+    return principal * r * growth / (growth - 1)
+
+
+def max_principal(emi, months, annual_rate):
+    """Largest principal an instalment of emi repays over months; inverse of amortized_emi."""
+    emi = np.asarray(emi, dtype=np.float64)
+    months = np.asarray(months, dtype=np.float64)
+    r = annual_rate / 12
+    if r == 0:
+        return emi * months
+    growth = (1 + r) ** months
+    return emi * (growth - 1) / (r * growth)
+
+
+def _dumps(result):
+    return json.dumps(result, separators=(",", ":"))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def offer_grid_json(income: int, annual_rate: float, tenure_step: int = 6) -> str:
+    """offer_grid as JSON text, cached per input tuple; endpoints send it as is."""
+    return _dumps(_offer_grid(income, annual_rate, tenure_step))
+
+
+def offer_grid(income: int, annual_rate: float, tenure_step: int = 6) -> dict:
+    """Largest approvable amount and its EMI for every tenure, per approval route.
+
+    The whole (route x tenure) grid is one NumPy expression. Amounts are capped
+    so the amortized EMI stays strictly under the route's share of income; that
+    EMI is never below the flat loan/tenure the underwriting check uses, so every
+    offer passes it, at any rate including 0. Each call gets a new dict, parsed from the cached JSON:
+    a caller that changes it changes nobody else's.
+    """
+    return json.loads(offer_grid_json(income, annual_rate, tenure_step))
+
+
+def _offer_grid(income, annual_rate, tenure_step):
+    tenures = np.arange(MIN_TENURE, MAX_TENURE + 1, tenure_step)
+    ratios = np.array(list(EMI_RATIOS.values()))[:, np.newaxis]
+    amounts = np.floor(max_principal(ratios * income, tenures, annual_rate) / AMOUNT_STEP) * AMOUNT_STEP
+    # Underwriting wants the EMI strictly under the share, computed as emi / income;
+    # an amount that meets it exactly (always possible at rate 0) is one step less
+    amounts = np.maximum(
+        amounts - AMOUNT_STEP * (amortized_emi(amounts, tenures, annual_rate) / income >= ratios), 0
+    )
+    emis = amortized_emi(amounts, tenures, annual_rate)
+    total_interest = emis * tenures - amounts
+
+    rows = []
+    for j, tenure in enumerate(tenures.tolist()):
+        row = {"tenure": tenure}
+        for i, route in enumerate(EMI_RATIOS):
+            row[route] = {
+                "maxAmount": int(amounts[i, j]),
+                "emi": round(float(emis[i, j]), 2),
+                "totalInterest": round(float(total_interest[i, j]), 2),
+            }
+        rows.append(row)
+    return {"income": income, "annualRate": annual_rate, "emiRatios": EMI_RATIOS, "offers": rows}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def repayment_schedules_json(amount: int, tenures: tuple, annual_rate: float) -> str:
+    """repayment_schedules as JSON text, cached per input tuple; endpoints send it as is."""
+    return _dumps(_repayment_schedules(amount, tenures, annual_rate))
+
+
+def repayment_schedules(amount: int, tenures: tuple, annual_rate: float) -> dict:
+    """Month-by-month schedules for amount over each tenure, computed as one (tenure x month) grid.
+
+    The balance after k payments has a closed form, so no month depends on a
+    loop over the previous one. Each call gets a new dict, as with offer_grid.
+    """
+    return json.loads(repayment_schedules_json(amount, tenures, annual_rate))
+
+
+def _repayment_schedules(amount, tenures, annual_rate):
+    months_n = np.array(tenures, dtype=np.float64)[:, np.newaxis]
+    k = np.arange(1, max(tenures) + 1, dtype=np.float64)[np.newaxis, :]
+    emi = amortized_emi(amount, months_n, annual_rate)
+    r = annual_rate / 12
+
+    if r == 0:
+        opening = amount - emi * (k - 1)
+    else:
+        opening = amount * (1 + r) ** (k - 1) - emi * ((1 + r) ** (k - 1) - 1) / r
+    interest = opening * r
+    principal = emi - interest
+    # Clamped so rounding never leaves a tiny negative balance; months past a
+    # tenure's end are padding and are sliced off below
+    closing = np.maximum(opening - principal, 0.0)
+
+    schedules = []
+    for i, tenure in enumerate(tenures):
+        n = int(tenure)
+        schedules.append({
+            "tenure": n,
+            "emi": round(float(emi[i, 0]), 2),
+            "totalInterest": round(float(interest[i, :n].sum()), 2),
+            "months": [
+                {"month": month, "interest": paid_interest, "principal": paid_principal, "balance": balance}
+                for month, paid_interest, paid_principal, balance in zip(
+                    range(1, n + 1),
+                    np.round(interest[i, :n], 2).tolist(),
+                    np.round(principal[i, :n], 2).tolist(),
+                    np.round(closing[i, :n], 2).tolist(),
+                )
+            ],
+        })
+    return {"amount": amount, "annualRate": annual_rate, "schedules": schedules}
@@ -0,0 +1,294 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services.workflow import matches
+
+# Sessions kept in memory when there is no database, and how long an untouched one lives
+MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX", "10000"))
+IDLE_TTL_S = float(os.getenv("SESSION_STORE_TTL_H", "24")) * 3600
+
+
+def apply_set(doc, fields):
+    """$set fields on doc in place; a dotted key sets a nested field, as in MongoDB.
+
+    Nested dicts on the path are replaced by updated copies rather than changed,
+    so shallow copies of doc handed out earlier never see the write.
+    """
+    for key, value in fields.items():
+        *parents, leaf = key.split(".")
+        target = doc
+        for part in parents:
+            child = target.get(part)
+            target[part] = dict(child) if isinstance(child, dict) else {}
+            target = target[part]
+        target[leaf] = value
+
+
+def apply_update(doc, update):
+    """Apply a MongoDB update's $set and $push to doc in place, $set first.
+
+    $push appends one value, or each of {"$each": [...]}, to an array field,
+    creating it if missing; like apply_set it builds a new list rather than
+    changing the one a shallow copy may share.
+    """
+    apply_set(doc, update.get("$set", {}))
+    for key, value in update.get("$push", {}).items():
+        values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+        current = doc
+        for part in key.split("."):
+            current = current.get(part) if isinstance(current, dict) else None
+        if current is not None and not isinstance(current, list):
+            raise ValueError(f"$push to {key}, which is not an array")
+        apply_set(doc, {key: (current or []) + list(values)})
+
+
+def project(doc, projection):
+    """A copy of doc with a MongoDB-style projection applied to its top-level fields."""
+    if doc is None or not projection:
+        return None if doc is None else dict(doc)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(fields.values()):
+        return {k: doc[k] for k in fields if fields[k] and k in doc}
+    return {k: v for k, v in doc.items() if k not in fields}
+
+
+class _Stripe:
+    """One lock's share of the sessions, kept in least-recently-used order."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # sessionId -> [last used, {collection: doc}]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+class SessionCollection:
+    """A collection of a SessionStore with the pymongo calls the app makes on it."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def find_one(self, query, projection=None):
+        return self.store.find_one(self.name, query, projection)
+
+    def update_one(self, query, update, upsert=False):
+        self.store.find_one_and_update(self.name, query, update, upsert=upsert)
+
+    def find_one_and_update(self, query, update, upsert=False, **kwargs):
+        return self.store.find_one_and_update(self.name, query, update, upsert=upsert)
+
+    def find(self, query, projection=None, batch_size=None):
+        return self.store.find(self.name, query, projection)
+
+
+class SessionLog:
+    """An append-only collection of a SessionStore: any number of documents per session, in insertion order."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def insert_many(self, documents, ordered=True):
+        self.store.append(self.name, documents)
+
+    def find(self, query, projection=None):
+        return self.store.find_appended(self.name, query, projection)
+
+
+class SessionStore:
+    """Bounded, thread-safe in-memory storage for per-session documents.
+
+    Every collection's document for a session lives in one entry, so a session is
+    evicted as a whole: application, documents, decision and sanction together.
+    Sessions are spread over `stripes` locks by sessionId, so requests for
+    different sessions rarely contend. Each stripe holds at most its share of
+    max_sessions and drops its least recently used session past that; a session
+    not touched for ttl_s is dropped when next seen or when its stripe is written.
+
+    Collections are attributes (store.applications, ...) with find_one,
+    update_one, find_one_and_update and find, so the store stands in for a
+    pymongo database. Queries are matched with workflow.matches; only sessionId lookups
+    are indexed, any other query scans. Projections apply to top-level fields.
+    Log collections (logs) hold a list of documents per session instead, with
+    insert_many and find; they are evicted with the rest of the session.
+    """
+
+    def __init__(self, collections, max_sessions=MAX_SESSIONS, ttl_s=IDLE_TTL_S, stripes=16, logs=()):
+        self.collections = tuple(collections)
+        self.logs = tuple(logs)
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self._per_stripe = max(1, -(-max_sessions // stripes))
+        for name in self.collections:
+            setattr(self, name, SessionCollection(self, name))
+        for name in self.logs:
+            setattr(self, name, SessionLog(self, name))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def _stripe(self, session_id):
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    def _expired(self, entry, now):
+        return self.ttl_s and now - entry[0] > self.ttl_s
+
+    def _entry(self, stripe, session_id, now, create=False):
+        """The session's entry marked as used, or None; caller holds stripe.lock."""
+        entry = stripe.sessions.get(session_id)
+        if entry is not None and self._expired(entry, now):
+            del stripe.sessions[session_id]
+            stripe.expirations += 1
+            entry = None
+
+        if entry is not None:
+            entry[0] = now
+            stripe.sessions.move_to_end(session_id)
+        elif create:
+            entry = stripe.sessions[session_id] = [now, {}]
+            self._evict(stripe, now)
+        return entry
+
+    def _evict(self, stripe, now):
+        sessions = stripe.sessions
+        while sessions:
+            oldest = next(iter(sessions.values()))
+            if self._expired(oldest, now):
+                stripe.expirations += 1
+            elif len(sessions) > self._per_stripe:
+                stripe.evictions += 1
+            else:
+                break
+            sessions.popitem(last=False)
+
+    def find_one(self, name, query, projection=None):
+        session_id = query.get("sessionId")
+        if session_id is None:
+            return project(self._scan(name, query), projection)
+
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            entry = self._entry(stripe, session_id, time.time())
+            doc = entry[1].get(name) if entry is not None else None
+            if doc is None:
+                stripe.misses += 1
+                return None
+            stripe.hits += 1
+            return project(doc, projection) if matches(doc, query) else None
+
+    def _scan(self, name, query):
+        now = time.time()
+        for stripe in self._stripes:
+            with stripe.lock:
+                for entry in stripe.sessions.values():
+                    doc = entry[1].get(name)
+                    if doc is not None and not self._expired(entry, now) and matches(doc, query):
+                        return dict(doc)
+        return None
+
+    def find(self, name, query, projection=None):
+        """Iterate over the documents of a collection that match query.
+
+        A sessionId (or sessionId $in) query looks the sessions up; any other
+        query copies out one stripe's matches at a time, so iterating never holds
+        a lock between documents. Unlike find_one, reads do not count as a use of
+        the session: a bulk read does not reorder eviction.
+        """
+        session_id = query.get("sessionId")
+        if isinstance(session_id, dict):
+            ids = session_id.get("$in")
+        else:
+            ids = None if session_id is None else [session_id]
+        if ids is not None:
+            # Looked up by id, so only the rest of the query is left to match
+            rest = {k: v for k, v in query.items() if k != "sessionId"}
+            for sid in ids:
+                stripe = self._stripe(sid)
+                with stripe.lock:
+                    doc = self._peek(stripe, sid, name, rest)
+                    doc = project(doc, projection) if doc is not None else None
+                if doc is not None:
+                    yield doc
+            return
+
+        for stripe in self._stripes:
+            with stripe.lock:
+                found = [project(doc, projection) for doc in
+                         (self._peek(stripe, sid, name, query) for sid in stripe.sessions) if doc is not None]
+            yield from found
+
+    def _peek(self, stripe, session_id, name, query):
+        """The session's document in name if it matches query, without marking it used; caller holds stripe.lock."""
+        entry = stripe.sessions.get(session_id)
+        if entry is None or self._expired(entry, time.time()):
+            return None
+        doc = entry[1].get(name)
+        return doc if doc is not None and matches(doc, query) else None
+
+    def find_one_and_update(self, name, query, update, upsert=False):
+        """Apply $set / $push / $setOnInsert atomically if the document matches query.
+
+        Returns the document as it was before the update, or None if there was
+        none (inserted, with upsert) or it did not match.
+        """
+        session_id = query["sessionId"]
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            entry = self._entry(stripe, session_id, time.time(), create=upsert)
+            doc = entry[1].get(name) if entry is not None else None
+            if doc is not None and not matches(doc, query):
+                return None
+            if doc is None and not upsert:
+                return None
+
+            before = dict(doc) if doc is not None else None
+            if doc is None:
+                doc = entry[1][name] = {"sessionId": session_id, **update.get("$setOnInsert", {})}
+            apply_update(doc, update)
+            return before
+
+    def append(self, name, documents):
+        """Append documents to a log collection, taking each session's stripe lock once."""
+        by_session = {}
+        for doc in documents:
+            by_session.setdefault(doc["sessionId"], []).append(dict(doc))
+        now = time.time()
+        for session_id, docs in by_session.items():
+            stripe = self._stripe(session_id)
+            with stripe.lock:
+                entry = self._entry(stripe, session_id, now, create=True)
+                entry[1].setdefault(name, []).extend(docs)
+
+    def find_appended(self, name, query, projection=None):
+        """Documents of a log collection for query's sessionId that match query, oldest first."""
+        session_id = query["sessionId"]
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            entry = self._entry(stripe, session_id, time.time())
+            docs = list(entry[1].get(name, ())) if entry is not None else []
+        return [project(doc, projection) for doc in docs if matches(doc, query)]
+
+    def clear(self):
+        """Drop every session, leaving the counters."""
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.sessions.clear()
+
+    def stats(self):
+        """Counters summed over the stripes."""
+        totals = {"sessions": 0, "hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        for stripe in self._stripes:
+            with stripe.lock:
+                totals["sessions"] += len(stripe.sessions)
+                totals["hits"] += stripe.hits
+                totals["misses"] += stripe.misses
+                totals["evictions"] += stripe.evictions
+                totals["expirations"] += stripe.expirations
+        totals["maxSessions"] = self.max_sessions
+        return totals
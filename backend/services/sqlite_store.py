@@ -0,0 +1,311 @@
+import json
+import os
+import queue
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from services.session_store import apply_update, project
+from services.workflow import matches
+
+# Fields looked up by something other than sessionId get an expression index:
+# letters by id, and exports by date. Every index is paid for on each write of its
+# table, and applications are written at every step, so a status-only export scans.
+INDEXED_FIELDS = {"applications": ("statusAt",), "sanctions": ("pdfId",)}
+# Indexes earlier versions created
+RETIRED_INDEXES = ("applications_status",)
+
+_FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_RANGE_OPS = {"$lt": "<", "$lte": "<=", "$gt": ">", "$gte": ">="}
+
+
+def _where(query):
+    """(SQL condition, parameters) narrowing rows to those that may match query.
+
+    Covers equality, $in and ranges on sessionId and on plain top-level fields;
+    anything else ($or, nested fields, None) is left to matches(), which callers
+    still apply to every row.
+    """
+    clauses, params = [], []
+    for key, cond in query.items():
+        if key == "sessionId":
+            column = "sessionId"
+        elif _FIELD_RE.match(key):
+            column = f"json_extract(doc, '$.{key}')"
+        else:
+            continue
+        if not isinstance(cond, dict):
+            if cond is not None and not isinstance(cond, list):
+                clauses.append(f"{column} = ?")
+                params.append(cond)
+            continue
+        values = cond.get("$in")
+        if values is not None and None not in values:
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})" if values else "0")
+            params.extend(values)
+        for op, sql in _RANGE_OPS.items():
+            if cond.get(op) is not None:
+                clauses.append(f"{column} {sql} ?")
+                params.append(cond[op])
+    return " AND ".join(clauses) or "1", params
+
+
+class SQLiteCollection:
+    """A table of a SQLiteStore with the pymongo calls the app makes on it."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def find_one(self, query, projection=None):
+        return self.store.find_one(self.name, query, projection)
+
+    def update_one(self, query, update, upsert=False):
+        self.store.find_one_and_update(self.name, query, update, upsert=upsert)
+
+    def find_one_and_update(self, query, update, upsert=False, **kwargs):
+        return self.store.find_one_and_update(self.name, query, update, upsert=upsert)
+
+    def find(self, query, projection=None, batch_size=1000):
+        return self.store.find(self.name, query, projection, batch_size)
+
+
+class SQLiteLog:
+    """An append-only table of a SQLiteStore: any number of documents per session, in insertion order."""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def insert_many(self, documents, ordered=True):
+        self.store.append(self.name, documents)
+
+    def find(self, query, projection=None):
+        return self.store.find_appended(self.name, query, projection)
+
+
+class SQLiteStore:
+    """Durable per-session storage in one SQLite file, shared by every process on the box.
+
+    Each collection is a table of (sessionId PRIMARY KEY, doc JSON), so session
+    lookups are index seeks. The database runs in WAL mode, so readers never block
+    the writer or each other across processes. Connections come from a small pool
+    (rebuilt after a fork), and all SQL is fixed text with parameters, so each
+    connection's statement cache keeps it prepared.
+
+    Conditional updates run in BEGIN IMMEDIATE transactions, which take SQLite's
+    write lock first: the read, the match and the write are atomic across
+    processes, as MongoDB's find_one_and_update is.
+
+    Log collections (logs) are tables of (id, sessionId, doc) with any number of
+    rows per session; insert_many appends a whole batch in one transaction.
+    apply_writes commits a batch of the session journal, documents and events,
+    as one transaction too.
+    """
+
+    def __init__(self, path, collections, pool_size=8, busy_timeout_ms=5000, logs=()):
+        self.path = path
+        self.collections = tuple(collections)
+        self.logs = tuple(logs)
+        self.pool_size = pool_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._pool = None
+        self._pid = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self.connection() as conn:
+            for name in self.collections:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} ("
+                    "sessionId TEXT PRIMARY KEY, doc TEXT NOT NULL, updatedAt REAL NOT NULL)"
+                )
+                for field in INDEXED_FIELDS.get(name, ()):
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {name}_{field} ON {name} (json_extract(doc, '$.{field}'))"
+                    )
+            for index in RETIRED_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index}")
+            for name in self.logs:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, sessionId TEXT NOT NULL, doc TEXT NOT NULL)"
+                )
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_sessionId ON {name} (sessionId, id)")
+        for name in self.collections:
+            setattr(self, name, SQLiteCollection(self, name))
+        for name in self.logs:
+            setattr(self, name, SQLiteLog(self, name))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def _connect(self):
+        # Autocommit mode; transactions are opened explicitly where they are needed
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; a new one is opened when none is idle."""
+        if self._pid != os.getpid():
+            # Connections must not cross a fork: start the child with its own pool
+            self._pool = queue.LifoQueue(maxsize=self.pool_size)
+            self._pid = os.getpid()
+        pool = self._pool
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def find_one(self, name, query, projection=None):
+        session_id = query.get("sessionId")
+        with self.connection() as conn:
+            if session_id is not None:
+                rows = conn.execute(f"SELECT doc FROM {name} WHERE sessionId = ?", (session_id,))
+            else:
+                # Narrow in SQL (indexed where INDEXED_FIELDS says so), then apply the full query in Python
+                where, params = _where(query)
+                rows = conn.execute(f"SELECT doc FROM {name} WHERE {where}", params)
+            for (raw,) in rows:
+                doc = json.loads(raw)
+                if matches(doc, query):
+                    return project(doc, projection)
+        return None
+
+    def find(self, name, query, projection=None, batch_size=1000):
+        """Iterate over the documents of a collection that match query.
+
+        One statement reads the whole result, fetched batch_size rows at a time,
+        so memory stays bounded however many rows match; the rows come from the
+        snapshot the statement started on (WAL), and writers are never blocked.
+        """
+        where, params = _where(query)
+        session_id = query.get("sessionId")
+        if isinstance(session_id, dict) and "$in" in session_id:
+            # Each row is checked against the list: make that a set lookup
+            query = {**query, "sessionId": {**session_id, "$in": set(session_id["$in"])}}
+        with self.connection() as conn:
+            cursor = conn.execute(f"SELECT doc FROM {name} WHERE {where}", params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    for (raw,) in rows:
+                        doc = json.loads(raw)
+                        if matches(doc, query):
+                            yield project(doc, projection)
+            finally:
+                cursor.close()
+
+    def find_one_and_update(self, name, query, update, upsert=False):
+        """Apply $set / $push / $setOnInsert atomically if the document matches query.
+
+        Returns the document as it was before the update, or None if there was
+        none (inserted, with upsert) or it did not match.
+        """
+        session_id = query["sessionId"]
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(f"SELECT doc FROM {name} WHERE sessionId = ?", (session_id,)).fetchone()
+            doc = json.loads(row[0]) if row else None
+            if (doc is not None and not matches(doc, query)) or (doc is None and not upsert):
+                conn.execute("COMMIT")
+                return None
+
+            before = dict(doc) if doc is not None else None
+            if doc is None:
+                doc = {"sessionId": session_id, **update.get("$setOnInsert", {})}
+            apply_update(doc, update)
+            conn.execute(
+                f"INSERT INTO {name} (sessionId, doc, updatedAt) VALUES (?, ?, ?) "
+                "ON CONFLICT(sessionId) DO UPDATE SET doc = excluded.doc, updatedAt = excluded.updatedAt",
+                (session_id, json.dumps(doc), time.time())
+            )
+            conn.execute("COMMIT")
+            return before
+
+    def apply_writes(self, writes, log=None):
+        """Commit a journal batch (services.journal.Write) in one transaction.
+
+        Writes are applied in order: an unconditional one upserts its document, a
+        conditional one takes effect only if the document exists and matches its
+        query. The events of the writes that took effect are appended to the log
+        table in the same transaction, so the documents and the journal commit
+        together or not at all.
+        """
+        docs = {}  # (table, sessionId) -> the document as this transaction has it
+        changed = set()
+        results = []
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for write in writes:
+                if write.applied is not None:
+                    # Already applied; only its event is left to store
+                    results.append(write.applied)
+                    continue
+                key = (write.collection, write.session_id)
+                if key not in docs:
+                    row = conn.execute(
+                        f"SELECT doc FROM {write.collection} WHERE sessionId = ?", (write.session_id,)
+                    ).fetchone()
+                    docs[key] = json.loads(row[0]) if row else None
+                doc = docs[key]
+                if write.query is not None and (doc is None or not matches(doc, write.query)):
+                    results.append(False)
+                    continue
+                if doc is None:
+                    doc = docs[key] = {"sessionId": write.session_id}
+                apply_update(doc, write.update())
+                changed.add(key)
+                results.append(True)
+
+            now = time.time()
+            for name, session_id in changed:
+                conn.execute(
+                    f"INSERT INTO {name} (sessionId, doc, updatedAt) VALUES (?, ?, ?) "
+                    "ON CONFLICT(sessionId) DO UPDATE SET doc = excluded.doc, updatedAt = excluded.updatedAt",
+                    (session_id, json.dumps(docs[name, session_id]), now)
+                )
+            if log is not None:
+                conn.executemany(
+                    f"INSERT INTO {log} (sessionId, doc) VALUES (?, ?)",
+                    [(w.session_id, json.dumps(w.event)) for w, ok in zip(writes, results) if ok and not w.event_stored]
+                )
+            conn.execute("COMMIT")
+        for write, ok in zip(writes, results):
+            write.applied = ok
+            write.event_stored = write.event_stored or (ok and log is not None)
+
+    def append(self, name, documents):
+        """Append documents to a log table; the batch commits as one transaction."""
+        rows = [(doc["sessionId"], json.dumps(doc)) for doc in documents]
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(f"INSERT INTO {name} (sessionId, doc) VALUES (?, ?)", rows)
+            conn.execute("COMMIT")
+
+    def find_appended(self, name, query, projection=None):
+        """Rows of a log table for query's sessionId that match query, oldest first."""
+        with self.connection() as conn:
+            rows = conn.execute(f"SELECT doc FROM {name} WHERE sessionId = ? ORDER BY id", (query["sessionId"],))
+            docs = [json.loads(raw) for (raw,) in rows]
+        return [project(doc, projection) for doc in docs if matches(doc, query)]
+
+    def stats(self):
+        with self.connection() as conn:
+            sessions = conn.execute(f"SELECT COUNT(*) FROM {self.collections[0]}").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "sessions": sessions}
@@ -0,0 +1,222 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+log = logging.getLogger("loan_advisor")
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, event, the request id if any, and the event's fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        trace = _current_trace.get()
+        if trace is not None:
+            entry["requestId"] = trace.request_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging(level=None):
+    """Send the app's log events to stderr as JSON lines (once; later calls only set the level)."""
+    log.setLevel(level or os.getenv("LOG_LEVEL", "INFO").upper())
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        log.addHandler(handler)
+        log.propagate = False
+
+
+def log_event(event, level=logging.INFO, exc_info=False, **fields):
+    log.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+
+class Span:
+    """A timed step of a request; children are the steps it ran."""
+
+    __slots__ = ("name", "attrs", "start", "duration", "children", "error")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = None
+        self.children = []
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def flatten(self, origin, depth=0, out=None):
+        """The tree in pre-order as dicts, with times in ms from origin."""
+        out = [] if out is None else out
+        entry = {
+            "name": self.name,
+            "depth": depth,
+            "startMs": round((self.start - origin) * 1000, 3),
+            "durationMs": None if self.duration is None else round(self.duration * 1000, 3),
+            **self.attrs,
+        }
+        if self.error is not None:
+            entry["error"] = self.error
+        out.append(entry)
+        for child in self.children:
+            child.flatten(origin, depth + 1, out)
+        return out
+
+
+class _SpanScope:
+    """Context manager that opens a child of the current span."""
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, parent, name, attrs):
+        self.span = Span(name, attrs)
+        parent.children.append(self.span)
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration = time.perf_counter() - self.span.start
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        return False
+
+
+class _NoSpan:
+    """Stands in for a span outside any trace (background threads, scripts)."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **attrs):
+    """with span("name", key=value) as s: time a step under the current request's trace.
+
+    Costs one context variable lookup when no trace is active.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NO_SPAN
+    return _SpanScope(parent, name, attrs)
+
+
+class Trace:
+    """One request's span tree, plus its profiler when the request is being profiled."""
+
+    def __init__(self, request_id, name, attrs):
+        self.request_id = request_id
+        self.root = Span(name, attrs)
+        self.profiler = None
+        self.sampled = False
+        self._tokens = None
+
+
+class Tracer:
+    """Per-request tracing and profiling.
+
+    Every request gets a span tree, logged as one JSON "request" event when it
+    finishes (with the spans once it took at least spans_min_ms).
+
+    cProfile runs on a random profile_sample fraction of requests and, when
+    profile_slow_ms is set, on every request so that the slow ones can be kept;
+    either way a profile is written to profile_dir only if the request was sampled
+    or slower than profile_slow_ms, and only the newest profile_keep files stay.
+    Load one with pstats.Stats(path). Only one request per process is profiled at
+    a time (Python allows one active profiler from 3.12 on), so under concurrency
+    some requests go unprofiled.
+    """
+
+    def __init__(self, profile_sample=0.0, profile_slow_ms=0.0, profile_dir="profiles",
+                 profile_keep=200, spans_min_ms=0.0):
+        self.profile_sample = profile_sample
+        self.profile_slow_ms = profile_slow_ms
+        self.profile_dir = profile_dir
+        self.profile_keep = profile_keep
+        self.spans_min_ms = spans_min_ms
+        self._profile_lock = threading.Lock()
+
+    def start(self, request_id, name, **attrs):
+        trace = Trace(request_id, name, attrs)
+        trace.sampled = self.profile_sample > 0 and random.random() < self.profile_sample
+        if (trace.sampled or self.profile_slow_ms > 0) and self._profile_lock.acquire(blocking=False):
+            trace.profiler = cProfile.Profile()
+            trace.profiler.enable()
+        trace._tokens = (_current_trace.set(trace), _current_span.set(trace.root))
+        return trace
+
+    def finish(self, trace, **attrs):
+        """Close the trace, log it and keep its profile if it qualifies; returns the duration in ms."""
+        root = trace.root
+        root.duration = time.perf_counter() - root.start
+        root.set(**attrs)
+        if trace.profiler is not None:
+            trace.profiler.disable()
+            self._profile_lock.release()
+
+        duration_ms = root.duration * 1000
+        fields = {"name": root.name, "durationMs": round(duration_ms, 3), **root.attrs}
+        if trace.profiler is not None and (trace.sampled or (self.profile_slow_ms and duration_ms >= self.profile_slow_ms)):
+            fields["profile"] = self._dump(trace, duration_ms)
+        if duration_ms >= self.spans_min_ms:
+            fields["spans"] = [s for child in root.children for s in child.flatten(root.start)]
+        log_event("request", **fields)
+
+        current_trace, current_span = trace._tokens
+        _current_span.reset(current_span)
+        _current_trace.reset(current_trace)
+        return duration_ms
+
+    def _dump(self, trace, duration_ms):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", trace.root.name).strip("_") or "request"
+        path = os.path.join(
+            self.profile_dir,
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{slug}-{int(duration_ms)}ms-{trace.request_id}.prof"
+        )
+        trace.profiler.dump_stats(path)
+        self._prune()
+        return path
+
+    def _prune(self):
+        try:
+            names = sorted(n for n in os.listdir(self.profile_dir) if n.endswith(".prof"))
+        except FileNotFoundError:
+            return
+        # Names start with the timestamp, so the oldest sort first
+        for name in names[:max(0, len(names) - self.profile_keep)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except FileNotFoundError:
+                pass
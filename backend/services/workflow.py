@@ -0,0 +1,97 @@
+import operator
+import os
+import time
+
+# A claimed (in-progress) status older than this may be taken over, so a step
+# abandoned by a crashed worker does not leave the session stuck forever
+CLAIM_TIMEOUT_S = float(os.getenv("WORKFLOW_CLAIM_TIMEOUT", "120"))
+
+_COMPARISONS = {"$lt": operator.lt, "$lte": operator.le, "$gt": operator.gt, "$gte": operator.ge}
+
+
+def matches(doc, query):
+    """Evaluate the small subset of Mongo query syntax the workflow uses.
+
+    Supports field equality (a missing field equals None), $in, $lt, $lte, $gt,
+    $gte and $or, so the in-memory backends can apply the same guarded updates
+    and export filters as MongoDB.
+    """
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(cond, dict):
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+            for op, compare in _COMPARISONS.items():
+                if op in cond and (value is None or not compare(value, cond[op])):
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+class Workflow:
+    """Table-driven status machine with compare-and-set transitions.
+
+    transitions maps each status to the statuses it may move to. claims maps a
+    status whose agent is expensive or has side effects to the in-progress status
+    held while that agent runs. cas(session_id, query, fields) must $set fields on
+    the application in one atomic conditional update, only if the document still
+    matches query, and return whether it did. instrument(status, agent), if
+    given, returns a context manager that wraps every agent run (timing, tracing).
+    """
+
+    def __init__(self, transitions, claims, cas, instrument=None):
+        self.transitions = transitions
+        self.claims = claims
+        self.cas = cas
+        self.instrument = instrument
+
+    def advance(self, session_id, source, target, fields=None):
+        """Move source -> target; False if the session is no longer in source."""
+        if target not in self.transitions.get(source, ()):
+            raise ValueError(f"Invalid transition {source} -> {target}")
+        return self.cas(session_id, {"status": source}, {**(fields or {}), "status": target, "statusAt": time.time()})
+
+    def reset(self, session_id, source, target):
+        """Move a session out of a status the table does not know about."""
+        return self.cas(session_id, {"status": source}, {"status": target, "statusAt": time.time()})
+
+    def claim(self, session_id, status):
+        """Take the in-progress status for status's step; only one caller wins."""
+        claim = self.claims[status]
+        now = time.time()
+        query = {"$or": [
+            {"status": status},
+            {"status": claim, "statusAt": {"$lt": now - CLAIM_TIMEOUT_S}}
+        ]}
+        return self.cas(session_id, query, {"status": claim, "statusAt": now})
+
+    def is_claim(self, status):
+        return status in self.claims.values()
+
+    def run(self, session_id, status, agent, *args):
+        """Run status's agent, claiming the step first when the table says so.
+
+        Returns None without running the agent when another request holds the claim.
+        If the agent fails, the claim is released so the step can be retried.
+        """
+        if status not in self.claims:
+            return self._call(session_id, status, agent, args)
+
+        if not self.claim(session_id, status):
+            return None
+        try:
+            return self._call(session_id, status, agent, args)
+        except Exception:
+            self.cas(session_id, {"status": self.claims[status]}, {"status": status, "statusAt": time.time()})
+            raise
+
+    def _call(self, session_id, status, agent, args):
+        if self.instrument is None:
+            return agent(session_id, *args)
+        with self.instrument(status, agent):
+            return agent(session_id, *args)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the backend's modules (services, agents) as the app does, from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
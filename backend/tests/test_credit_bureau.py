@@ -0,0 +1,87 @@
+"""CreditScores: single-flight pulls, the TTL cache, and errors that are not cached."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.credit_bureau import CREDIT_SCORE_LOOKUPS, CreditScoreProvider, CreditScores, simulated_score
+
+
+class GatedBureau(CreditScoreProvider):
+    """Counts pulls and holds each one until released, so lookups pile up behind it."""
+
+    def __init__(self, fail=False):
+        self.pulls = 0
+        self.fail = fail
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def pull(self, applicant_id):
+        with self._lock:
+            self.pulls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            raise ConnectionError("bureau unavailable")
+        return simulated_score(applicant_id)
+
+
+def misses():
+    """Lookups so far that pulled or joined a pull, from the lookups counter."""
+    return sum(value for _, labels, value in CREDIT_SCORE_LOOKUPS.samples() if '"hit"' not in labels)
+
+
+def lookups(scores, callers, n):
+    """n concurrent scores.get("a1"), returned once every one of them holds the pull's future."""
+    before = misses()
+    results = [callers.submit(scores.get, "a1") for _ in range(n)]
+    deadline = time.monotonic() + 5
+    while misses() - before < n and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return results
+
+
+def test_concurrent_lookups_make_one_pull():
+    bureau = GatedBureau()
+    scores = CreditScores(bureau, workers=4)
+    with ThreadPoolExecutor(max_workers=16) as callers:
+        results = lookups(scores, callers, 16)
+        assert bureau.started.wait(5)
+        bureau.release.set()
+        values = [r.result(timeout=5) for r in results]
+
+    assert values == [simulated_score("a1")] * 16
+    assert bureau.pulls == 1
+    assert scores.get("a1") == simulated_score("a1")
+    assert bureau.pulls == 1
+    assert scores.stats()["inflight"] == 0
+
+
+def test_expired_score_is_pulled_again():
+    bureau = GatedBureau()
+    bureau.release.set()
+    scores = CreditScores(bureau, ttl_s=0)
+
+    scores.get("a1")
+    scores.get("a1")
+
+    assert bureau.pulls == 2
+
+
+def test_failed_pull_reaches_every_waiter_and_is_not_cached():
+    bureau = GatedBureau(fail=True)
+    scores = CreditScores(bureau)
+    with ThreadPoolExecutor(max_workers=4) as callers:
+        results = lookups(scores, callers, 4)
+        assert bureau.started.wait(5)
+        bureau.release.set()
+        for result in results:
+            with pytest.raises(ConnectionError):
+                result.result(timeout=5)
+
+    assert bureau.pulls == 1
+    bureau.fail = False
+    assert scores.get("a1") == simulated_score("a1")
+    assert bureau.pulls == 2
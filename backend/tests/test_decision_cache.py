@@ -0,0 +1,53 @@
+"""DecisionCache: results served only for the inputs they were computed from."""
+from services.decision_cache import DecisionCache, fingerprint
+
+INPUTS = {"income": 90000, "loan_amount": 300000, "tenure": 24}
+DECISION = {"approved": True, "confidence": 0.9}
+
+
+def test_hit_only_for_the_same_fingerprint():
+    cache = DecisionCache()
+    key = fingerprint(INPUTS, 760)
+    cache.put("s1", key, DECISION)
+
+    assert cache.get("s1", fingerprint(dict(reversed(list(INPUTS.items()))), 760)) == DECISION
+    assert cache.get("s1", fingerprint({**INPUTS, "income": 10000}, 760)) is None
+    assert cache.get("s1", fingerprint(INPUTS, 650)) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_returned_result_is_a_copy():
+    cache = DecisionCache()
+    key = fingerprint(INPUTS)
+    cache.put("s1", key, DECISION)
+
+    cache.get("s1", key)["sessionId"] = "s1"
+
+    assert cache.get("s1", key) == DECISION
+
+
+def test_invalidate_drops_the_session():
+    cache = DecisionCache()
+    key = fingerprint(INPUTS)
+    cache.put("s1", key, DECISION)
+
+    cache.invalidate("s1")
+    cache.invalidate("s1")
+
+    assert cache.get("s1", key) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_least_recently_used_session_goes_first():
+    cache = DecisionCache(max_entries=2)
+    key = fingerprint(INPUTS)
+    cache.put("s1", key, DECISION)
+    cache.put("s2", key, DECISION)
+    cache.get("s1", key)
+
+    cache.put("s3", key, DECISION)
+
+    assert cache.get("s2", key) is None
+    assert cache.get("s1", key) == DECISION
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,128 @@
+"""EventJournal over the in-memory store: durability modes, replay of unflushed writes, the pending overlay."""
+import importlib
+
+import pytest
+
+from services.journal import EventJournal, JournalError, Write, apply_writes
+from services.session_store import SessionStore
+
+COLLECTIONS = ("applications", "documents")
+
+
+@pytest.fixture
+def db():
+    return SessionStore(COLLECTIONS)
+
+
+@pytest.fixture
+def log():
+    return SessionStore((), logs=("events",))
+
+
+def journal(db, log, durability, **kwargs):
+    # A long flush interval: nothing is committed unless the test commits it
+    return EventJournal(lambda writes: apply_writes(db, writes), lambda: log.events,
+                        durability=durability, flush_interval_s=60, **kwargs)
+
+
+def stored(db, collection="applications"):
+    return db[collection].find_one({"sessionId": "s1"}, {"_id": 0})
+
+
+@pytest.fixture(scope="module")
+def with_pending(tmp_path_factory):
+    # The overlay is the app's; keep what importing it creates out of the tree
+    root = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("DOC_STORE_DIR", str(root / "documents"))
+        patch.setenv("TRACE_PROFILE_DIR", str(root / "profiles"))
+        patch.setenv("LETTER_CACHE_DIR", str(root / "letters"))
+        return importlib.import_module("app").with_pending
+
+
+def test_unflushed_async_write_is_replayed(db, log):
+    j = journal(db, log, "async")
+
+    assert j.write([Write("s1", "applications", {"income": 90000}, "application_saved")]) == [True]
+
+    assert stored(db) is None
+    assert [w.fields for w in j.pending("s1")] == [{"income": 90000}]
+    assert j.replay("s1") == {"applications": {"sessionId": "s1", "income": 90000}}
+
+    assert j.flush()
+    assert stored(db) == {"sessionId": "s1", "income": 90000}
+    assert j.pending("s1") == []
+    assert [e["type"] for e in log.events.find({"sessionId": "s1"})] == ["application_saved"]
+    assert j.replay("s1") == {"applications": {"sessionId": "s1", "income": 90000}}
+
+
+def test_sync_write_is_committed_on_return(db, log):
+    j = journal(db, log, "sync")
+
+    j.write([Write("s1", "documents", {"uploaded": True}, "document_uploaded", push={"files": ["a.pdf"]})])
+
+    assert stored(db, "documents") == {"sessionId": "s1", "uploaded": True, "files": ["a.pdf"]}
+    assert j.pending("s1") == []
+    assert len(list(log.events.find({"sessionId": "s1"}))) == 1
+
+
+def test_conditional_write_is_waited_for_in_async_mode(db, log):
+    j = journal(db, log, "async")
+    db.applications.update_one({"sessionId": "s1"}, {"$set": {"status": "sales"}}, upsert=True)
+
+    assert j.write([Write("s1", "applications", {"status": "scoring"}, "claimed", query={"status": "underwriting"})]) == [False]
+    assert j.write([Write("s1", "applications", {"status": "verification"}, "advanced", query={"status": "sales"})]) == [True]
+
+    assert stored(db)["status"] == "verification"
+    assert [e["type"] for e in j.events("s1")] == ["advanced"]
+
+
+def test_failed_commit_raises_for_a_waiting_caller(log):
+    def apply(writes):
+        raise ConnectionError("storage down")
+
+    j = EventJournal(apply, lambda: log.events, durability="sync", flush_interval_s=60)
+    with pytest.raises(JournalError):
+        j.write([Write("s1", "applications", {"income": 1}, "application_saved")])
+
+
+def test_durability_off_and_unknown_modes(db, log):
+    assert not journal(db, log, "off").enabled
+    assert journal(db, log, "off").events("s1") == []
+    with pytest.raises(ValueError):
+        journal(db, log, "eventually")
+
+
+def test_busy_session_is_committed_by_its_read(db, log):
+    j = journal(db, log, "async", session_backlog=3)
+    for i in range(3):
+        j.write([Write("s1", "applications", {"step": i}, "step")])
+
+    assert j.pending("s1") == []
+    assert stored(db) == {"sessionId": "s1", "step": 2}
+
+
+def test_overlay_keeps_a_write_committed_during_the_read(db, log, with_pending):
+    j = journal(db, log, "async")
+    j.write([Write("s1", "applications", {"income": 90000}, "application_saved")])
+    pending = j.pending("s1")
+    read = {"applications": stored(db)}
+    # Committed after storage was read, before the overlay
+    assert j.flush()
+
+    docs = with_pending(read, pending, {})
+
+    assert docs["applications"] == {"sessionId": "s1", "income": 90000}
+
+
+def test_overlay_does_not_push_a_committed_value_twice(db, log, with_pending):
+    j = journal(db, log, "async")
+    j.write([Write("s1", "documents", {"uploaded": True}, "document_uploaded", push={"files": [{"digest": "d1"}]})])
+    pending = j.pending("s1")
+    # Committed before storage was read
+    assert j.flush()
+    read = {"documents": stored(db, "documents")}
+
+    docs = with_pending(read, pending, {})
+
+    assert docs["documents"]["files"] == [{"digest": "d1"}]
@@ -0,0 +1,32 @@
+"""services.mongo.db: local without MONGO_URI, refusing use while a configured MongoDB connects."""
+import os
+
+import mongomock
+import pytest
+
+from services import mongo
+from services.mongo_setup import MongoConnector
+
+
+@pytest.fixture
+def configured(monkeypatch):
+    connector = MongoConnector("mongodb://mongo.invalid:27017")
+    # As if this process had started connecting: start() is then a no-op
+    connector._pid = os.getpid()
+    monkeypatch.setattr(mongo, "connector", connector)
+    return connector
+
+
+def test_without_mongo_uri_the_local_store_is_used(monkeypatch):
+    monkeypatch.setattr(mongo, "connector", MongoConnector(""))
+    mongo.db.applications.update_one({"sessionId": "local"}, {"$set": {"income": 1}}, upsert=True)
+    assert mongo.db.applications.find_one({"sessionId": "local"}, {"_id": 0}) == {"sessionId": "local", "income": 1}
+
+
+def test_writes_are_refused_until_connected(configured):
+    with pytest.raises(mongo.MongoNotReady):
+        mongo.db.applications.update_one({"sessionId": "s1"}, {"$set": {"income": 1}}, upsert=True)
+
+    configured.database = mongomock.MongoClient().ai_loan_advisor
+    mongo.db.applications.update_one({"sessionId": "s1"}, {"$set": {"income": 1}}, upsert=True)
+    assert configured.database.applications.find_one({"sessionId": "s1"})["income"] == 1
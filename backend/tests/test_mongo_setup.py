@@ -0,0 +1,83 @@
+"""ensure_indexes and the projected reads, against mongomock (no mongod needed)."""
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from services.export import JOINED, joined_batches
+from services.mongo_setup import INDEXES, ensure_indexes
+from services.session_store import project
+
+DOCUMENTS = {
+    "sessionId": "s1",
+    "uploaded": True,
+    "files": [{"filename": "slip.pdf", "digest": "d1"}],
+    "inspections": {"d1": {"kind": "salary_slip"}},
+    "inspectionText": {"d1": "net pay"},
+}
+
+
+@pytest.fixture
+def database():
+    return mongomock.MongoClient().ai_loan_advisor
+
+
+def all_index_names():
+    return [f"{collection}.{options['name']}" for collection, indexes in INDEXES.items() for _, options in indexes]
+
+
+def test_ensure_indexes_twice_leaves_one_of_each(database):
+    assert ensure_indexes(database) == all_index_names()
+    assert ensure_indexes(database) == all_index_names()
+
+    for collection, indexes in INDEXES.items():
+        info = database[collection].index_information()
+        assert set(info) == {"_id_"} | {options["name"] for _, options in indexes}
+        for keys, options in indexes:
+            assert info[options["name"]]["key"] == keys
+            assert info[options["name"]].get("unique", False) == options.get("unique", False)
+
+
+def test_unique_session_index_rejects_a_second_document(database):
+    ensure_indexes(database)
+    database.applications.insert_one({"sessionId": "s1"})
+    with pytest.raises(DuplicateKeyError):
+        database.applications.insert_one({"sessionId": "s1"})
+
+
+def test_index_over_duplicates_is_skipped(database):
+    database.documents.insert_many([{"sessionId": "s1"}, {"sessionId": "s1"}])
+
+    ensured = ensure_indexes(database)
+
+    assert "documents.sessionId_unique" not in ensured
+    assert ensured == [name for name in all_index_names() if name != "documents.sessionId_unique"]
+
+
+def test_export_join_projects_away_text_and_decision_snapshot(database):
+    ensure_indexes(database)
+    database.applications.insert_one({"sessionId": "s1", "status": "completed", "statusAt": 100.0})
+    database.documents.insert_one(dict(DOCUMENTS))
+    database.sanctions.insert_one({"sessionId": "s1", "pdfId": "p1", "decision": {"approved": True}})
+
+    rows = [row for batch in joined_batches(database, {"status": {"$in": ["completed"]}}) for row in batch]
+
+    assert rows == [{
+        "sessionId": "s1",
+        "application": {"sessionId": "s1", "status": "completed", "statusAt": 100.0},
+        "documents": {k: v for k, v in DOCUMENTS.items() if k != "inspectionText"},
+        "decision": {},
+        "sanction": {"sessionId": "s1", "pdfId": "p1"},
+    }]
+
+
+@pytest.mark.parametrize("projection", [
+    *(projection for _, projection in JOINED.values()),
+    {"_id": 0, "uploaded": 1},
+    {"_id": 0, "sessionId": 1, "files": 1, "missing": 1},
+    None,
+])
+def test_local_stores_project_as_mongodb_does(database, projection):
+    database.documents.insert_one(dict(DOCUMENTS))
+    found = database.documents.find_one({"sessionId": "s1"}, projection)
+    found.pop("_id", None)
+    assert project(DOCUMENTS, projection) == found
@@ -0,0 +1,26 @@
+"""offer_grid: every offered amount passes the underwriting EMI check, at any rate."""
+import pytest
+
+from services.offers import AMOUNT_STEP, EMI_RATIOS, amortized_emi, offer_grid
+
+
+@pytest.mark.parametrize("income", [100000, 90000, 35000, 12345])
+@pytest.mark.parametrize("annual_rate", [0.0, 0.12])
+def test_offers_stay_strictly_under_the_emi_share(income, annual_rate):
+    for row in offer_grid(income, annual_rate)["offers"]:
+        for route, ratio in EMI_RATIOS.items():
+            amount = row[route]["maxAmount"]
+            # As underwriting computes it: the flat loan / tenure over income
+            assert amount / row["tenure"] / income < ratio
+            assert row[route]["emi"] / income < ratio
+            # One step more would not pass
+            assert float(amortized_emi(amount + AMOUNT_STEP, row["tenure"], annual_rate)) / income >= ratio
+
+
+def test_zero_rate_exact_fit_is_one_step_less():
+    # 0.3 * 100000 * 6 months = 180000 exactly: that EMI would equal the cap
+    offer = offer_grid(100000, 0.0)["offers"][0]
+
+    assert offer["tenure"] == 6
+    assert offer["instant"]["maxAmount"] == 180000 - AMOUNT_STEP
+    assert offer["instant"]["totalInterest"] == 0
@@ -0,0 +1,62 @@
+"""SessionStore: per-stripe LRU eviction, idle expiry and its counters, and writes under the stripe locks."""
+import threading
+import time
+
+from services.session_store import SessionStore
+
+
+def touch(store, session_id):
+    store.applications.update_one({"sessionId": session_id}, {"$set": {"seen": True}}, upsert=True)
+
+
+def test_least_recently_used_session_is_evicted_whole():
+    store = SessionStore(("applications", "documents"), max_sessions=2, stripes=1)
+    touch(store, "s1")
+    store.documents.update_one({"sessionId": "s1"}, {"$set": {"uploaded": True}}, upsert=True)
+    touch(store, "s2")
+    assert store.applications.find_one({"sessionId": "s1"})  # s1 is now the most recently used
+
+    touch(store, "s3")
+
+    assert store.applications.find_one({"sessionId": "s2"}) is None
+    assert store.documents.find_one({"sessionId": "s1"}) == {"sessionId": "s1", "uploaded": True}
+    stats = store.stats()
+    assert (stats["sessions"], stats["evictions"], stats["expirations"]) == (2, 1, 0)
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_each_stripe_holds_its_share():
+    store = SessionStore(("applications",), max_sessions=8, stripes=4)
+    for i in range(100):
+        touch(store, f"s{i}")
+
+    stats = store.stats()
+    assert stats["sessions"] <= 8
+    assert stats["evictions"] == 100 - stats["sessions"]
+
+
+def test_idle_session_expires():
+    store = SessionStore(("applications",), ttl_s=0.05, stripes=1)
+    touch(store, "s1")
+    time.sleep(0.1)
+
+    assert store.applications.find_one({"sessionId": "s1"}) is None
+    assert store.stats()["expirations"] == 1
+
+
+def test_concurrent_pushes_to_one_session_all_land():
+    store = SessionStore(("documents",), stripes=4)
+    barrier = threading.Barrier(8)
+
+    def writer(k):
+        barrier.wait()
+        for i in range(100):
+            store.documents.update_one({"sessionId": "s1"}, {"$push": {"files": f"{k}-{i}"}}, upsert=True)
+
+    threads = [threading.Thread(target=writer, args=(k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store.documents.find_one({"sessionId": "s1"})["files"]) == 800
@@ -0,0 +1,68 @@
+"""SQLiteStore.apply_writes: one transaction per journal batch, documents and events together."""
+import pytest
+
+from services.journal import Write
+from services.sqlite_store import SQLiteStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / "sessions.db"), ("applications", "documents"), logs=("events",))
+    store.applications.update_one({"sessionId": "s1"}, {"$set": {"status": "sales"}}, upsert=True)
+    return store
+
+
+def write(session_id, collection, fields, query=None, push=None):
+    w = Write(session_id, collection, fields, "test", query=query, push=push)
+    w.event = {"sessionId": session_id, "eventId": f"{session_id}-{collection}-{sorted(fields)}"}
+    return w
+
+
+def event_ids(store, session_id):
+    return [e["eventId"] for e in store.events.find({"sessionId": session_id}, {"_id": 0})]
+
+
+def test_failed_conditional_write_leaves_the_rest_of_the_batch(store):
+    writes = [
+        write("s1", "applications", {"income": 90000}),
+        write("s1", "applications", {"status": "sanction"}, query={"status": "underwriting"}),
+        write("s1", "documents", {"uploaded": True}, push={"files": [{"digest": "d1"}]}),
+        write("s2", "applications", {"status": "sales"}),
+    ]
+
+    store.apply_writes(writes, log="events")
+
+    assert [w.applied for w in writes] == [True, False, True, True]
+    assert [w.event_stored for w in writes] == [True, False, True, True]
+    assert store.applications.find_one({"sessionId": "s1"}, {"_id": 0}) == {
+        "sessionId": "s1", "status": "sales", "income": 90000}
+    assert store.documents.find_one({"sessionId": "s1"}, {"_id": 0}) == {
+        "sessionId": "s1", "uploaded": True, "files": [{"digest": "d1"}]}
+    assert event_ids(store, "s1") == [writes[0].event["eventId"], writes[2].event["eventId"]]
+    assert event_ids(store, "s2") == [writes[3].event["eventId"]]
+
+
+def test_conditional_write_sees_earlier_writes_of_its_batch(store):
+    writes = [
+        write("s1", "applications", {"status": "underwriting"}),
+        write("s1", "applications", {"status": "scoring"}, query={"status": "underwriting"}),
+        write("s3", "applications", {"status": "scoring"}, query={"status": "underwriting"}),
+    ]
+
+    store.apply_writes(writes, log="events")
+
+    assert [w.applied for w in writes] == [True, True, False]
+    assert store.applications.find_one({"sessionId": "s1"})["status"] == "scoring"
+    # A conditional write never creates the document
+    assert store.applications.find_one({"sessionId": "s3"}) is None
+
+
+def test_applied_writes_only_store_their_events(store):
+    done = write("s1", "applications", {"income": 1})
+    done.applied = True
+
+    store.apply_writes([done], log="events")
+
+    assert done.event_stored
+    assert "income" not in store.applications.find_one({"sessionId": "s1"})
+    assert event_ids(store, "s1") == [done.event["eventId"]]
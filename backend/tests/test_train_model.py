@@ -0,0 +1,51 @@
+"""train() over CSV chunks: label-sorted input is refused before it can build a broken forest."""
+import csv
+
+import numpy as np
+import pytest
+
+from ml.train_model import FEATURES, LABEL, csv_chunks, train
+from services.forest import CompiledForest
+
+ROWS = 300
+CHUNK_ROWS = 100
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([*FEATURES, LABEL])
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def decisions():
+    rng = np.random.default_rng(0)
+    income = rng.random(ROWS) * 100000
+    loan = rng.random(ROWS) * 500000
+    tenure = (rng.random(ROWS) * 60 + 6).astype(int)
+    approved = (loan / tenure < 0.4 * income).astype(int)
+    return [(float(a), float(b), int(c), int(d)) for a, b, c, d in zip(income, loan, tenure, approved)]
+
+
+def train_csv(path):
+    return train(csv_chunks(path, CHUNK_ROWS), ROWS // CHUNK_ROWS, trees=6, jobs=1, holdout=0.2,
+                 seed=42, min_samples_leaf=1, max_depth=None)
+
+
+def test_label_sorted_csv_fails_on_the_single_class_chunk(tmp_path, decisions):
+    path = write_csv(tmp_path / "sorted.csv", sorted(decisions, key=lambda row: row[3]))
+
+    with pytest.raises(ValueError, match=r"Chunk \d/3 has approved=\[\d\] only"):
+        train_csv(path)
+
+
+def test_shuffled_csv_trains_a_two_class_forest(tmp_path, decisions):
+    path = write_csv(tmp_path / "shuffled.csv", decisions)
+
+    model, X_eval, y_eval, timings = train_csv(path)
+
+    assert model.n_estimators == 6
+    assert timings["trainRows"] + len(X_eval) == ROWS
+    assert CompiledForest(model).predict_proba(X_eval).shape == (len(X_eval), 2)
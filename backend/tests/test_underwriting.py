@@ -0,0 +1,28 @@
+"""score_and_decide_batch: the same fields as score_and_decide, row for row."""
+import numpy as np
+
+from agents import underwriting
+
+ROWS = [
+    {"income": 90000, "loan_amount": 300000, "tenure": 24},
+    {"income": 10000, "loan_amount": 300000, "tenure": 12},
+]
+
+
+def test_model_scored_rows_carry_the_model_version(monkeypatch):
+    monkeypatch.setattr(underwriting, "score_approval", lambda X, shadow=False: (np.array([0.9, 0.1]), "v7"))
+
+    results = underwriting.score_and_decide_batch(ROWS)
+
+    assert [r["model_version"] for r in results] == ["v7", "v7"]
+    assert [r["approved"] for r in results] == [True, False]
+    assert results[0]["reason"] == "Model-based underwriting"
+
+
+def test_fallback_rows_have_no_model_version(monkeypatch):
+    monkeypatch.setattr(underwriting, "score_approval", lambda X, shadow=False: (None, None))
+
+    results = underwriting.score_and_decide_batch(ROWS)
+
+    assert all("model_version" not in r for r in results)
+    assert [r["approved"] for r in results] == [True, False]
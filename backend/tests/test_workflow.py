@@ -0,0 +1,92 @@
+"""Workflow claims: compare-and-set over the in-memory store, raced from several threads."""
+import threading
+import time
+
+import pytest
+
+from services import workflow as workflow_module
+from services.session_store import SessionStore
+from services.workflow import Workflow
+
+TRANSITIONS = {"underwriting": ("sanction",), "scoring": ("sanction",)}
+CLAIMS = {"underwriting": "scoring"}
+
+
+@pytest.fixture
+def store():
+    store = SessionStore(("applications",))
+    store.applications.update_one({"sessionId": "s1"}, {"$set": {"status": "underwriting", "statusAt": 0}}, upsert=True)
+    return store
+
+
+@pytest.fixture
+def workflow(store):
+    def cas(session_id, query, fields):
+        return store.applications.find_one_and_update({"sessionId": session_id, **query}, {"$set": fields}) is not None
+    return Workflow(TRANSITIONS, CLAIMS, cas)
+
+
+def status(store):
+    return store.applications.find_one({"sessionId": "s1"})["status"]
+
+
+def test_two_claimants_one_winner(workflow, store):
+    barrier = threading.Barrier(2)
+    won = []
+
+    def claimant():
+        barrier.wait()
+        won.append(workflow.claim("s1", "underwriting"))
+
+    threads = [threading.Thread(target=claimant) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(won) == [False, True]
+    assert status(store) == "scoring"
+
+
+def test_agent_runs_once_for_concurrent_requests(workflow):
+    entered = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def agent(session_id):
+        calls.append(session_id)
+        entered.set()
+        release.wait(5)
+        return "done"
+
+    first = []
+    thread = threading.Thread(target=lambda: first.append(workflow.run("s1", "underwriting", agent)))
+    thread.start()
+    assert entered.wait(5)
+    # The step is claimed: a second request does not run the agent again
+    assert workflow.run("s1", "underwriting", agent) is None
+    release.set()
+    thread.join()
+
+    assert first == ["done"]
+    assert calls == ["s1"]
+
+
+def test_stale_claim_is_taken_over(workflow, store, monkeypatch):
+    monkeypatch.setattr(workflow_module, "CLAIM_TIMEOUT_S", 60)
+    store.applications.update_one({"sessionId": "s1"}, {"$set": {"status": "scoring", "statusAt": time.time()}})
+    assert not workflow.claim("s1", "underwriting")
+
+    store.applications.update_one({"sessionId": "s1"}, {"$set": {"statusAt": time.time() - 61}})
+    assert workflow.claim("s1", "underwriting")
+    assert store.applications.find_one({"sessionId": "s1"})["statusAt"] > time.time() - 5
+
+
+def test_failed_agent_releases_the_claim(workflow, store):
+    def agent(session_id):
+        raise RuntimeError("bureau down")
+
+    with pytest.raises(RuntimeError):
+        workflow.run("s1", "underwriting", agent)
+    assert status(store) == "underwriting"
+    assert workflow.claim("s1", "underwriting")